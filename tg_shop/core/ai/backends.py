@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class BaseAnswerBackend:
+    """
+    Генератор ответов на вопросы покупателей.
+
+    Получает контекст товара (см. core.ai.context.build_product_context) и пачку
+    вопросов по нему, возвращает тексты ответов в том же порядке. Один вызов
+    на товар — чтобы LLM-бэкенд мог отправить общий контекст товара один раз.
+    """
+
+    def generate_answers(self, context, questions):
+        raise NotImplementedError
+
+
+class OpenAIAnswerBackend(BaseAnswerBackend):
+    """
+    Ответы через OpenAI Chat Completions. Требует пакет `openai` и OPENAI_API_KEY.
+    """
+
+    system_prompt = (
+        "Ты — вежливый менеджер интернет-магазина. Отвечай кратко и только по фактам о товаре. "
+        "Если информации недостаточно, скажи, что менеджер уточнит."
+    )
+
+    def __init__(self):
+        try:
+            from openai import OpenAI
+        except ImportError:
+            raise ImproperlyConfigured("Для OpenAIAnswerBackend установите пакет openai")
+        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.model = settings.AI_ANSWER_MODEL
+
+    def product_prompt(self, context):
+        lines = [
+            f"Товар: {context['title']}",
+            f"Описание: {context['description']}",
+            f"Характеристики: {context['specifications']}",
+        ]
+        if context['marketplaces']:
+            lines.append(f"Продаётся на: {', '.join(context['marketplaces'])}")
+        for item in context['qa']:
+            lines.append(f"Вопрос: {item['question']}\nОтвет: {item['answer']}")
+        return "\n".join(lines)
+
+    def generate_answers(self, context, questions):
+        prompt = self.product_prompt(context)
+        answers = []
+        for question in questions:
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {'role': 'system', 'content': self.system_prompt},
+                    {'role': 'system', 'content': prompt},
+                    {'role': 'user', 'content': question.text},
+                ],
+            )
+            answers.append(completion.choices[0].message.content.strip())
+        return answers
+
+
+def get_answer_backend():
+    # Бэкенда по умолчанию нет: ответы воркера уходят покупателям на маркетплейсы
+    if not settings.AI_ANSWER_BACKEND:
+        raise ImproperlyConfigured("Задайте AI_ANSWER_BACKEND, например core.ai.backends.OpenAIAnswerBackend")
+    return import_string(settings.AI_ANSWER_BACKEND)()
@@ -0,0 +1,113 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Product, ProductQuestionMessage, QuestionAnswer
+
+# Меняется при изменении структуры контекста — старые записи кэша просто перестают читаться
+CONTEXT_VERSION = 2
+
+# Роли, ответы которых считаются проверенными и попадают в контекст
+ANSWER_ROLES = ('manager', 'owner')
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+# Контекст лежит в общем кэше (CACHES['default']): сброс по сигналу в веб-процессе
+# сразу виден воркерам run_ai_workers, иначе они отвечали бы по устаревшему товару
+def _cache_key(product_id):
+    return f"ai:product-context:v{CONTEXT_VERSION}:{product_id}"
+
+
+def _count(hits=0, misses=0):
+    with _stats_lock:
+        _stats['hits'] += hits
+        _stats['misses'] += misses
+
+
+def context_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def _truncate(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def build_product_context(product):
+    """
+    Компактный контекст товара для промпта: описание, характеристики,
+    маркетплейсы, подписи к фото и последние проверенные ответы.
+    """
+    text_limit = settings.PRODUCT_CONTEXT_TEXT_LIMIT
+    qa_limit = settings.PRODUCT_CONTEXT_QA_LIMIT
+
+    qa = [
+        (question, answer)
+        for question, answer in ProductQuestionMessage.objects
+        .filter(question__product=product, role__in=ANSWER_ROLES)
+        .order_by('-sent_at')
+        .values_list('question__text', 'text')[:qa_limit]
+    ]
+    if len(qa) < qa_limit:
+        qa += list(
+            QuestionAnswer.objects
+            .filter(question__product=product, role__in=ANSWER_ROLES)
+            .order_by('-sent_at')
+            .values_list('question__text', 'text')[:qa_limit - len(qa)]
+        )
+
+    return {
+        'version': CONTEXT_VERSION,
+        'product_id': product.pk,
+        'store_id': product.store_id,
+        'title': product.title,
+        'description': _truncate(product.description, text_limit),
+        'specifications': product.specifications,
+        'marketplaces': [marketplace.name for marketplace in product.marketplaces.all()],
+        'images': [image.caption for image in product.images.all() if image.caption],
+        'qa': [
+            {'question': _truncate(question, 500), 'answer': _truncate(answer, 1000)}
+            for question, answer in qa
+        ],
+    }
+
+
+def get_product_contexts(product_ids):
+    """
+    Контексты для нескольких товаров: один запрос к кэшу на всю пачку,
+    в БД идём только за отсутствующими.
+    """
+    keys = {_cache_key(product_id): product_id for product_id in product_ids}
+    cached = cache.get_many(keys.keys())
+    contexts = {keys[key]: value for key, value in cached.items()}
+
+    missing = [product_id for product_id in keys.values() if product_id not in contexts]
+    _count(hits=len(contexts), misses=len(missing))
+    if missing:
+        built = {}
+        for product in Product.objects.filter(pk__in=missing).prefetch_related('marketplaces', 'images'):
+            built[product.pk] = build_product_context(product)
+        cache.set_many(
+            {_cache_key(product_id): context for product_id, context in built.items()},
+            timeout=settings.PRODUCT_CONTEXT_TTL,
+        )
+        contexts.update(built)
+    return contexts
+
+
+def get_product_context(product_id):
+    return get_product_contexts([product_id]).get(product_id)
+
+
+def invalidate_product_context(product_id):
+    cache.delete(_cache_key(product_id))
+
+
+def invalidate_product_contexts(product_ids):
+    if product_ids:
+        cache.delete_many([_cache_key(product_id) for product_id in product_ids])
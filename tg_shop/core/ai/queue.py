@@ -0,0 +1,32 @@
+from core.models import AIAnswerJob, ProductQuestion
+
+
+def enqueue_questions(questions):
+    """
+    Поставить вопросы в очередь ИИ-ответов.
+    questions — пары (question_id, product_id); повторная постановка игнорируется.
+    """
+    AIAnswerJob.objects.bulk_create(
+        [AIAnswerJob(question_id=question_id, product_id=product_id) for question_id, product_id in questions],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_unanswered(batch_size=1000):
+    """Поставить в очередь все нерешённые вопросы, для которых ещё нет задачи."""
+    queued = 0
+    batch = []
+    questions = (
+        ProductQuestion.objects
+        .filter(is_resolved=False, ai_job__isnull=True)
+        .values_list('id', 'product_id')
+        .iterator(chunk_size=batch_size)
+    )
+    for pair in questions:
+        batch.append(pair)
+        if len(batch) >= batch_size:
+            enqueue_questions(batch)
+            queued += len(batch)
+            batch = []
+    enqueue_questions(batch)
+    return queued + len(batch)
@@ -0,0 +1,232 @@
+import re
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import OuterRef, Subquery, Q
+
+from core.models import AnsweredQuestionSignature, ProductQuestion, ProductQuestionMessage, QuestionAnswer
+from .context import ANSWER_ROLES
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r'\w+')
+
+
+def _permutations(num_perm, seed=1):
+    # Параметры фиксированы сидом: сигнатуры, посчитанные в разных процессах, сравнимы
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+_PERM_A, _PERM_B = _permutations(settings.SIMILARITY_NUM_PERM)
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+def shingles(text):
+    """Символьные 3-граммы и отдельные слова: устойчиво к словоформам («размер» / «размера»)."""
+    text = normalize(text)
+    if not text:
+        # Пустой или только из знаков препинания текст ни на что не похож
+        return set()
+    grams = {text[i:i + 3] for i in range(max(len(text) - 2, 1))}
+    grams.update(text.split())
+    return grams
+
+
+def minhash(text):
+    hashes = np.fromiter(
+        (zlib.crc32(gram.encode()) for gram in shingles(text)), dtype=np.uint64,
+    )
+    if not len(hashes):
+        return np.full(len(_PERM_A), _MAX_HASH, dtype=np.uint32)
+    # (a·x + b) mod p для всех перестановок сразу, затем минимум по шинглам
+    permuted = np.bitwise_and((np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME, _MAX_HASH)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+class StoreIndex:
+    """
+    Сигнатуры отвеченных вопросов одного магазина в виде матрицы uint32 (n × num_perm).
+    Поиск — векторное сравнение сигнатур (оценка коэффициента Жаккара), без LLM и БД.
+    """
+
+    def __init__(self, store_id):
+        self.store_id = store_id
+        self.num_perm = len(_PERM_A)
+        self.signatures = np.empty((0, self.num_perm), dtype=np.uint32)
+        self.question_ids = np.empty(0, dtype=np.int64)
+        self.answers = []
+        self.rows = {}
+        self.size = 0
+        self.loaded_until = None
+        self.refreshed_at = 0.0
+        self.reloaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def _grow(self):
+        capacity = max(64, len(self.question_ids) * 2)
+        signatures = np.empty((capacity, self.num_perm), dtype=np.uint32)
+        signatures[:self.size] = self.signatures[:self.size]
+        question_ids = np.empty(capacity, dtype=np.int64)
+        question_ids[:self.size] = self.question_ids[:self.size]
+        self.signatures, self.question_ids = signatures, question_ids
+
+    def add(self, question_id, signature, answer):
+        with self.lock:
+            row = self.rows.get(question_id)
+            if row is None:
+                if self.size == len(self.question_ids):
+                    self._grow()
+                row = self.size
+                self.size += 1
+                self.rows[question_id] = row
+                self.answers.append(answer)
+                self.question_ids[row] = question_id
+            else:
+                self.answers[row] = answer
+            self.signatures[row] = signature
+
+    def refresh(self):
+        """
+        Догрузить строки, изменённые после предыдущей загрузки (в т.ч. другими процессами).
+
+        Раз в SIMILARITY_INDEX_RELOAD секунд индекс загружается заново: иначе в нём остались бы
+        строки, удалённые rebuild_index другого процесса или каскадом вместе с вопросом.
+        """
+        now = time.monotonic()
+        full = self.loaded_until is None or now - self.reloaded_at >= settings.SIMILARITY_INDEX_RELOAD
+        rows = AnsweredQuestionSignature.objects.filter(store_id=self.store_id)
+        if full:
+            target, loaded_until = StoreIndex(self.store_id), None
+        else:
+            # updated_at ставится до коммита: транзакция, закоммиченная после загрузки более
+            # новой строки, получает метку раньше loaded_until — окно перечитывается с запасом
+            target, loaded_until = self, self.loaded_until
+            rows = rows.filter(updated_at__gte=loaded_until - timedelta(seconds=settings.SIMILARITY_INDEX_LAG))
+        for question_id, signature, answer, updated_at in rows.order_by('updated_at').values_list(
+            'question_id', 'signature', 'answer', 'updated_at',
+        ).iterator(chunk_size=2000):
+            target.add(question_id, np.frombuffer(bytes(signature), dtype=np.uint32), answer)
+            loaded_until = updated_at if loaded_until is None else max(loaded_until, updated_at)
+        if full:
+            with self.lock:
+                self.signatures, self.question_ids = target.signatures, target.question_ids
+                self.answers, self.rows, self.size = target.answers, target.rows, target.size
+            self.reloaded_at = now
+        self.loaded_until = loaded_until
+        self.refreshed_at = now
+
+    def search(self, signature, exclude_question_id=None):
+        """Лучшее совпадение: (question_id, answer, score) или None."""
+        with self.lock:
+            if not self.size:
+                return None
+            scores = (self.signatures[:self.size] == signature).mean(axis=1)
+            if exclude_question_id in self.rows:
+                scores[self.rows[exclude_question_id]] = -1.0
+            best = int(scores.argmax())
+            return int(self.question_ids[best]), self.answers[best], float(scores[best])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(store_id):
+    with _indexes_lock:
+        index = _indexes.get(store_id)
+        if index is None:
+            index = _indexes[store_id] = StoreIndex(store_id)
+    if time.monotonic() - index.refreshed_at >= settings.SIMILARITY_INDEX_REFRESH:
+        index.refresh()
+    return index
+
+
+def suggest_answer(store_id, text, exclude_question_id=None, threshold=None):
+    """
+    Готовый ответ на похожий вопрос того же магазина, если сходство не ниже порога.
+    Возвращает {'answer', 'score', 'question_id'} или None.
+
+    Только подсказка сотруднику, не ответ покупателю: индекс общий для всех товаров
+    магазина, а MinHash не видит отрицания («Он водонепроницаемый?» и «Он не
+    водонепроницаемый?» — сходство 0.75).
+    """
+    threshold = settings.SIMILARITY_THRESHOLD if threshold is None else threshold
+    if not shingles(text):
+        return None
+    match = get_index(store_id).search(minhash(text), exclude_question_id=exclude_question_id)
+    if match is None or match[2] < threshold:
+        return None
+    question_id, answer, score = match
+    return {'answer': answer, 'score': round(score, 3), 'question_id': question_id}
+
+
+def remember_answer(question, answer):
+    """Добавить отвеченный вопрос в индекс (БД + индекс текущего процесса)."""
+    store_id = ProductQuestion.objects.filter(pk=question.pk).values_list('product__store_id', flat=True).first()
+    if store_id is None or not shingles(question.text):
+        return
+    signature = minhash(question.text)
+    AnsweredQuestionSignature.objects.update_or_create(
+        question_id=question.pk,
+        defaults={'store_id': store_id, 'signature': signature.tobytes(), 'answer': answer},
+    )
+    index = _indexes.get(store_id)
+    if index is not None:
+        index.add(question.pk, signature, answer)
+
+
+def _latest_answers(store_id=None):
+    """Последний ответ сотрудника на каждый вопрос: сообщения, затем QuestionAnswer."""
+    messages = ProductQuestionMessage.objects.filter(question=OuterRef('pk'), role__in=ANSWER_ROLES)
+    answers = QuestionAnswer.objects.filter(question=OuterRef('pk'), role__in=ANSWER_ROLES)
+    questions = ProductQuestion.objects.annotate(
+        message_answer=Subquery(messages.order_by('-sent_at').values('text')[:1]),
+        legacy_answer=Subquery(answers.order_by('-sent_at').values('text')[:1]),
+    ).filter(Q(message_answer__isnull=False) | Q(legacy_answer__isnull=False))
+    if store_id is not None:
+        questions = questions.filter(product__store_id=store_id)
+    return questions.values_list('id', 'product__store_id', 'text', 'message_answer', 'legacy_answer')
+
+
+def rebuild_index(store_id=None, batch_size=1000):
+    """Полностью пересчитать сигнатуры (всех магазинов или одного). Возвращает число вопросов."""
+    stale = AnsweredQuestionSignature.objects.all()
+    if store_id is not None:
+        stale = stale.filter(store_id=store_id)
+    stale.delete()
+
+    total = 0
+    batch = []
+    for question_id, question_store_id, text, message_answer, legacy_answer in _latest_answers(store_id).iterator(
+        chunk_size=batch_size,
+    ):
+        if not shingles(text):
+            continue
+        batch.append(AnsweredQuestionSignature(
+            question_id=question_id,
+            store_id=question_store_id,
+            signature=minhash(text).tobytes(),
+            answer=message_answer or legacy_answer,
+        ))
+        if len(batch) >= batch_size:
+            AnsweredQuestionSignature.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+            batch = []
+    AnsweredQuestionSignature.objects.bulk_create(batch, ignore_conflicts=True)
+
+    with _indexes_lock:
+        if store_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(store_id, None)
+    return total + len(batch)
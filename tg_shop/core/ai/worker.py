@@ -0,0 +1,204 @@
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import AIAnswerJob, ProductQuestion, ProductQuestionMessage
+from .backends import get_answer_backend
+from .context import get_product_contexts, context_stats
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('claim', 'load', 'generate', 'write')
+
+
+class WorkerStats:
+    """Счётчики пропускной способности и суммарное время по стадиям."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.jobs = 0
+        self.answers = 0
+        self.failed = 0
+        self.batches = 0
+        self.stage_time = defaultdict(float)
+
+    def add(self, stage, seconds):
+        self.stage_time[stage] += seconds
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'jobs': self.jobs,
+            'answers': self.answers,
+            'failed': self.failed,
+            'batches': self.batches,
+            'elapsed_s': round(elapsed, 3),
+            'jobs_per_s': round(self.jobs / elapsed, 2) if elapsed else 0.0,
+            'context_cache': context_stats(),
+            # средняя задержка стадии на одну пачку задач
+            'stage_ms': {
+                stage: round(1000 * self.stage_time[stage] / self.batches, 2) if self.batches else 0.0
+                for stage in STAGES
+            },
+        }
+
+
+class _timer:
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.stats.add(self.stage, time.perf_counter() - self.start)
+
+
+def retry_delay(attempts):
+    return min(settings.AI_JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.AI_JOB_MAX_BACKOFF)
+
+
+class AnswerWorker:
+    """
+    Воркер очереди AIAnswerJob.
+
+    Забирает пачку задач через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    несколько процессов работают с одной таблицей без блокировок друг друга.
+    Задачи, зависшие в статусе running дольше AI_JOB_LOCK_TIMEOUT, забираются повторно,
+    пока не исчерпано AI_JOB_MAX_ATTEMPTS попыток. После ошибки бэкенда задача повторяется
+    не раньше next_attempt_at (экспоненциальная пауза, как у outbox доставки ответов) —
+    сбой бэкенда не сжигает все попытки за секунды.
+    """
+
+    def __init__(self, backend=None, batch_size=None, worker_id=None):
+        self.backend = backend or get_answer_backend()
+        self.batch_size = batch_size or settings.AI_JOB_BATCH_SIZE
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.stats = WorkerStats()
+
+    def claim(self):
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.AI_JOB_LOCK_TIMEOUT)
+        abandoned = Q(status=AIAnswerJob.Status.RUNNING, locked_at__lt=stale)
+        with transaction.atomic():
+            # Брошенная задача, исчерпавшая попытки, не забирается снова, а проваливается:
+            # иначе вопрос, роняющий воркер, перезапускался бы бесконечно
+            AIAnswerJob.objects.filter(abandoned, attempts__gte=settings.AI_JOB_MAX_ATTEMPTS).update(
+                status=AIAnswerJob.Status.FAILED, error='Превышено время выполнения', finished_at=now,
+            )
+            jobs = list(
+                AIAnswerJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(Q(status=AIAnswerJob.Status.PENDING, next_attempt_at__lte=now) |
+                        abandoned & Q(attempts__lt=settings.AI_JOB_MAX_ATTEMPTS))
+                .order_by('created_at')[:self.batch_size]
+            )
+            if jobs:
+                AIAnswerJob.objects.filter(id__in=[job.id for job in jobs]).update(
+                    status=AIAnswerJob.Status.RUNNING,
+                    locked_by=self.worker_id,
+                    locked_at=now,
+                    attempts=F('attempts') + 1,
+                )
+        return jobs
+
+    def run_once(self):
+        """Обработать одну пачку. Возвращает число обработанных задач."""
+        with _timer(self.stats, 'claim'):
+            jobs = self.claim()
+        if not jobs:
+            return 0
+
+        with _timer(self.stats, 'load'):
+            questions = ProductQuestion.objects.in_bulk([job.question_id for job in jobs])
+            by_product = defaultdict(list)
+            done = []
+            for job in jobs:
+                question = questions.get(job.question_id)
+                # На вопрос уже ответил человек — генерировать нечего
+                if question is None or question.is_resolved:
+                    done.append(job.id)
+                    continue
+                by_product[question.product_id].append((job, question))
+            # Контекст всех товаров пачки — одним обращением к кэшу
+            contexts = get_product_contexts(list(by_product))
+
+        for product_id, items in by_product.items():
+            context = contexts[product_id]
+            try:
+                with _timer(self.stats, 'generate'):
+                    answers = self.backend.generate_answers(context, [question for _, question in items])
+                if len(answers) != len(items):
+                    # zip() молча обрезал бы пачку и сопоставил ответы не тем вопросам
+                    raise ValueError(f"Бэкенд вернул {len(answers)} ответов на {len(items)} вопросов")
+                with _timer(self.stats, 'write'):
+                    self.write_answers(items, answers)
+            except Exception as exc:
+                logger.exception("AI backend failed for product %s", product_id)
+                self.fail([job for job, _ in items], exc)
+
+        self.finish(done)
+        self.stats.batches += 1
+        self.stats.jobs += len(jobs)
+        return len(jobs)
+
+    def write_answers(self, items, answers):
+        messages = [
+            ProductQuestionMessage(
+                question=question,
+                sender=None,
+                role='ai',
+                text=answer,
+                marketplace_id=question.marketplace_id,
+            )
+            for (_, question), answer in zip(items, answers)
+        ]
+        # Ответы и статус задач — одной транзакцией, чтобы после падения не ответить дважды
+        with transaction.atomic():
+            ProductQuestionMessage.objects.bulk_create(messages)
+            self.finish([job.id for job, _ in items])
+        self.stats.answers += len(messages)
+        return messages
+
+    def finish(self, job_ids):
+        AIAnswerJob.objects.filter(id__in=job_ids).update(
+            status=AIAnswerJob.Status.DONE, finished_at=timezone.now(), error='',
+        )
+
+    def fail(self, jobs, exc):
+        now = timezone.now()
+        # job.attempts — значение до claim(), текущая попытка на единицу больше
+        retry = defaultdict(list)
+        for job in jobs:
+            if job.attempts + 1 < settings.AI_JOB_MAX_ATTEMPTS:
+                retry[retry_delay(job.attempts + 1)].append(job.id)
+        dead = [job.id for job in jobs if job.attempts + 1 >= settings.AI_JOB_MAX_ATTEMPTS]
+        for delay, job_ids in retry.items():
+            AIAnswerJob.objects.filter(id__in=job_ids).update(
+                status=AIAnswerJob.Status.PENDING, error=repr(exc), next_attempt_at=now + timedelta(seconds=delay),
+            )
+        AIAnswerJob.objects.filter(id__in=dead).update(
+            status=AIAnswerJob.Status.FAILED, error=repr(exc), finished_at=now,
+        )
+        self.stats.failed += len(dead)
+
+    def run(self, poll_interval=1.0, stop_when_empty=False, report_every=30.0):
+        last_report = time.monotonic()
+        while True:
+            processed = self.run_once()
+            if time.monotonic() - last_report >= report_every:
+                logger.info("AI worker %s: %s", self.worker_id, self.stats.as_dict())
+                last_report = time.monotonic()
+            if not processed:
+                if stop_when_empty:
+                    return self.stats
+                time.sleep(poll_interval)
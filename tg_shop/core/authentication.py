@@ -0,0 +1,72 @@
+"""
+Аутентификация интеграций магазина по заголовку X-API-KEY (StoreAPIKey).
+
+Ключ ищется по sha256 — сравнения с секретом в открытом виде нет. Результат (магазин или
+«ключ неизвестен/отозван») хранится в процессном LRU-кэше: на горячем пути аутентификация
+не ходит в БД. Отзыв сбрасывает кэш своего процесса сразу (core/signals.py), остальных —
+не позже чем через API_KEY_CACHE_TTL секунд.
+"""
+import hmac
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import StoreAPIKey
+from .utils.cache import TTLCache
+from .utils.crypto import hash_api_key
+
+# request.auth запроса с ключом магазина
+StoreKey = namedtuple('StoreKey', 'id store_id')
+
+# sha256(ключ) → StoreKey или None
+api_key_cache = TTLCache(maxsize=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL)
+
+
+def _load_api_key(key_hash):
+    row = (
+        StoreAPIKey.objects
+        .filter(key_hash=key_hash, revoked_at__isnull=True)
+        .values_list('id', 'store_id')
+        .first()
+    )
+    return StoreKey(*row) if row else None
+
+
+def resolve_api_key(raw_key):
+    key_hash = hash_api_key(raw_key)
+    return api_key_cache.get_or_set(key_hash, lambda: _load_api_key(key_hash))
+
+
+def invalidate_api_key(key_hash):
+    api_key_cache.delete(key_hash)
+
+
+def request_store_key(request):
+    """StoreKey, если запрос аутентифицирован ключом магазина, иначе None."""
+    auth = getattr(request, 'auth', None)
+    return auth if isinstance(auth, StoreKey) else None
+
+
+def is_api_secret(value):
+    """Общий EXTERNAL_API_SECRET; сравнение за постоянное время, без заданного секрета — всегда False."""
+    secret = settings.EXTERNAL_API_SECRET
+    return bool(secret and value) and hmac.compare_digest(value.encode(), secret.encode())
+
+
+class StoreAPIKeyAuthentication(BaseAuthentication):
+    """
+    X-API-KEY → request.auth = StoreKey, request.user — анонимный: ключ даёт доступ
+    только к эндпоинтам интеграций, а не права владельца магазина.
+    """
+
+    def authenticate(self, request):
+        raw_key = request.headers.get('X-API-KEY')
+        if not raw_key:
+            return None
+        key = resolve_api_key(raw_key)
+        if key is None:
+            raise AuthenticationFailed('Неверный или отозванный API-ключ')
+        return AnonymousUser(), key
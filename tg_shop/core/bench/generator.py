@@ -0,0 +1,216 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from core.images.storage import original_key, rendition_key
+from core.models import (
+    Store, CustomUser, Marketplace, Product, ProductImage, ProductQuestion, ProductQuestionMessage,
+)
+
+MARKETPLACES = ('ozon', 'wildberries', 'yandex_market')
+COLORS = ('черный', 'белый', 'красный', 'синий', 'зеленый')
+SIZES = ('XS', 'S', 'M', 'L', 'XL')
+QUESTION_TEMPLATES = (
+    'Какой размер у {title}?',
+    'Подойдет ли {title} для подарка?',
+    'Есть ли {title} в цвете {color}?',
+    'Какой вес у {title}?',
+    'Когда будет доставка {title}?',
+    'Из какого материала сделан {title}?',
+)
+
+
+class SyntheticDataGenerator:
+    """
+    Наполняет БД синтетическими магазинами, товарами (со specifications и фото),
+    вопросами и переписками. Масштаб задаётся примерным общим числом строк.
+
+    Данные пишутся через bulk_create пачками: post_save-сигналы не срабатывают,
+    поэтому очередь ИИ-ответов и индекс похожих вопросов не заполняются.
+    """
+
+    def __init__(self, rows=10_000, messages_per_question=3, chunk_size=5000, seed=0):
+        self.messages_per_question = messages_per_question
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        # Уникальный префикс: повторный запуск на той же БД не конфликтует по username/external_id
+        self.run_id = uuid.uuid4().hex[:8]
+
+        # на вопрос приходится сообщений + ~0.2 строки товаров, фото и покупателей
+        self.questions = max(int(rows / (messages_per_question + 1.2)), 10)
+        self.stores = max(self.questions // 10_000, 1)
+        self.products = max(self.questions // 20, self.stores)
+        self.customers = max(self.questions // 10, 1)
+
+        self.counts = {}
+        self.fixtures = {}
+
+    def generate(self):
+        started = time.perf_counter()
+        marketplaces = self.ensure_marketplaces()
+        stores, owners, managers = self.create_stores()
+        products = self.create_products(stores, owners, marketplaces)
+        customers = self.create_customers()
+        self.create_questions(products, customers, managers, marketplaces)
+        elapsed = time.perf_counter() - started
+
+        # Сценарии работают с первым («горячим») магазином
+        hot_store = stores[0]
+        hot_products = [product_id for product_id, store_id in products if store_id == hot_store.pk]
+        self.fixtures = {
+            'store': hot_store,
+            'owner': owners[0],
+            'manager': managers[0],
+            'product_ids': hot_products,
+            'marketplaces': [marketplace.name for marketplace in marketplaces],
+            'external_ids': [external_id for _, external_id in customers[:1000]],
+            'question_ids': list(
+                ProductQuestion.objects.filter(product__store=hot_store).values_list('id', flat=True)[:1000]
+            ),
+        }
+        total = sum(self.counts.values())
+        return {
+            'rows': self.counts,
+            'total_rows': total,
+            'seconds': round(elapsed, 2),
+            'rows_per_s': round(total / elapsed, 1) if elapsed else None,
+        }
+
+    def _bulk_create(self, model, objects, **kwargs):
+        created = []
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.chunk_size:
+                created.extend(model.objects.bulk_create(batch, **kwargs))
+                batch = []
+        if batch:
+            created.extend(model.objects.bulk_create(batch, **kwargs))
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(created)
+        return created
+
+    def ensure_marketplaces(self):
+        return [Marketplace.objects.get_or_create(name=name)[0] for name in MARKETPLACES]
+
+    def create_stores(self):
+        password = make_password(None)
+        owners = self._bulk_create(CustomUser, (
+            CustomUser(username=f'bench_{self.run_id}_owner_{i}', password=password, role='owner')
+            for i in range(self.stores)
+        ))
+        stores = self._bulk_create(Store, (
+            Store(name=f'Магазин {i}', store_code=f'bench-{self.run_id}-{i}', owner=owner)
+            for i, owner in enumerate(owners)
+        ))
+        managers = self._bulk_create(CustomUser, (
+            CustomUser(username=f'bench_{self.run_id}_manager_{i}', password=password, role='manager', store=store)
+            for i, store in enumerate(stores)
+        ))
+        return stores, owners, managers
+
+    def specifications(self, i):
+        return {
+            'color': self.random.choice(COLORS),
+            'size': self.random.choice(SIZES),
+            'weight': round(self.random.uniform(0.1, 25), 2),
+            'price': self.random.randint(100, 100_000),
+            'article': f'A-{i:08d}',
+        }
+
+    def create_products(self, stores, owners, marketplaces):
+        products = []
+        through = Product.marketplaces.through
+        for start in range(0, self.products, self.chunk_size):
+            with transaction.atomic():
+                chunk = self._bulk_create(Product, (
+                    Product(
+                        store=stores[i % len(stores)],
+                        created_by=owners[i % len(owners)],
+                        title=f'Товар {i}',
+                        description=f'Описание товара {i}. ' * self.random.randint(1, 10),
+                        specifications=self.specifications(i),
+                    )
+                    for i in range(start, min(start + self.chunk_size, self.products))
+                ))
+                self._bulk_create(through, (
+                    through(product_id=product.pk, marketplace_id=marketplace.pk)
+                    for product in chunk
+                    for marketplace in self.random.sample(marketplaces, self.random.randint(1, len(marketplaces)))
+                ))
+                # Файлы не загружаются — в БД только ключи, как после обработки run_image_workers
+                self._bulk_create(ProductImage, (self.image(product) for product in chunk))
+            products.extend((product.pk, product.store_id) for product in chunk)
+        return products
+
+    def image(self, product):
+        content_hash = f'{self.run_id}{product.pk:056d}'
+        return ProductImage(
+            product=product,
+            image=original_key(content_hash, '.jpg'),
+            caption=f'Фото {product.title}',
+            content_hash=content_hash,
+            width=1600,
+            height=1200,
+            status=ProductImage.Status.READY,
+            renditions={
+                image_format: {str(width): rendition_key(content_hash, width, image_format) for width in (320, 640, 1280)}
+                for image_format in ('avif', 'webp')
+            },
+        )
+
+    def create_customers(self):
+        password = make_password(None)
+        customers = []
+        for start in range(0, self.customers, self.chunk_size):
+            chunk = self._bulk_create(CustomUser, (
+                CustomUser(
+                    username=f'bench_{self.run_id}_user_{i}',
+                    password=password,
+                    role='user',
+                    external_id=f'bench-{self.run_id}-{i}',
+                )
+                for i in range(start, min(start + self.chunk_size, self.customers))
+            ))
+            customers.extend((user.pk, user.external_id) for user in chunk)
+        return customers
+
+    def create_questions(self, products, customers, managers, marketplaces):
+        managers_by_store = {manager.store_id: manager.pk for manager in managers}
+        for start in range(0, self.questions, self.chunk_size):
+            with transaction.atomic():
+                questions = self._bulk_create(ProductQuestion, (
+                    self.question(i, products, customers, marketplaces)
+                    for i in range(start, min(start + self.chunk_size, self.questions))
+                ))
+                self._bulk_create(ProductQuestionMessage, (
+                    message
+                    for question in questions
+                    for message in self.thread(question, managers_by_store)
+                ))
+
+    def question(self, i, products, customers, marketplaces):
+        product_id, store_id = self.random.choice(products)
+        question = ProductQuestion(
+            product_id=product_id,
+            user_id=self.random.choice(customers)[0],
+            text=self.random.choice(QUESTION_TEMPLATES).format(title=f'товар {product_id}',
+                                                               color=self.random.choice(COLORS)),
+            marketplace=self.random.choice(marketplaces),
+            is_resolved=self.random.random() < 0.9,
+        )
+        question.store_id = store_id
+        return question
+
+    def thread(self, question, managers_by_store):
+        for n in range(self.messages_per_question):
+            staff = n % 2 == 1
+            yield ProductQuestionMessage(
+                question_id=question.pk,
+                sender_id=managers_by_store[question.store_id] if staff else question.user_id,
+                role='manager' if staff else 'user',
+                text=f'Ответ на вопрос {question.pk}' if staff else question.text,
+                marketplace_id=question.marketplace_id,
+            )
@@ -0,0 +1,188 @@
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .utils import percentile
+
+HOST = '127.0.0.1'
+
+
+class HttpScenario:
+    """Запрос к настоящему серверу: (method, path, headers, body) для i-го обращения."""
+
+    name = None
+
+    def __init__(self, fixtures, secret):
+        self.fixtures = fixtures
+        self.secret = secret
+
+    def request(self, i):
+        raise NotImplementedError
+
+    def pick(self, values, i):
+        return values[i % len(values)]
+
+
+class IngestSingleHttpScenario(HttpScenario):
+    name = 'ingest_single'
+
+    def request(self, i):
+        body = json.dumps({
+            'external_id': self.pick(self.fixtures['external_ids'], i),
+            'product': self.pick(self.fixtures['product_ids'], i),
+            'text': f'Вопрос из бенчмарка {i}',
+            'marketplace': self.pick(self.fixtures['marketplaces'], i),
+        }).encode()
+        headers = {'Content-Type': 'application/json', 'X-API-SECRET': self.secret}
+        return 'POST', '/api/external/questions/', headers, body
+
+
+class ConversationHttpScenario(HttpScenario):
+    name = 'conversation'
+
+    def __init__(self, fixtures, secret):
+        super().__init__(fixtures, secret)
+        self.headers = {'Authorization': f"Bearer {AccessToken.for_user(fixtures['manager'])}"}
+
+    def request(self, i):
+        query = urlencode({'external_id': self.pick(self.fixtures['external_ids'], i)})
+        return 'GET', f'/api/conversations/?{query}', self.headers, b''
+
+
+HTTP_SCENARIOS = {scenario.name: scenario for scenario in (IngestSingleHttpScenario, ConversationHttpScenario)}
+
+
+def server_command(server, port, workers, threads):
+    """WSGI — gunicorn с потоками (gthread), ASGI — uvicorn; одинаковое число процессов."""
+    if server == 'wsgi':
+        return [
+            sys.executable, '-m', 'gunicorn', 'tg_shop.wsgi:application', '--bind', f'{HOST}:{port}',
+            '--workers', str(workers), '--worker-class', 'gthread', '--threads', str(threads),
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'tg_shop.asgi:application', '--host', HOST, '--port', str(port),
+        '--workers', str(workers), '--no-access-log', '--log-level', 'warning',
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def running_server(server, env, workers, threads, timeout=30):
+    port = free_port()
+    process = subprocess.Popen(
+        server_command(server, port, workers, threads), cwd=settings.BASE_DIR,
+        env={**os.environ, **env, 'ASYNC_VIEWS': '1' if server == 'asgi' else '0'},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{server}: сервер завершился с кодом {process.returncode}")
+            try:
+                socket.create_connection((HOST, port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{server}: сервер не запустился за {timeout} с")
+                time.sleep(0.2)
+        yield port
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def _read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length, chunked, close = 0, False, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding':
+            chunked = value == 'chunked'
+        elif name == 'connection':
+            close = value == 'close'
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status, close
+
+
+async def _client(port, scenario, counter, total, timings, errors):
+    """Одно keep-alive соединение: запросы подряд, пока не исчерпан общий счётчик."""
+    reader = writer = None
+    while (i := next(counter)) < total:
+        if writer is None:
+            reader, writer = await asyncio.open_connection(HOST, port)
+        method, path, headers, body = scenario.request(i)
+        head = [f'{method} {path} HTTP/1.1', f'Host: {HOST}', f'Content-Length: {len(body)}']
+        head += [f'{name}: {value}' for name, value in headers.items()]
+        started = time.perf_counter()
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+        status, close = await _read_response(reader)
+        timings.append((time.perf_counter() - started) * 1000)
+        if status >= 400:
+            errors[status] = errors.get(status, 0) + 1
+        if close:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port, scenario, requests, concurrency, warmup=0):
+    """requests запросов через concurrency параллельных соединений; прогрев не попадает в статистику."""
+    if warmup:
+        await asyncio.gather(*(
+            _client(port, scenario, counter, warmup, [], {})
+            for counter in [itertools.count()] for _ in range(min(concurrency, warmup))
+        ))
+
+    counter = itertools.count(warmup)
+    timings, errors = [], {}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _client(port, scenario, counter, warmup + requests, timings, errors) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'requests_per_s': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(timings[-1], 3),
+    }
@@ -0,0 +1,218 @@
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .utils import percentile
+
+
+class Scenario:
+    """
+    Сценарий нагрузки: один HTTP-запрос к реальному view через тестовый клиент DRF.
+    rows() — сколько строк обработал запрос (для rows/s).
+    """
+
+    name = None
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        self.client = APIClient()
+
+    def request(self, i):
+        raise NotImplementedError
+
+    def rows(self, response):
+        data = response.json()
+        if isinstance(data, dict):
+            data = data.get('results', [data])
+        return len(data)
+
+    def pick(self, values, i):
+        return values[i % len(values)]
+
+
+class IngestSingleScenario(Scenario):
+    name = 'ingest_single'
+
+    def request(self, i):
+        return self.client.post('/api/external/questions/', {
+            'external_id': self.pick(self.fixtures['external_ids'], i),
+            'product': self.pick(self.fixtures['product_ids'], i),
+            'text': f'Вопрос из бенчмарка {i}',
+            'marketplace': self.pick(self.fixtures['marketplaces'], i),
+        }, format='json', HTTP_X_API_SECRET=settings.EXTERNAL_API_SECRET)
+
+    def rows(self, response):
+        return 1
+
+
+class IngestBatchScenario(Scenario):
+    name = 'ingest_batch'
+    batch_size = 100
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        # ID вопросов маркетплейса уникальны в пределах прогона — каждый запрос создаёт новые строки
+        self.prefix = uuid.uuid4().hex[:8]
+
+    def request(self, i):
+        items = [
+            {
+                'external_id': self.pick(self.fixtures['external_ids'], i * self.batch_size + n),
+                'product': self.pick(self.fixtures['product_ids'], i * self.batch_size + n),
+                'text': f'Вопрос из бенчмарка {i}-{n}',
+                'marketplace': self.pick(self.fixtures['marketplaces'], n),
+                'question_id': f'bench-{self.prefix}-{i}-{n}',
+            }
+            for n in range(self.batch_size)
+        ]
+        return self.client.post('/api/external/questions/batch/', items, format='json',
+                                HTTP_X_API_SECRET=settings.EXTERNAL_API_SECRET)
+
+    def rows(self, response):
+        data = response.json()
+        return data['created'] + data['duplicates']
+
+
+class ConversationScenario(Scenario):
+    name = 'conversation'
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        self.client.force_authenticate(fixtures['manager'])
+
+    def request(self, i):
+        return self.client.get('/api/conversations/', {'external_id': self.pick(self.fixtures['external_ids'], i)})
+
+
+class ShopUsersScenario(Scenario):
+    name = 'shop_users'
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        self.client.force_authenticate(fixtures['owner'])
+
+    def request(self, i):
+        return self.client.get('/api/shop_users/')
+
+
+class ProductListScenario(Scenario):
+    name = 'product_list'
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        self.client.force_authenticate(fixtures['owner'])
+
+    def request(self, i):
+        return self.client.get('/api/products/')
+
+
+class ProductCreateScenario(Scenario):
+    name = 'product_create'
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        self.client.force_authenticate(fixtures['owner'])
+
+    def request(self, i):
+        return self.client.post('/api/products/', {
+            'title': f'Новый товар {i}',
+            'description': 'Товар, созданный бенчмарком',
+            'specifications': json.dumps({'color': 'черный', 'weight': i % 25}),
+            'marketplaces': self.fixtures['marketplaces'][:2],
+        }, format='multipart')
+
+    def rows(self, response):
+        return 1
+
+
+class MessagePostScenario(Scenario):
+    name = 'message_post'
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        self.client.force_authenticate(fixtures['manager'])
+
+    def request(self, i):
+        return self.client.post('/api/messages/', {
+            'question': self.pick(self.fixtures['question_ids'], i),
+            'text': f'Ответ менеджера {i}',
+        }, format='json')
+
+    def rows(self, response):
+        return 1
+
+
+class SearchScenario(Scenario):
+    name = 'search'
+    # частые слова (совпадает большая доля вопросов), редкие и название товара
+    queries = ('размер', 'доставка', 'материала', 'подарок -размер', 'товар 12', 'черный')
+
+    def __init__(self, fixtures):
+        super().__init__(fixtures)
+        self.client.force_authenticate(fixtures['owner'])
+
+    def request(self, i):
+        return self.client.get('/api/search/', {'q': self.pick(self.queries, i)})
+
+    def rows(self, response):
+        return sum(len(results) for results in response.json().values())
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        IngestSingleScenario,
+        IngestBatchScenario,
+        ConversationScenario,
+        ShopUsersScenario,
+        ProductListScenario,
+        ProductCreateScenario,
+        MessagePostScenario,
+        SearchScenario,
+    )
+}
+
+
+def run_scenario(scenario, requests=200, warmup=10):
+    """
+    Прогнать сценарий: задержка каждого запроса, число SQL-запросов и обработанных строк.
+    Прогрев не попадает в статистику.
+    """
+    for i in range(warmup):
+        scenario.request(i)
+
+    timings = []
+    queries = []
+    rows = 0
+    errors = {}
+    for i in range(warmup, warmup + requests):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = scenario.request(i)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+        if response.status_code >= 400:
+            errors[response.status_code] = errors.get(response.status_code, 0) + 1
+        else:
+            rows += scenario.rows(response)
+
+    total_s = sum(timings) / 1000
+    timings.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(timings[-1], 3),
+        'mean_ms': round(1000 * total_s / requests, 3),
+        'queries_per_request': round(sum(queries) / requests, 2),
+        'max_queries': max(queries),
+        'rows': rows,
+        'rows_per_s': round(rows / total_s, 1) if total_s else None,
+    }
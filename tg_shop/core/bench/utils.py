@@ -0,0 +1,37 @@
+import subprocess
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def bench_database(keepdb=False, use_current_db=False):
+    """
+    Отдельная БД test_<NAME> на время бенчмарка, чтобы синтетические данные
+    и пересоздание индексов не затрагивали рабочую базу.
+    """
+    if use_current_db:
+        yield
+        return
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,157 @@
+"""
+Маршрутизация чтения на реплику и состояние соединений с БД (режимы — DB_CONNECTION_MODE в settings).
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+
+_use_replica = ContextVar('db_use_replica', default=False)
+_replica_state = TTLCache(maxsize=1, ttl=settings.DB_REPLICA_CHECK_INTERVAL)
+
+
+@contextmanager
+def reading_from_replica(enabled=True):
+    """Чтение ORM внутри блока идёт на реплику (если она настроена и доступна)."""
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_available():
+    """Недоступная реплика не проверяется чаще раза в DB_REPLICA_CHECK_INTERVAL — чтение идёт в default."""
+    if REPLICA not in settings.DATABASES:
+        return False
+    return _replica_state.get_or_set('available', _probe_replica)
+
+
+def _probe_replica():
+    try:
+        connections[REPLICA].ensure_connection()
+    except DatabaseError:
+        logger.warning("Реплика БД недоступна, чтение идёт в default", exc_info=True)
+        return False
+    return True
+
+
+class ReplicaRouter:
+    """
+    Чтение — с реплики, но только внутри reading_from_replica() (ReplicaMiddleware включает его
+    для GET/HEAD к DB_REPLICA_URL_NAMES): в остальных местах код может читать только что
+    записанное, а реплика отстаёт. Запись и миграции — только default.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_available():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика — копия default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+# ── проверка и метрики соединений ──────────
+
+def pool_stats(alias):
+    """Статистика пула psycopg (None без DB_CONNECTION_MODE=pool)."""
+    pool = connections[alias].pool
+    return pool.get_stats() if pool is not None else None
+
+
+def check_database(alias):
+    started = time.perf_counter()
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except DatabaseError as exc:
+        return {'ok': False, 'error': exc.__class__.__name__}
+    result = {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 3)}
+    stats = pool_stats(alias)
+    if stats is not None:
+        result['pool'] = {key: stats.get(key, 0) for key in ('pool_size', 'pool_available', 'requests_waiting')}
+    return result
+
+
+_pool_counters = {}
+
+
+def db_latency(alias='default'):
+    """
+    Задержка БД для адаптивного ограничения запросов, мс: SELECT 1 плюс, в режиме pool,
+    среднее ожидание соединения из пула с прошлого замера. None — БД недоступна.
+    """
+    result = check_database(alias)
+    if not result['ok']:
+        return None
+    latency = result['latency_ms']
+    stats = pool_stats(alias)
+    if stats is not None:
+        counters = (stats.get('requests_num', 0), stats.get('requests_wait_ms', 0))
+        previous = _pool_counters.get(alias, counters)
+        _pool_counters[alias] = counters
+        requests = counters[0] - previous[0]
+        if requests > 0:
+            latency += (counters[1] - previous[1]) / requests
+    return latency
+
+
+# Счётчики psycopg_pool накапливаются с момента создания пула
+POOL_GAUGES = {
+    'pool_min': 'Минимальный размер пула',
+    'pool_max': 'Максимальный размер пула',
+    'pool_size': 'Открытых соединений в пуле',
+    'pool_available': 'Свободных соединений в пуле',
+    'requests_waiting': 'Запросов ждут свободное соединение',
+}
+POOL_COUNTERS = {
+    'requests_num': 'Выдач соединений из пула',
+    'requests_queued': 'Выдач, которым пришлось ждать',
+    'requests_wait_ms': 'Суммарное ожидание соединения, мс',
+    'requests_errors': 'Не дождались соединения (таймаут)',
+    'connections_num': 'Открыто соединений с БД',
+    'connections_ms': 'Суммарное время открытия соединений, мс',
+    'connections_errors': 'Ошибок открытия соединений',
+    'connections_lost': 'Соединений потеряно (проверка при выдаче)',
+}
+
+
+def render_pool_metrics(prefix='tgshop'):
+    """
+    Пулы всех БД в формате Prometheus. saturation — доля занятых соединений от максимума:
+    около 1 при requests_waiting > 0 — пулу не хватает соединений.
+    """
+    lines = []
+    stats = {alias: pool_stats(alias) for alias in settings.DATABASES}
+    stats = {alias: value for alias, value in stats.items() if value is not None}
+    if not stats:
+        return ''
+    for kind, metrics in (('gauge', POOL_GAUGES), ('counter', POOL_COUNTERS)):
+        for key, description in metrics.items():
+            name = f'{prefix}_db_{key}' + ('_total' if kind == 'counter' else '')
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{alias="{alias}"}} {values.get(key, 0)}' for alias, values in sorted(stats.items())]
+
+    name = f'{prefix}_db_pool_saturation'
+    lines += [f'# HELP {name} Доля занятых соединений от максимума пула', f'# TYPE {name} gauge']
+    for alias, values in sorted(stats.items()):
+        used = values.get('pool_size', 0) - values.get('pool_available', 0)
+        lines.append(f'{name}{{alias="{alias}"}} {used / (values.get("pool_max") or 1):.3f}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,73 @@
+"""
+Скачивание фото товаров по source_url из импорта каталога.
+
+URL задаёт владелец магазина, поэтому скачиваются только адреса в публичном интернете:
+хост резолвится, и любой адрес в loopback, частных, link-local (169.254.169.254 —
+метаданные облака) и прочих непубличных сетях отклоняется — в том числе после редиректа.
+Сохраняется только то, что Pillow открывает как изображение.
+"""
+import io
+import ipaddress
+import socket
+from urllib.parse import urlsplit
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+
+class UnsafeURLError(ValueError):
+    pass
+
+
+def is_public_address(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_public_url(url):
+    """Проверить, что URL — http(s) и все адреса его хоста публичные; иначе UnsafeURLError."""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise UnsafeURLError(f"Недопустимый URL: {url}")
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as exc:
+        raise UnsafeURLError(f"Хост {parts.hostname} не найден") from exc
+    # Между проверкой и соединением DNS может ответить иначе; от этого защищает только
+    # egress-фильтр на уровне сети — проверка здесь отсекает прямые и редиректные адреса
+    for info in infos:
+        if not is_public_address(info[4][0]):
+            raise UnsafeURLError(f"Адрес {info[4][0]} хоста {parts.hostname} не публичный")
+
+
+class _PublicRedirectHandler(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = build_opener(_PublicRedirectHandler)
+
+
+def fetch_image(url):
+    """Байты изображения по публичному URL; UnsafeURLError / ValueError — скачивать нельзя."""
+    check_public_url(url)
+    request = Request(url, headers={'User-Agent': 'tg-shop-image-fetcher'})
+    with _opener.open(request, timeout=settings.IMAGE_FETCH_TIMEOUT) as response:
+        data = response.read(settings.IMAGE_UPLOAD_MAX_SIZE + 1)
+    if len(data) > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise ValueError(f"Файл больше {settings.IMAGE_UPLOAD_MAX_SIZE} байт")
+    try:
+        # verify() читает только заголовок и структуру — без декодирования пикселей
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as exc:
+        raise ValueError("Ответ не является изображением") from exc
+    return data
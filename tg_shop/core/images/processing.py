@@ -0,0 +1,64 @@
+import io
+import logging
+import math
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import ExifTags, Image, ImageOps, features
+
+from .storage import rendition_key, save_if_missing
+
+logger = logging.getLogger(__name__)
+
+# Параметры кодировщиков Pillow по форматам
+_ENCODER_OPTIONS = {
+    'webp': lambda: {'quality': settings.IMAGE_WEBP_QUALITY, 'method': 4},
+    'avif': lambda: {'quality': settings.IMAGE_AVIF_QUALITY, 'speed': 8},
+}
+
+
+def supported_formats():
+    """Форматы из IMAGE_RENDITION_FORMATS, которые умеет кодировать установленный Pillow."""
+    formats = []
+    for image_format in settings.IMAGE_RENDITION_FORMATS:
+        if image_format in _ENCODER_OPTIONS and features.check(image_format):
+            formats.append(image_format)
+        else:
+            logger.warning("Формат %s не поддерживается Pillow, превью не создаются", image_format)
+    return formats
+
+
+def target_widths(width):
+    """Ширины превью не больше оригинала; маленький оригинал получает одно превью своей ширины."""
+    widths = sorted({w for w in settings.IMAGE_RENDITION_WIDTHS if w <= width})
+    return widths or [width]
+
+
+def render(file, content_hash):
+    """
+    Создать превью оригинала во всех ширинах и форматах и сохранить их по ключам от хэша.
+    Возвращает (width, height, renditions).
+    """
+    with Image.open(file) as source:
+        width, height = source.size
+        if source.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            width, height = height, width
+        widths = target_widths(width)
+        # JPEG умеет декодироваться сразу в уменьшенном масштабе — быстрее и меньше памяти
+        scale = widths[-1] / width
+        source.draft('RGB', (math.ceil(source.width * scale), math.ceil(source.height * scale)))
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P', 'PA') else 'RGB')
+
+    formats = supported_formats()
+    renditions = {image_format: {} for image_format in formats}
+    # От большего к меньшему: каждое превью масштабируется из предыдущего, а не из оригинала
+    for target in reversed(widths):
+        if target != image.width:
+            image = image.resize((target, max(1, round(image.height * target / image.width))), Image.LANCZOS)
+        for image_format in formats:
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format.upper(), **_ENCODER_OPTIONS[image_format]())
+            key = rendition_key(content_hash, target, image_format)
+            renditions[image_format][str(target)] = save_if_missing(key, ContentFile(buffer.getvalue()))
+    return width, height, renditions
@@ -0,0 +1,144 @@
+import base64
+import mimetypes
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+_lock = threading.Lock()
+_clients = {}
+_executor = None
+
+
+def is_s3_storage(storage=None):
+    storage = storage or default_storage
+    return hasattr(storage, 'bucket_name') and hasattr(storage, 'connection')
+
+
+def get_client(endpoint_url=None):
+    """
+    Общий на процесс клиент boto3 (потокобезопасен) с пулом соединений
+    на S3_MAX_POOL_CONNECTIONS — не создаём клиент и TLS-соединение на каждый запрос.
+    """
+    endpoint_url = endpoint_url or settings.AWS_S3_ENDPOINT_URL
+    client = _clients.get(endpoint_url)
+    if client is None:
+        with _lock:
+            client = _clients.get(endpoint_url)
+            if client is None:
+                client = _clients[endpoint_url] = boto3.session.Session().client(
+                    's3',
+                    endpoint_url=endpoint_url,
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                    region_name=settings.AWS_S3_REGION_NAME,
+                    config=Config(
+                        signature_version='s3v4',
+                        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                        retries={'max_attempts': 3, 'mode': 'standard'},
+                    ),
+                )
+    return client
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.S3_UPLOAD_CONCURRENCY, thread_name_prefix='s3-upload',
+                )
+    return _executor
+
+
+def transfer_config():
+    # Большие файлы уходят multipart-частями, части — параллельно
+    return TransferConfig(
+        multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+        use_threads=True,
+    )
+
+
+def bucket():
+    return default_storage.bucket_name
+
+
+def object_key(name):
+    """Ключ объекта в бакете с учётом AWS_LOCATION хранилища."""
+    location = getattr(default_storage, 'location', '')
+    return posixpath.join(location, name) if location else name
+
+
+def head(name):
+    """Метаданные объекта или None, если его нет."""
+    try:
+        return get_client().head_object(Bucket=bucket(), Key=object_key(name))
+    except ClientError as exc:
+        if exc.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def head_many(names):
+    """head() для нескольких ключей параллельно."""
+    return list(get_executor().map(head, names))
+
+
+def upload(fileobj, name, content_type=None):
+    """Загрузить файл, если объекта с таким ключом ещё нет (ключи — по хэшу содержимого)."""
+    if head(name) is None:
+        fileobj.seek(0)
+        get_client().upload_fileobj(
+            fileobj, bucket(), object_key(name),
+            ExtraArgs={'ContentType': content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'},
+            Config=transfer_config(),
+        )
+    return name
+
+
+def upload_many(items):
+    """
+    Параллельная загрузка [(fileobj, name, content_type), ...] через общий пул потоков.
+    Время ответа — время самой долгой загрузки, а не сумма.
+    """
+    futures = [get_executor().submit(upload, *item) for item in items]
+    return [future.result() for future in futures]
+
+
+def presigned_put(name, content_type, size, sha256_hex):
+    """
+    Подписанный PUT на прямую загрузку в хранилище. Подписаны Content-Type, Content-Length
+    и x-amz-checksum-sha256 — хранилище отклонит файл другого размера или содержимого,
+    поэтому ключу по хэшу можно доверять.
+    """
+    checksum = base64.b64encode(bytes.fromhex(sha256_hex)).decode()
+    client = get_client(settings.AWS_S3_PUBLIC_ENDPOINT_URL)
+    url = client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': bucket(),
+            'Key': object_key(name),
+            'ContentType': content_type,
+            'ContentLength': size,
+            'ChecksumSHA256': checksum,
+        },
+        ExpiresIn=settings.IMAGE_UPLOAD_URL_TTL,
+    )
+    return {
+        'url': url,
+        'method': 'PUT',
+        'headers': {
+            'Content-Type': content_type,
+            'Content-Length': str(size),
+            'x-amz-checksum-sha256': checksum,
+        },
+    }
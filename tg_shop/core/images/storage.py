@@ -0,0 +1,89 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import default_storage
+
+from .s3 import is_s3_storage, upload_many
+
+ORIGINALS_PREFIX = 'products/originals'
+RENDITIONS_PREFIX = 'products/renditions'
+
+_ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.avif', '.heic', '.bmp', '.tiff'}
+_ORIGINAL_KEY_RE = re.compile(rf'^{ORIGINALS_PREFIX}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[a-z]+)?$')
+
+
+def hash_file(file, chunk_size=1024 * 1024):
+    """sha256 содержимого файла; читается кусками, файл не загружается в память целиком."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def original_key(content_hash, filename=''):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in _ALLOWED_EXTENSIONS:
+        extension = ''
+    return f'{ORIGINALS_PREFIX}/{content_hash[:2]}/{content_hash}{extension}'
+
+
+def rendition_key(content_hash, width, image_format):
+    return f'{RENDITIONS_PREFIX}/{content_hash[:2]}/{content_hash}/{width}.{image_format}'
+
+
+def save_originals(uploads):
+    """
+    Сохранить загруженные файлы по ключам от хэша содержимого; уже имеющиеся
+    в хранилище файлы повторно не загружаются. В S3 файлы уходят параллельно.
+    Возвращает [(key, content_hash), ...] в порядке uploads.
+    """
+    saved = [(original_key(content_hash, upload.name), content_hash)
+             for upload, content_hash in ((upload, hash_file(upload)) for upload in uploads)]
+    if is_s3_storage():
+        upload_many([
+            (upload, key, getattr(upload, 'content_type', None))
+            for upload, (key, _) in zip(uploads, saved)
+        ])
+    else:
+        for upload, (key, _) in zip(uploads, saved):
+            save_if_missing(key, upload)
+    return saved
+
+
+def parse_original_key(key):
+    """content_hash из ключа оригинала или None, если ключ не из products/originals."""
+    match = _ORIGINAL_KEY_RE.match(key)
+    if match is None or original_key(match.group(1), key) != key:
+        return None
+    return match.group(1)
+
+
+def save_if_missing(key, content):
+    if not default_storage.exists(key):
+        default_storage.save(key, content)
+    return key
+
+
+def storage_url(key):
+    return default_storage.url(key)
+
+
+def srcset(renditions):
+    """{'webp': 'url 320w, url 640w', 'avif': ...} для <picture>/<source srcset>."""
+    return {
+        image_format: ', '.join(
+            f'{storage_url(key)} {width}w'
+            for width, key in sorted(by_width.items(), key=lambda item: int(item[0]))
+        )
+        for image_format, by_width in renditions.items()
+    }
+
+
+def smallest_rendition_url(renditions, image_format='webp'):
+    by_width = renditions.get(image_format)
+    if not by_width:
+        return None
+    return storage_url(by_width[min(by_width, key=int)])
@@ -0,0 +1,136 @@
+import logging
+import posixpath
+import time
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import ProductImage
+from .fetch import fetch_image
+from .processing import render
+from .storage import hash_file, save_originals
+
+logger = logging.getLogger(__name__)
+
+
+class ImageWorker:
+    """
+    Воркер обработки фото товаров: превью WebP/AVIF в нескольких ширинах.
+
+    Пачка необработанных фото забирается через SELECT ... FOR UPDATE SKIP LOCKED,
+    поэтому несколько процессов делят очередь без блокировок. Фото с одинаковым
+    хэшем содержимого обрабатываются один раз: результат копируется из готовой записи.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.IMAGE_JOB_BATCH_SIZE
+        self.started = time.monotonic()
+        self.stats = {'processed': 0, 'deduplicated': 0, 'failed': 0}
+
+    def claim(self):
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.IMAGE_JOB_LOCK_TIMEOUT)
+        abandoned = Q(status=ProductImage.Status.PROCESSING, locked_at__lt=stale)
+        with transaction.atomic():
+            # Фото, на котором воркер падает, не забирается бесконечно: после
+            # IMAGE_JOB_MAX_ATTEMPTS брошенная обработка считается ошибкой
+            ProductImage.objects.filter(abandoned, attempts__gte=settings.IMAGE_JOB_MAX_ATTEMPTS).update(
+                status=ProductImage.Status.FAILED, error='Превышено время обработки',
+            )
+            images = list(
+                ProductImage.objects
+                .select_for_update(skip_locked=True)
+                .filter(Q(status=ProductImage.Status.PENDING) |
+                        abandoned & Q(attempts__lt=settings.IMAGE_JOB_MAX_ATTEMPTS))
+                .order_by('created_at')
+                .only('id', 'image', 'source_url', 'content_hash', 'attempts')[:self.batch_size]
+            )
+            if images:
+                ProductImage.objects.filter(id__in=[image.id for image in images]).update(
+                    status=ProductImage.Status.PROCESSING, locked_at=now, attempts=F('attempts') + 1,
+                )
+        return images
+
+    def run_once(self):
+        """Обработать одну пачку. Возвращает число обработанных фото."""
+        images = self.claim()
+        processed = {}
+        for image in images:
+            try:
+                if not image.image.name:
+                    self.fetch_original(image)
+                content_hash = image.content_hash or self.hash_original(image)
+                result = processed.get(content_hash) or self.find_processed(content_hash)
+                if result is None:
+                    with default_storage.open(image.image.name, 'rb') as file:
+                        result = render(file, content_hash)
+                else:
+                    self.stats['deduplicated'] += 1
+                processed[content_hash] = result
+                self.finish(image, content_hash, result)
+            except Exception as exc:
+                logger.exception("Не удалось обработать фото %s", image.id)
+                self.fail(image, exc)
+        return len(images)
+
+    def fetch_original(self, image):
+        """Скачать оригинал по source_url (фото из импорта каталога) в хранилище по хэшу."""
+        data = fetch_image(image.source_url)
+        name = posixpath.basename(urlparse(image.source_url).path) or 'image'
+        [(key, content_hash)] = save_originals([ContentFile(data, name=name)])
+        ProductImage.objects.filter(pk=image.pk).update(image=key, content_hash=content_hash)
+        image.image.name, image.content_hash = key, content_hash
+
+    def hash_original(self, image):
+        # Фото, загруженные до появления конвейера, хэшируются при первой обработке
+        with default_storage.open(image.image.name, 'rb') as file:
+            return hash_file(file)
+
+    def find_processed(self, content_hash):
+        ready = (
+            ProductImage.objects
+            .filter(content_hash=content_hash, status=ProductImage.Status.READY)
+            .values_list('width', 'height', 'renditions')
+            .first()
+        )
+        return tuple(ready) if ready else None
+
+    def finish(self, image, content_hash, result):
+        width, height, renditions = result
+        ProductImage.objects.filter(pk=image.pk).update(
+            status=ProductImage.Status.READY,
+            content_hash=content_hash,
+            width=width,
+            height=height,
+            renditions=renditions,
+            error='',
+        )
+        self.stats['processed'] += 1
+
+    def fail(self, image, exc):
+        status = ProductImage.Status.PENDING
+        if image.attempts + 1 >= settings.IMAGE_JOB_MAX_ATTEMPTS:
+            status = ProductImage.Status.FAILED
+            self.stats['failed'] += 1
+        ProductImage.objects.filter(pk=image.pk).update(status=status, error=repr(exc))
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            **self.stats,
+            'elapsed_s': round(elapsed, 3),
+            'images_per_s': round(self.stats['processed'] / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def run(self, poll_interval=1.0, stop_when_empty=False):
+        while True:
+            if not self.run_once():
+                if stop_when_empty:
+                    return self
+                time.sleep(poll_interval)
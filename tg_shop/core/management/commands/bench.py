@@ -0,0 +1,108 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.bench.generator import SyntheticDataGenerator
+from core.bench.scenarios import SCENARIOS, run_scenario
+from core.bench.utils import bench_database, git_revision
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует синтетические данные заданного масштаба и прогоняет сценарии нагрузки "
+        "против реальных view (тестовый клиент DRF). Отчёт — JSON с p50/p95/p99, "
+        "числом SQL-запросов на запрос и rows/s"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000,
+                            help="Примерный объём данных в строках (от 1k до 10M)")
+        parser.add_argument('--messages-per-question', type=int, default=3)
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Размер пачки bulk_create")
+        parser.add_argument('--seed', type=int, default=0, help="Сид генератора данных")
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help="Сценарий (можно несколько раз). По умолчанию — все")
+        parser.add_argument('--requests', type=int, default=200, help="Запросов на сценарий")
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--output', help="Файл для JSON-отчёта (по умолчанию stdout)")
+        parser.add_argument('--compare', help="JSON-отчёт предыдущего запуска для сравнения")
+        parser.add_argument('--keepdb', action='store_true', help="Не удалять тестовую БД после прогона")
+        parser.add_argument('--use-current-db', action='store_true',
+                            help="Писать данные в текущую БД вместо отдельной test_<NAME>")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Не удалось прочитать {options['compare']}: {exc}")
+
+        # Тестовый клиент ходит на хост testserver
+        with bench_database(keepdb=options['keepdb'], use_current_db=options['use_current_db']), \
+                override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            report = self.run(options)
+
+        if baseline:
+            report['compare'] = self.compare(baseline, report)
+
+        output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Отчёт записан в {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        generator = SyntheticDataGenerator(
+            rows=options['rows'],
+            messages_per_question=options['messages_per_question'],
+            chunk_size=options['chunk_size'],
+            seed=options['seed'],
+        )
+        self.stderr.write(f"Генерация ~{options['rows']} строк...")
+        seed = generator.generate()
+        self.stderr.write(f"Данные созданы за {seed['seconds']} с ({seed['rows_per_s']} строк/с)")
+
+        scenarios = {}
+        for name in options['scenario'] or SCENARIOS:
+            started = time.perf_counter()
+            scenarios[name] = run_scenario(
+                SCENARIOS[name](generator.fixtures), requests=options['requests'], warmup=options['warmup'],
+            )
+            self.stderr.write(
+                f"{name}: p50 {scenarios[name]['p50_ms']} мс, p99 {scenarios[name]['p99_ms']} мс, "
+                f"{scenarios[name]['queries_per_request']} SQL/запрос ({time.perf_counter() - started:.1f} с)"
+            )
+
+        return {
+            'revision': git_revision(),
+            'started_at': timezone.now(),
+            'database': connection.vendor,
+            'options': {
+                key: options[key]
+                for key in ('rows', 'messages_per_question', 'seed', 'requests', 'warmup')
+            },
+            'seed': seed,
+            'scenarios': scenarios,
+        }
+
+    def compare(self, baseline, report):
+        """Отношение метрик к предыдущему прогону (< 1 — стало быстрее)."""
+        result = {'baseline_revision': baseline.get('revision')}
+        for name, current in report['scenarios'].items():
+            previous = baseline.get('scenarios', {}).get(name)
+            if not previous:
+                continue
+            result[name] = {
+                metric: round(current[metric] / previous[metric], 3) if previous.get(metric) else None
+                for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+            }
+        return result
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core.bench.generator import SyntheticDataGenerator
+from core.bench.http import HTTP_SCENARIOS, run_load, running_server
+from core.bench.utils import bench_database, git_revision
+
+SERVERS = ('wsgi', 'asgi')
+# Под ASGI ORM работает из разных потоков — постоянные соединения там не переиспользуются
+DB_MODES = {'wsgi': 'persistent', 'asgi': 'pool'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность WSGI (gunicorn, sync-view) и ASGI (uvicorn, async-view) "
+        "на одних данных и одном железе: параллельные HTTP-запросы к настоящему серверу. "
+        "Отчёт — JSON с requests/s и p50/p95/p99 по серверам и сценариям"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000, help="Примерный объём данных в строках")
+        parser.add_argument('--seed', type=int, default=0, help="Сид генератора данных")
+        parser.add_argument('--server', action='append', choices=SERVERS,
+                            help="Сервер (можно несколько раз). По умолчанию — оба")
+        parser.add_argument('--scenario', action='append', choices=sorted(HTTP_SCENARIOS),
+                            help="Сценарий (можно несколько раз). По умолчанию — все")
+        parser.add_argument('--requests', type=int, default=2000, help="Запросов на сценарий")
+        parser.add_argument('--concurrency', type=int, default=50, help="Параллельных соединений")
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=2, help="Процессов сервера")
+        parser.add_argument('--threads', type=int, default=8, help="Потоков на процесс gunicorn")
+        parser.add_argument('--db-mode', choices=('persistent', 'pool', 'none'),
+                            help="DB_CONNECTION_MODE обоих серверов. По умолчанию — рекомендуемый для "
+                                 "каждого: persistent для WSGI, pool для ASGI")
+        parser.add_argument('--output', help="Файл для JSON-отчёта (по умолчанию stdout)")
+        parser.add_argument('--keepdb', action='store_true', help="Не удалять тестовую БД после прогона")
+        parser.add_argument('--use-current-db', action='store_true',
+                            help="Писать данные в текущую БД вместо отдельной test_<NAME>")
+
+    def handle(self, *args, **options):
+        with bench_database(keepdb=options['keepdb'], use_current_db=options['use_current_db']):
+            try:
+                report = self.run(options)
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+
+        output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Отчёт записан в {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        generator = SyntheticDataGenerator(rows=options['rows'], seed=options['seed'])
+        self.stderr.write(f"Генерация ~{options['rows']} строк...")
+        seed = generator.generate()
+
+        secret = settings.EXTERNAL_API_SECRET or 'bench-secret'
+        # Серверы — отдельные процессы: БД бенчмарка и настройки передаются через окружение
+        env = {
+            'POSTGRES_DB': connection.settings_dict['NAME'],
+            'EXTERNAL_API_SECRET': secret,
+        }
+        connection.close()
+
+        results = {}
+        for server in options['server'] or SERVERS:
+            results[server] = {}
+            db_mode = options['db_mode'] or DB_MODES[server]
+            server_env = {**env, 'DB_CONNECTION_MODE': db_mode}
+            with running_server(server, server_env, options['workers'], options['threads']) as port:
+                for name in options['scenario'] or HTTP_SCENARIOS:
+                    result = asyncio.run(run_load(
+                        port, HTTP_SCENARIOS[name](generator.fixtures, secret),
+                        requests=options['requests'], concurrency=options['concurrency'], warmup=options['warmup'],
+                    ))
+                    results[server][name] = {**result, 'db_mode': db_mode}
+                    self.stderr.write(
+                        f"{server} {name}: {result['requests_per_s']} запросов/с, "
+                        f"p50 {result['p50_ms']} мс, p99 {result['p99_ms']} мс"
+                    )
+
+        report = {
+            'revision': git_revision(),
+            'started_at': timezone.now(),
+            'options': {
+                key: options[key]
+                for key in ('rows', 'seed', 'requests', 'concurrency', 'warmup', 'workers', 'threads', 'db_mode')
+            },
+            'seed': seed,
+            'servers': results,
+        }
+        if {'wsgi', 'asgi'} <= results.keys():
+            # > 1 — ASGI обрабатывает больше запросов в секунду
+            report['asgi_vs_wsgi'] = {
+                name: round(results['asgi'][name]['requests_per_s'] / results['wsgi'][name]['requests_per_s'], 3)
+                for name in results['asgi'] if name in results['wsgi']
+            }
+        return report
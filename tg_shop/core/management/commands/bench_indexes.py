@@ -0,0 +1,286 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.bench.utils import bench_database, percentile
+from core.models import Store, CustomUser, Product, ProductQuestion, ProductQuestionMessage, QuestionAnswer
+
+# Индексы горячих путей (миграция 0015) — сравниваем план «до» и «после» них
+HOT_PATH_INDEXES = [
+    (Product, 'product_store_id_idx'),
+    (ProductQuestion, 'question_user_created_idx'),
+    (ProductQuestion, 'question_product_resolved_idx'),
+    (ProductQuestion, 'question_unresolved_idx'),
+    (ProductQuestionMessage, 'message_question_sent_idx'),
+    (QuestionAnswer, 'answer_question_sent_idx'),
+    (QuestionAnswer, 'answer_responder_sent_idx'),
+]
+
+# Одиночные индексы внешних ключей, которые были до миграции 0015
+LEGACY_FK_INDEXES = [
+    (Product, 'store_id'),
+    (ProductQuestion, 'product_id'),
+    (ProductQuestion, 'user_id'),
+    (ProductQuestionMessage, 'question_id'),
+    (QuestionAnswer, 'question_id'),
+    (QuestionAnswer, 'responder_id'),
+]
+
+
+def _table(model):
+    return model._meta.db_table
+
+
+def _index(model, name):
+    return next(index for index in model._meta.indexes if index.name == name)
+
+
+QUERIES = {
+    'conversation': (
+        f"SELECT * FROM {_table(ProductQuestion)} WHERE user_id = %s ORDER BY created_at DESC LIMIT 50",
+        'user',
+    ),
+    'unresolved_by_product': (
+        f"SELECT * FROM {_table(ProductQuestion)} WHERE product_id = %s AND NOT is_resolved "
+        f"ORDER BY created_at LIMIT 50",
+        'product',
+    ),
+    'resolved_count_by_product': (
+        f"SELECT count(*) FROM {_table(ProductQuestion)} WHERE product_id = %s AND is_resolved",
+        'product',
+    ),
+    'question_messages': (
+        f"SELECT * FROM {_table(ProductQuestionMessage)} WHERE question_id = %s ORDER BY sent_at",
+        'question',
+    ),
+    'answers_by_responder': (
+        f"SELECT * FROM {_table(QuestionAnswer)} WHERE responder_id = %s ORDER BY sent_at DESC, id DESC LIMIT 50",
+        'staff',
+    ),
+    'answers_by_question': (
+        f"SELECT * FROM {_table(QuestionAnswer)} WHERE question_id = %s ORDER BY sent_at",
+        'question',
+    ),
+    'store_products': (
+        f"SELECT * FROM {_table(Product)} WHERE store_id = %s ORDER BY id DESC LIMIT 50",
+        'store',
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет БД синтетическими данными и сравнивает EXPLAIN-планы и задержки "
+        "запросов горячих путей до и после индексов миграции 0015"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1_000_000)
+        parser.add_argument('--messages-per-question', type=int, default=3)
+        parser.add_argument('--stores', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50, help="Запусков каждого запроса на фазу")
+        parser.add_argument('--output', help="Файл для JSON-отчёта (по умолчанию stdout)")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Не удалять тестовую БД (повторный запуск без --seed использует данные)")
+        parser.add_argument('--no-seed', dest='seed', action='store_false')
+        parser.add_argument('--use-current-db', action='store_true',
+                            help="Работать в текущей БД вместо отдельной test_<NAME>. Осторожно: индексы пересоздаются")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write("Бенчмарк рассчитан на PostgreSQL")
+            return
+
+        with bench_database(keepdb=options['keepdb'], use_current_db=options['use_current_db']):
+            report = self.run(options)
+
+        output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Отчёт записан в {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        if options['seed']:
+            started = time.perf_counter()
+            self.seed(options)
+            self.stdout.write(f"Данные созданы за {time.perf_counter() - started:.1f} с")
+
+        with connection.cursor() as cursor:
+            for model in (Product, ProductQuestion, ProductQuestionMessage, QuestionAnswer):
+                cursor.execute(f"ANALYZE {_table(model)}")
+        params = self.sample_params(options['repeat'])
+
+        self.use_legacy_indexes()
+        before = self.measure(params)
+        self.use_hot_path_indexes()
+        after = self.measure(params)
+
+        return {
+            'rows': self.row_counts(),
+            'before': before,
+            'after': after,
+            'speedup_p50': {
+                name: round(before[name]['p50_ms'] / after[name]['p50_ms'], 2) if after[name]['p50_ms'] else None
+                for name in QUERIES
+            },
+        }
+
+    # ── данные ─────────────────────────────────
+
+    def seed(self, options):
+        questions = options['questions']
+        stores = options['stores']
+        products = max(questions // 20, stores)
+        customers = max(questions // 10, 1)
+        staff = stores * 5
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {_table(Store)} (name, store_code) "
+                f"SELECT 'Bench store ' || g, 'bench-' || g || '-' || md5(random()::text) "
+                f"FROM generate_series(1, %s) g",
+                [stores],
+            )
+            cursor.execute(f"SELECT min(id) FROM {_table(Store)} WHERE store_code LIKE %s", ['bench-%'])
+            first_store = cursor.fetchone()[0]
+
+            user_columns = (
+                "password, is_superuser, username, first_name, last_name, email, is_staff, is_active, "
+                "date_joined, external_id, role, store_id"
+            )
+            cursor.execute(
+                f"INSERT INTO {_table(CustomUser)} ({user_columns}) "
+                f"SELECT '', false, 'bench_staff_' || g || '_' || md5(random()::text), '', '', '', false, true, "
+                f"now(), NULL, 'manager', %s + (g %% %s) FROM generate_series(1, %s) g",
+                [first_store, stores, staff],
+            )
+            cursor.execute(
+                f"INSERT INTO {_table(CustomUser)} ({user_columns}) "
+                f"SELECT '', false, 'bench_user_' || g || '_' || md5(random()::text), '', '', '', false, true, "
+                f"now(), 'bench-' || md5(random()::text), 'user', NULL FROM generate_series(1, %s) g",
+                [customers],
+            )
+            cursor.execute(
+                f"INSERT INTO {_table(Product)} (store_id, title, description, specifications) "
+                f"SELECT %s + (g %% %s), 'Товар ' || g, 'Описание товара ' || g, "
+                f"jsonb_build_object('weight', (g %% 10) || 'kg', 'color', (ARRAY['black','white','red'])[1 + g %% 3]) "
+                f"FROM generate_series(1, %s) g",
+                [first_store, stores, products],
+            )
+            cursor.execute(f"SELECT min(id), max(id) FROM {_table(Product)}")
+            min_product, max_product = cursor.fetchone()
+            cursor.execute(f"SELECT min(id), max(id) FROM {_table(CustomUser)} WHERE role = 'user'")
+            min_user, max_user = cursor.fetchone()
+            cursor.execute(f"SELECT min(id), max(id) FROM {_table(CustomUser)} WHERE role = 'manager'")
+            min_staff, max_staff = cursor.fetchone()
+
+            # ~90% вопросов отвечены — неотвеченные составляют малую часть таблицы
+            cursor.execute(
+                f"INSERT INTO {_table(ProductQuestion)} (product_id, user_id, text, is_resolved, created_at) "
+                f"SELECT %s + floor(random() * %s)::bigint, %s + floor(random() * %s)::bigint, "
+                f"'Вопрос ' || g, random() < 0.9, now() - random() * interval '365 days' "
+                f"FROM generate_series(1, %s) g",
+                [min_product, max_product - min_product + 1, min_user, max_user - min_user + 1, questions],
+            )
+            cursor.execute(
+                f"INSERT INTO {_table(ProductQuestionMessage)} (question_id, sender_id, text, sent_at, role) "
+                f"SELECT q.id, q.user_id, 'Сообщение ' || m, q.created_at + m * interval '1 hour', "
+                f"CASE WHEN m %% 2 = 0 THEN 'user' ELSE 'manager' END "
+                f"FROM {_table(ProductQuestion)} q, generate_series(0, %s - 1) m",
+                [options['messages_per_question']],
+            )
+            cursor.execute(
+                f"INSERT INTO {_table(QuestionAnswer)} (question_id, responder_id, text, sent_at, role) "
+                f"SELECT q.id, %s + floor(random() * %s)::bigint, 'Ответ', q.created_at + interval '2 hours', 'manager' "
+                f"FROM {_table(ProductQuestion)} q WHERE q.is_resolved",
+                [min_staff, max_staff - min_staff + 1],
+            )
+
+    def row_counts(self):
+        counts = {}
+        with connection.cursor() as cursor:
+            for model in (Store, CustomUser, Product, ProductQuestion, ProductQuestionMessage, QuestionAnswer):
+                cursor.execute(f"SELECT count(*) FROM {_table(model)}")
+                counts[model.__name__] = cursor.fetchone()[0]
+        return counts
+
+    def sample_params(self, repeat):
+        samples = {
+            'user': f"SELECT user_id FROM {_table(ProductQuestion)} WHERE user_id IS NOT NULL",
+            'product': f"SELECT id FROM {_table(Product)}",
+            'question': f"SELECT id FROM {_table(ProductQuestion)}",
+            'staff': f"SELECT responder_id FROM {_table(QuestionAnswer)} WHERE responder_id IS NOT NULL",
+            'store': f"SELECT store_id FROM {_table(Product)}",
+        }
+        params = {}
+        with connection.cursor() as cursor:
+            for kind, sql in samples.items():
+                cursor.execute(f"{sql} ORDER BY random() LIMIT %s", [repeat])
+                values = [row[0] for row in cursor.fetchall()] or [0]
+                params[kind] = [random.choice(values) for _ in range(repeat)]
+        return params
+
+    # ── индексы ────────────────────────────────
+
+    def use_legacy_indexes(self):
+        with connection.schema_editor(atomic=False) as editor:
+            for model, name in HOT_PATH_INDEXES:
+                editor.execute(f"DROP INDEX IF EXISTS {editor.quote_name(name)}")
+            for model, column in LEGACY_FK_INDEXES:
+                editor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {editor.quote_name(f'bench_legacy_{_table(model)}_{column}')} "
+                    f"ON {editor.quote_name(_table(model))} ({editor.quote_name(column)})"
+                )
+
+    def use_hot_path_indexes(self):
+        with connection.schema_editor(atomic=False) as editor:
+            for model, column in LEGACY_FK_INDEXES:
+                editor.execute(f"DROP INDEX IF EXISTS {editor.quote_name(f'bench_legacy_{_table(model)}_{column}')}")
+            for model, name in HOT_PATH_INDEXES:
+                editor.add_index(model, _index(model, name))
+        with connection.cursor() as cursor:
+            for model in (Product, ProductQuestion, ProductQuestionMessage, QuestionAnswer):
+                cursor.execute(f"ANALYZE {_table(model)}")
+
+    # ── замеры ─────────────────────────────────
+
+    def measure(self, params):
+        results = {}
+        with connection.cursor() as cursor:
+            for name, (sql, kind) in QUERIES.items():
+                values = params[kind]
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", [values[0]])
+                plan = cursor.fetchone()[0]
+                plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+
+                timings = []
+                for value in values:
+                    started = time.perf_counter()
+                    cursor.execute(sql, [value])
+                    cursor.fetchall()
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+
+                results[name] = {
+                    'p50_ms': round(percentile(timings, 50), 3),
+                    'p95_ms': round(percentile(timings, 95), 3),
+                    'max_ms': round(timings[-1], 3),
+                    'node': plan['Plan']['Node Type'],
+                    'index': _plan_indexes(plan['Plan']),
+                    'execution_ms': plan.get('Execution Time'),
+                    'plan': plan,
+                }
+        return results
+
+
+def _plan_indexes(node):
+    names = [node['Index Name']] if 'Index Name' in node else []
+    for child in node.get('Plans', []):
+        names.extend(_plan_indexes(child))
+    return names
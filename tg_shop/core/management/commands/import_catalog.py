@@ -0,0 +1,38 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Store
+from core.utils.catalog import FORMATS, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Потоковый импорт каталога товаров магазина из CSV или JSONL (upsert по артикулу)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_id', type=int)
+        parser.add_argument('path', help="Путь к файлу или - для stdin")
+        parser.add_argument('--format', dest='file_format', choices=FORMATS,
+                            help="По умолчанию определяется по расширению файла")
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(pk=options['store_id'])
+        except Store.DoesNotExist:
+            raise CommandError(f"Магазин {options['store_id']} не найден")
+
+        path = options['path']
+        file_format = options['file_format'] or detect_format(filename=path)
+        if file_format is None:
+            raise CommandError("Не удалось определить формат, укажите --format")
+
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            result = import_catalog(store, stream, file_format, user=store.owner,
+                                    chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
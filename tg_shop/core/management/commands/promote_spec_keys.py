@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import SpecKeyUsage
+from core.utils.specs import KEY_RE, create_spec_index, detect_value_type, drop_spec_index, index_expression
+
+
+class Command(BaseCommand):
+    help = ("Строит типизированные btree-индексы (store_id, значение) для самых частых ключей "
+            "specifications в фильтрах товаров (статистика SpecKeyUsage)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=settings.SPEC_PROMOTE_TOP,
+                            help="Сколько самых частых ключей индексировать")
+        parser.add_argument('--min-count', type=int, default=settings.SPEC_PROMOTE_MIN_COUNT,
+                            help="Минимальное число фильтров по ключу")
+        parser.add_argument('--key', action='append', default=[], help="Индексировать ключ независимо от статистики")
+        parser.add_argument('--type', dest='value_type', choices=SpecKeyUsage.ValueType.values,
+                            help="Тип индекса для --key (по умолчанию определяется по данным)")
+        parser.add_argument('--demote', action='append', default=[], help="Удалить индекс ключа")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что будет сделано")
+
+    def handle(self, *args, **options):
+        for key in options['demote']:
+            if options['dry_run']:
+                self.stdout.write(f"удалить индекс: {key}")
+                continue
+            name = drop_spec_index(key)
+            self.stdout.write(f"{key}: индекс {name} удалён" if name else f"{key}: индекса нет")
+
+        keys = list(options['key'])
+        if not keys and not options['demote']:
+            keys = list(
+                SpecKeyUsage.objects
+                .filter(index_name='', filter_count__gte=options['min_count'])
+                .order_by('-filter_count')
+                .values_list('key', flat=True)[:options['top']]
+            )
+
+        for key in keys:
+            if not KEY_RE.match(key):
+                raise CommandError(f"Недопустимый ключ: {key!r}")
+            value_type = options['value_type'] or detect_value_type(key)
+            if value_type is None:
+                self.stdout.write(f"{key}: нет товаров с этим ключом, пропущен")
+                continue
+            if options['dry_run']:
+                self.stdout.write(f"{key}: индекс (store_id, {index_expression(key, value_type)})")
+                continue
+            name = create_spec_index(key, value_type)
+            self.stdout.write(self.style.SUCCESS(f"{key}: {value_type}-индекс {name}"))
+
+        if not keys and not options['demote']:
+            self.stdout.write("Нет ключей для индексации")
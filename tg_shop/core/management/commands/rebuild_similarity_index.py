@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.ai.similarity import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает индекс похожих вопросов (MinHash-сигнатуры отвеченных вопросов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', type=int, default=None, help="Только для одного магазина")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = rebuild_index(store_id=options['store'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано вопросов: {total}"))
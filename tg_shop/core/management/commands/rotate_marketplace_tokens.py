@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import MarketplaceIntegrationToken
+from core.utils.crypto import rotate_token, is_primary_key_token, token_cache
+
+# Попыток перешифровать токен, который параллельно меняют
+MAX_ATTEMPTS = 3
+
+
+class Command(BaseCommand):
+    help = "Перешифровывает токены маркетплейсов основным ключом из FERNET_KEYS (пакетами)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Пауза между пакетами в секундах, чтобы не нагружать БД")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        self.rotated = self.skipped = self.failed = self.raced = 0
+
+        while True:
+            batch = list(
+                MarketplaceIntegrationToken.objects
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', '_token')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            for token_id, ciphertext in batch:
+                self.rotate(token_id, ciphertext)
+            self.stdout.write(
+                f"До id={last_id}: перешифровано {self.rotated}, пропущено {self.skipped}, "
+                f"изменено параллельно {self.raced}, ошибок {self.failed}"
+            )
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        # Ключи кэша содержат хэш шифротекста, старые записи больше не нужны
+        token_cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: перешифровано {self.rotated}, пропущено {self.skipped}, "
+            f"изменено параллельно {self.raced}, ошибок {self.failed}"
+        ))
+
+    def rotate(self, token_id, ciphertext):
+        """
+        Перешифровать один токен. UPDATE только при неизменном шифротексте: токен, который
+        владелец заменил, пока команда работала, не перезаписывается старым значением.
+        """
+        for _ in range(MAX_ATTEMPTS):
+            if is_primary_key_token(ciphertext):
+                self.skipped += 1
+                return
+            try:
+                rotated = rotate_token(ciphertext)
+            except Exception as exc:
+                self.failed += 1
+                self.stderr.write(f"Токен {token_id} не расшифровывается ни одним ключом: {exc!r}")
+                return
+            if MarketplaceIntegrationToken.objects.filter(pk=token_id, _token=ciphertext).update(_token=rotated):
+                self.rotated += 1
+                return
+            # Токен изменили или удалили — перечитываем и пробуем снова
+            self.raced += 1
+            ciphertext = (
+                MarketplaceIntegrationToken.objects.filter(pk=token_id).values_list('_token', flat=True).first()
+            )
+            if ciphertext is None:
+                return
+        self.failed += 1
+        self.stderr.write(f"Токен {token_id} меняется быстрее, чем перешифровывается")
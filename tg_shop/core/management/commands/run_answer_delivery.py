@@ -0,0 +1,26 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.sync.delivery import DeliveryWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Отправляет ответы сотрудников и ИИ на маркетплейсы из очереди AnswerDelivery. "
+        "Один процесс обслуживает все магазины; несколько процессов не мешают друг другу"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Выйти, когда очередь опустеет")
+
+    def handle(self, *args, **options):
+        worker = DeliveryWorker(batch_size=options['batch_size'])
+        try:
+            asyncio.run(worker.run(poll_interval=options['poll_interval'], stop_when_empty=options['once']))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(json.dumps(worker.stats.as_dict(), ensure_ascii=False))
@@ -0,0 +1,50 @@
+import json
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.images.worker import ImageWorker
+
+
+def _run_worker(batch_size, poll_interval, once, results):
+    # В дочернем процессе открываем собственное соединение с БД
+    connections.close_all()
+    worker = ImageWorker(batch_size=batch_size).run(poll_interval=poll_interval, stop_when_empty=once)
+    results.put(worker.as_dict())
+
+
+class Command(BaseCommand):
+    help = "Запускает N процессов, создающих WebP/AVIF-превью фотографий товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Выйти, когда очередь опустеет")
+
+    def handle(self, *args, **options):
+        if options['workers'] == 1:
+            worker = ImageWorker(batch_size=options['batch_size']).run(
+                poll_interval=options['poll_interval'], stop_when_empty=options['once'],
+            )
+            self.stdout.write(json.dumps(worker.as_dict(), ensure_ascii=False))
+            return
+
+        # Соединение родителя не должно наследоваться форкнутыми процессами
+        connections.close_all()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_run_worker,
+                args=(options['batch_size'], options['poll_interval'], options['once'], results),
+            )
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        while not results.empty():
+            self.stdout.write(json.dumps(results.get(), ensure_ascii=False))
@@ -0,0 +1,36 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sync.adapters import get_adapters
+from core.sync.scheduler import SyncScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает новые вопросы покупателей из API маркетплейсов по токенам магазинов "
+        "(MarketplaceIntegrationToken). Работает постоянно; с --once — один проход по всем магазинам"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Один проход и выход (например, из cron)")
+        parser.add_argument('--marketplace', action='append',
+                            help="Только указанные маркетплейсы (можно несколько раз)")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Пауза между проходами по магазину, секунд (по умолчанию SYNC_POLL_INTERVAL)")
+
+    def handle(self, *args, **options):
+        adapters = get_adapters()
+        if options['marketplace']:
+            unknown = set(options['marketplace']) - adapters.keys()
+            if unknown:
+                raise CommandError(f"Нет адаптера для: {', '.join(sorted(unknown))}")
+            adapters = {name: adapters[name] for name in options['marketplace']}
+
+        scheduler = SyncScheduler(adapters=adapters, poll_interval=options['poll_interval'])
+        try:
+            stats = asyncio.run(scheduler.run(once=options['once']))
+        except KeyboardInterrupt:
+            stats = dict(scheduler.stats)
+        self.stdout.write(json.dumps(stats, ensure_ascii=False))
@@ -0,0 +1,202 @@
+import hashlib
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Границы бакетов гистограмм, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы бакетов числа SQL-запросов на HTTP-запрос
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_current = ContextVar('request_metrics', default=None)
+
+_NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+
+
+def fingerprint(sql):
+    """
+    Отпечаток запроса без значений: одинаковый для «SELECT ... WHERE id = 1» и «... = 2»
+    и для IN-списков любой длины. Повторы одного отпечатка за запрос — признак N+1.
+    """
+    normalized = _STRING_RE.sub('?', sql)
+    normalized = _NUMBER_RE.sub('?', normalized)
+    normalized = _IN_LIST_RE.sub('(...)', normalized)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+class RequestMetrics:
+    """Метрики одного HTTP-запроса: SQL-запросы, их время и отпечатки, время сериализации."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.fingerprints = Counter()
+        self.statements = {}
+        self.timings = defaultdict(float)
+        self._active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Хук connection.execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            key, normalized = fingerprint(sql)
+            self.fingerprints[key] += 1
+            self.statements.setdefault(key, normalized)
+
+    def duplicates(self):
+        """Отпечатки, выполненные больше одного раза: {fingerprint: count}."""
+        return {key: count for key, count in self.fingerprints.items() if count > 1}
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_metrics():
+    return _current.get()
+
+
+def execute_hook(execute, sql, params, many, context):
+    """
+    Хук execute_wrapper, стоящий на каждом соединении (core.signals): считает запрос в метриках
+    текущего HTTP-запроса. Соединения привязаны к потокам, а ContextVar копируется в
+    sync_to_async, поэтому так учитываются и запросы async-view; вне выборки — один ContextVar.get().
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@contextmanager
+def collect(metrics):
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Засечь время участка кода текущего запроса (если запрос попал в выборку).
+    Вложенные участки с тем же именем не считаются повторно.
+    """
+    metrics = _current.get()
+    if metrics is None or name in metrics._active:
+        yield
+        return
+    metrics._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - started
+        metrics._active.discard(name)
+
+
+class TimedSerializerMixin:
+    """Время to_representation попадает в метрику serializer (учитываются и вложенные, и many=True)."""
+
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Агрегаты по эндпоинтам в памяти процесса. Каждый воркер gunicorn отдаёт свои значения;
+    Prometheus различает их по instance и суммирует при запросе.
+    """
+
+    HISTOGRAMS = {
+        'http_request_duration_seconds': ('Время обработки запроса', DURATION_BUCKETS),
+        'sql_duration_seconds': ('Суммарное время SQL за запрос', DURATION_BUCKETS),
+        'sql_queries': ('Число SQL-запросов за запрос', QUERY_BUCKETS),
+        'serializer_duration_seconds': ('Время сериализации ответа', DURATION_BUCKETS),
+    }
+
+    def __init__(self, prefix='tgshop'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.histograms = {name: {} for name in self.HISTOGRAMS}
+        self.duplicates = Counter()
+
+    def observe(self, endpoint, method, metrics):
+        labels = (endpoint, method)
+        values = {
+            'http_request_duration_seconds': metrics.elapsed,
+            'sql_duration_seconds': metrics.sql_time,
+            'sql_queries': metrics.queries,
+            'serializer_duration_seconds': metrics.timings.get('serializer', 0.0),
+        }
+        with self.lock:
+            for name, value in values.items():
+                histogram = self.histograms[name].get(labels)
+                if histogram is None:
+                    histogram = self.histograms[name][labels] = Histogram(self.HISTOGRAMS[name][1])
+                histogram.observe(value)
+            for key, count in metrics.duplicates().items():
+                self.duplicates[labels + (key,)] += count - 1
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        lines = []
+        with self.lock:
+            for name, (description, buckets) in self.HISTOGRAMS.items():
+                metric = f'{self.prefix}_{name}'
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+                for (endpoint, method), histogram in sorted(self.histograms[name].items()):
+                    labels = f'endpoint="{_escape(endpoint)}",method="{method}"'
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum:.6f}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+
+            metric = f'{self.prefix}_duplicate_queries_total'
+            lines += [
+                f'# HELP {metric} Повторные выполнения одного и того же запроса (признак N+1)',
+                f'# TYPE {metric} counter',
+            ]
+            for (endpoint, method, key), count in sorted(self.duplicates.items()):
+                lines.append(
+                    f'{metric}{{endpoint="{_escape(endpoint)}",method="{method}",fingerprint="{key}"}} {count}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
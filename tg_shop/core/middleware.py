@@ -0,0 +1,132 @@
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .db import REPLICA, _use_replica
+from .metrics import RequestMetrics, collect, registry
+
+logger = logging.getLogger(__name__)
+
+
+class SyncAndAsyncMiddleware:
+    """
+    Основа middleware, работающих и под WSGI, и под ASGI: в async-цепочке __call__ —
+    корутина (__acall__), и Django не переключает каждый запрос между потоком и event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+    def handle(self, request):
+        raise NotImplementedError
+
+
+class QueryMetricsMiddleware(SyncAndAsyncMiddleware):
+    """
+    Для доли запросов METRICS_SAMPLE_RATE считает число SQL-запросов, их суммарное время,
+    повторы одинаковых запросов и время сериализации. Результат — заголовок Server-Timing
+    и гистограммы по эндпоинтам в /api/_metrics. SQL считает хук соединений
+    (core.metrics.execute_hook), поэтому учитываются и запросы async-view из sync_to_async.
+    """
+
+    def handle(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        with collect(metrics):
+            response = self.get_response(request)
+        return self.finish(request, metrics, response)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        with collect(metrics):
+            response = await self.get_response(request)
+        return self.finish(request, metrics, response)
+
+    def finish(self, request, metrics, response):
+        match = request.resolver_match
+        if match is None or match.url_name != 'metrics':
+            # Шаблон маршрута, а не путь: число меток не растёт с числом объектов
+            endpoint = match.route.replace('^', '').rstrip('$') if match else '<unmatched>'
+            registry.observe(endpoint, request.method, metrics)
+            self.report_duplicates(request, metrics)
+
+        response['Server-Timing'] = self.server_timing(metrics)
+        return response
+
+    def server_timing(self, metrics):
+        duplicates = sum(count - 1 for count in metrics.duplicates().values())
+        entries = [
+            f'db;dur={metrics.sql_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f'dup;desc="{duplicates} duplicate queries"',
+            f'total;dur={metrics.elapsed * 1000:.1f}',
+        ]
+        if 'serializer' in metrics.timings:
+            entries.insert(1, f'serializer;dur={metrics.timings["serializer"] * 1000:.1f}')
+        return ', '.join(entries)
+
+    def report_duplicates(self, request, metrics):
+        for key, count in metrics.duplicates().items():
+            if count >= settings.METRICS_DUPLICATE_THRESHOLD:
+                logger.warning(
+                    "Возможный N+1 на %s %s: запрос %s выполнен %s раз: %s",
+                    request.method, request.path, key, count, metrics.statements[key][:500],
+                )
+
+
+class ReplicaMiddleware(SyncAndAsyncMiddleware):
+    """
+    GET/HEAD к эндпоинтам из DB_REPLICA_URL_NAMES читают с реплики (core.db.ReplicaRouter).
+    Без настроенной реплики ничего не меняет. Флаг действует до возврата ответа: потоковые
+    ответы (экспорт каталога) итерируются позже и читают из default.
+    """
+
+    def handle(self, request):
+        if REPLICA not in settings.DATABASES:
+            return self.get_response(request)
+        token = _use_replica.set(self.use_replica(request))
+        try:
+            return self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+    async def __acall__(self, request):
+        if REPLICA not in settings.DATABASES:
+            return await self.get_response(request)
+        # ContextVar копируется в sync_to_async, и флаг видят запросы ORM async-view
+        token = _use_replica.set(self.use_replica(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+    def use_replica(self, request):
+        # Маршрут определяется здесь, а не в process_view: под ASGI process_view выполняется
+        # в копии контекста, и флаг не дошёл бы до async-view
+        return request.method in ('GET', 'HEAD') and self.url_name(request) in settings.DB_REPLICA_URL_NAMES
+
+    @staticmethod
+    def url_name(request):
+        try:
+            return resolve(request.path_info, getattr(request, 'urlconf', None)).url_name
+        except Resolver404:
+            return None
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_alter_store_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productquestion',
+            name='external_question_id',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='productquestion',
+            constraint=models.UniqueConstraint(fields=('marketplace', 'external_question_id'), name='uniq_question_marketplace_external_id'),
+        ),
+    ]
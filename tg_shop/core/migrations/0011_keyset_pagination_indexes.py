@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_productquestion_external_question_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productquestion',
+            index=models.Index(fields=['created_at', 'id'], name='question_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productquestionmessage',
+            index=models.Index(fields=['sent_at', 'id'], name='message_sent_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionanswer',
+            index=models.Index(fields=['sent_at', 'id'], name='answer_sent_id_idx'),
+        ),
+    ]
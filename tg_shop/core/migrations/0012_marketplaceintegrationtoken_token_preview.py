@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+def fill_token_preview(apps, schema_editor):
+    from core.utils.crypto import decrypt_token, mask_token
+
+    MarketplaceIntegrationToken = apps.get_model('core', 'MarketplaceIntegrationToken')
+    batch = []
+    for token in MarketplaceIntegrationToken.objects.only('id', '_token').iterator(chunk_size=500):
+        try:
+            token.token_preview = mask_token(decrypt_token(token._token))
+        except Exception:
+            token.token_preview = '********'
+        batch.append(token)
+        if len(batch) >= 500:
+            MarketplaceIntegrationToken.objects.bulk_update(batch, ['token_preview'])
+            batch = []
+    MarketplaceIntegrationToken.objects.bulk_update(batch, ['token_preview'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marketplaceintegrationtoken',
+            name='token_preview',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(fill_token_preview, migrations.RunPython.noop),
+    ]
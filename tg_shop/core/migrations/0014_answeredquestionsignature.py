@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_aianswerjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnsweredQuestionSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.BinaryField()),
+                ('answer', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='signature', to='core.productquestion')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.store')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['store', 'updated_at'], name='signature_store_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+def _drop_fk_index(model_name, name, index_name, field):
+    """Снять db_index с FK: в состоянии — AlterField, в базе — только удаление индекса."""
+    return migrations.SeparateDatabaseAndState(
+        state_operations=[migrations.AlterField(model_name=model_name, name=name, field=field)],
+        database_operations=[migrations.RunSQL(
+            f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"',
+            reverse_sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index_name}" '
+                        f'ON "core_{model_name}" ("{name}_id")',
+        )],
+    )
+
+
+class Migration(migrations.Migration):
+    # индексы строятся CONCURRENTLY, без блокировки записи в горячие таблицы
+    atomic = False
+
+    dependencies = [
+        ('core', '0014_answeredquestionsignature'),
+    ]
+
+    operations = [
+        # сначала составные индексы, затем удаление покрытых ими одиночных
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['store', '-id'], name='product_store_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestion',
+            index=models.Index(fields=['user', '-created_at'], name='question_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestion',
+            index=models.Index(fields=['product', 'is_resolved'], name='question_product_resolved_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestion',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['product', 'created_at'], name='question_unresolved_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestionmessage',
+            index=models.Index(fields=['question', 'sent_at'], name='message_question_sent_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='questionanswer',
+            index=models.Index(fields=['question', 'sent_at'], name='answer_question_sent_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='questionanswer',
+            index=models.Index(fields=['responder', '-sent_at', '-id'], name='answer_responder_sent_idx'),
+        ),
+        # AlterField(db_index=False) в базе пересоздал бы FK-ограничения (с проверкой всей
+        # таблицы) и удалил бы индексы под блокировкой; в базе только DROP INDEX CONCURRENTLY
+        _drop_fk_index('product', 'store', 'core_product_store_id_7345bf6e', models.ForeignKey(
+            db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='core.store')),
+        _drop_fk_index('productquestion', 'product', 'core_productquestion_product_id_e2489068', models.ForeignKey(
+            db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='core.product')),
+        _drop_fk_index('productquestion', 'user', 'core_productquestion_user_id_05d254a9', models.ForeignKey(
+            db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+        _drop_fk_index('productquestionmessage', 'question', 'core_productquestionmessage_question_id_0b469b03', models.ForeignKey(
+            db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='core.productquestion')),
+        _drop_fk_index('questionanswer', 'question', 'core_questionanswer_question_id_c26506e9', models.ForeignKey(
+            db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='core.productquestion')),
+        _drop_fk_index('questionanswer', 'responder', 'core_questionanswer_responder_id_8fdeb195', models.ForeignKey(
+            blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:31
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+# search_vector пересчитывается триггером BEFORE INSERT/UPDATE: так его заполняют и bulk_create,
+# и COPY импорта каталога, и прямые UPDATE, которые обходят сигналы Django.
+# Русская и английская конфигурации вместе: в каталогах и вопросах тексты смешанные.
+TRIGGERS = {
+    'core_product': (
+        'sku, title, description',
+        "setweight(to_tsvector('simple', coalesce(NEW.sku, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B')",
+    ),
+    'core_productquestion': (
+        'product_id, text',
+        "to_tsvector('russian', coalesce(NEW.text, '')) || to_tsvector('english', coalesce(NEW.text, ''))",
+    ),
+    'core_productquestionmessage': (
+        'question_id, text',
+        "to_tsvector('russian', coalesce(NEW.text, '')) || to_tsvector('english', coalesce(NEW.text, ''))",
+    ),
+}
+
+# store_id вопросов и сообщений — копия магазина товара: поиск фильтрует по нему без JOIN.
+# Вопросы заполняются раньше сообщений (порядок TRIGGERS важен для backfill)
+STORE_LOOKUPS = {
+    'core_productquestion': "SELECT store_id INTO NEW.store_id FROM core_product WHERE id = NEW.product_id;",
+    'core_productquestionmessage': "SELECT store_id INTO NEW.store_id FROM core_productquestion WHERE id = NEW.question_id;",
+}
+
+BACKFILL_BATCH_SIZE = 10_000
+
+
+def create_triggers_sql():
+    statements = []
+    for table, (columns, expression) in TRIGGERS.items():
+        statements.append(f"""
+            CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {expression};
+                {STORE_LOOKUPS.get(table, '')}
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER {table}_search_vector_trg
+                BEFORE INSERT OR UPDATE OF {columns} ON {table}
+                FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_update();
+        """)
+    return '\n'.join(statements)
+
+
+def drop_triggers_sql():
+    return '\n'.join(
+        f"DROP TRIGGER IF EXISTS {table}_search_vector_trg ON {table};"
+        f"DROP FUNCTION IF EXISTS {table}_search_vector_update();"
+        for table in TRIGGERS
+    )
+
+
+def backfill(apps, schema_editor):
+    # Пачками по id: миграция не атомарная, каждая пачка — отдельная короткая транзакция
+    with schema_editor.connection.cursor() as cursor:
+        for table, (columns, _) in TRIGGERS.items():
+            column = columns.split(', ')[-1]
+            cursor.execute(f"SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM {table}")
+            low, high = cursor.fetchone()
+            for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+                # UPDATE OF <колонка> запускает триггер
+                cursor.execute(
+                    f"UPDATE {table} SET {column} = {column} WHERE id >= %s AND id < %s AND search_vector IS NULL",
+                    [start, start + BACKFILL_BATCH_SIZE],
+                )
+
+
+class Migration(migrations.Migration):
+    # GIN-индексы строятся CONCURRENTLY, без блокировки записи в горячие таблицы
+    atomic = False
+
+    dependencies = [
+        ('core', '0017_catalog_import'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productquestion',
+            name='store',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.store'),
+        ),
+        migrations.AddField(
+            model_name='productquestionmessage',
+            name='store',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.store'),
+        ),
+        migrations.AddField(
+            model_name='productquestion',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productquestionmessage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(create_triggers_sql(), drop_triggers_sql()),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='product_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestion',
+            index=models.Index(fields=['store'], name='question_store_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestion',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='question_search_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestionmessage',
+            index=models.Index(fields=['store'], name='message_store_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productquestionmessage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='message_search_idx'),
+        ),
+    ]
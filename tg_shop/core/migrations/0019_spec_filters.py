@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:07
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+# Число из значения характеристики: JSON-число или строка-число ("2", "-0.5"), иначе NULL.
+# IMMUTABLE — можно строить индексы по выражению core_spec_numeric(specifications -> 'ключ')
+CREATE_SPEC_NUMERIC = r"""
+CREATE OR REPLACE FUNCTION core_spec_numeric(value jsonb) RETURNS numeric
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(value) = 'number' THEN (value #>> '{}')::numeric
+        WHEN jsonb_typeof(value) = 'string' AND (value #>> '{}') ~ '^\s*-?\d+(\.\d+)?\s*$'
+            THEN (value #>> '{}')::numeric
+    END
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+    # GIN-индекс строится CONCURRENTLY, без блокировки записи в core_product
+    atomic = False
+
+    dependencies = [
+        ('core', '0018_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecKeyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('filter_count', models.PositiveBigIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('value_type', models.CharField(blank=True, choices=[('text', 'Текст'), ('numeric', 'Число')], max_length=16)),
+                ('index_name', models.CharField(blank=True, max_length=63)),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunSQL(CREATE_SPEC_NUMERIC, "DROP FUNCTION IF EXISTS core_spec_numeric(jsonb);"),
+        AddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['specifications'], name='product_specs_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
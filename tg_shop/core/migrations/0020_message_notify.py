@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:02
+
+from django.db import migrations
+
+# Уведомление о новых сообщениях для SSE (core.realtime): один NOTIFY на магазин и до 500 id
+# за оператор, а не на каждую строку — bulk_create ИИ-воркера и пакетная загрузка не
+# забивают очередь уведомлений. Полезная нагрузка — только id (лимит NOTIFY 8000 байт),
+# сами строки слушатель читает из БД. Уведомления доставляются после COMMIT.
+CREATE_NOTIFY_TRIGGER = """
+CREATE OR REPLACE FUNCTION core_productquestionmessage_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('core_messages', json_build_object('store', store_id, 'ids', ids)::text)
+    FROM (
+        SELECT store_id, array_agg(id ORDER BY id) AS ids
+        FROM (
+            SELECT store_id, id, (row_number() OVER (PARTITION BY store_id ORDER BY id) - 1) / 500 AS chunk
+            FROM inserted
+            WHERE store_id IS NOT NULL
+        ) AS numbered
+        GROUP BY store_id, chunk
+    ) AS batches;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_productquestionmessage_notify_trg
+    AFTER INSERT ON core_productquestionmessage
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION core_productquestionmessage_notify();
+"""
+
+DROP_NOTIFY_TRIGGER = """
+DROP TRIGGER IF EXISTS core_productquestionmessage_notify_trg ON core_productquestionmessage;
+DROP FUNCTION IF EXISTS core_productquestionmessage_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_spec_filters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NOTIFY_TRIGGER, DROP_NOTIFY_TRIGGER),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_message_notify'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketplaceSyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cursor', models.CharField(blank=True, max_length=255)),
+                ('fetched', models.PositiveBigIntegerField(default=0)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('marketplace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.marketplace')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.store')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('store', 'marketplace'), name='uniq_sync_cursor_store_marketplace')],
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# Outbox ответов: строка доставки создаётся в той же транзакции, что и сообщение, при любом
+# способе вставки (API, bulk_create ИИ-воркера). Отправлять есть куда, только если вопрос
+# пришёл с маркетплейса. Триггер на оператор, как core_productquestionmessage_notify.
+CREATE_DELIVERY_TRIGGER = """
+CREATE OR REPLACE FUNCTION core_answerdelivery_enqueue() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO core_answerdelivery (
+        message_id, question_id, store_id, marketplace_id,
+        status, attempts, next_attempt_at, locked_by, error, created_at
+    )
+    SELECT inserted.id, inserted.question_id, question.store_id, question.marketplace_id,
+           'pending', 0, now(), '', '', now()
+    FROM inserted
+    JOIN core_productquestion AS question ON question.id = inserted.question_id
+    WHERE inserted.role IN ('manager', 'owner', 'ai')
+      AND question.marketplace_id IS NOT NULL
+      AND question.external_question_id IS NOT NULL;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_answerdelivery_enqueue_trg
+    AFTER INSERT ON core_productquestionmessage
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION core_answerdelivery_enqueue();
+"""
+
+DROP_DELIVERY_TRIGGER = """
+DROP TRIGGER IF EXISTS core_answerdelivery_enqueue_trg ON core_productquestionmessage;
+DROP FUNCTION IF EXISTS core_answerdelivery_enqueue();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_marketplace_sync_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('sending', 'Отправляется'), ('delivered', 'Доставлено'), ('dead', 'Не доставлено')], default='pending', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=64)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('marketplace', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.marketplace')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='delivery', to='core.productquestionmessage')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.productquestion')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.store')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status__in', ['pending', 'sending', 'dead'])), fields=['marketplace', 'next_attempt_at'], name='delivery_undelivered_idx')],
+            },
+        ),
+        migrations.RunSQL(CREATE_DELIVERY_TRIGGER, DROP_DELIVERY_TRIGGER),
+    ]
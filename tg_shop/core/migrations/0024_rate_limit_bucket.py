@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+# Корзины меняются на каждый запрос к API: без WAL запись дешевле, а терять после сбоя нечего
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_question_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('allowed', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunSQL(
+            "ALTER TABLE core_ratelimitbucket SET UNLOGGED",
+            reverse_sql="ALTER TABLE core_ratelimitbucket SET LOGGED",
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_cache_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnmatchedMarketplaceQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_id', models.CharField(max_length=128)),
+                ('sku', models.CharField(blank=True, max_length=64)),
+                ('author', models.CharField(blank=True, max_length=255)),
+                ('text', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('marketplace', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.marketplace')),
+                ('store', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.store')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['store', 'sku'], name='unmatched_question_sku_idx')],
+                'constraints': [models.UniqueConstraint(fields=('store', 'marketplace', 'question_id'), name='uniq_unmatched_question')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_unmatched_marketplace_question'),
+    ]
+
+    operations = [
+        # пользователь вопроса определяется по ID покупателя или вопроса, имя автора не нужно
+        migrations.RemoveField(
+            model_name='unmatchedmarketplacequestion',
+            name='author',
+        ),
+        migrations.AddField(
+            model_name='unmatchedmarketplacequestion',
+            name='customer_id',
+            field=models.CharField(blank=True, default='', max_length=128),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_unmatched_question_customer_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aianswerjob',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,12 +1,16 @@
 import uuid
 from datetime import timedelta
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.utils import timezone
 
-from .utils.crypto import encrypt_token, decrypt_token
+from .utils.crypto import encrypt_token, decrypt_token, mask_token, token_cache, token_cache_key, \
+    generate_api_key, hash_api_key
 
 
 # ────────────────────────────────────────
@@ -58,11 +62,8 @@ class CustomUser(AbstractUser):
 
     @property
     def shop(self):
-        if self.is_manager():
-            return self.store
-        elif self.is_owner() and hasattr(self, 'owned_store'):
-            return self.owned_store
-        return None
+        from .utils.utils import get_store_for_user
+        return get_store_for_user(self)
 
 
 class Marketplace(models.Model):
@@ -80,21 +81,89 @@ class Marketplace(models.Model):
 # Товар
 # ────────────────────────────────────────
 class Product(models.Model):
-    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='products')
+    # одиночный индекс по store_id покрывается составным product_store_id_idx
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='products', db_index=False)
+    # Артикул магазина: ключ импорта каталога (уникален в пределах магазина)
+    sku = models.CharField(max_length=64, null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField()
     specifications = models.JSONField(default=dict)  # {'weight': '1kg', 'color': 'black'}
     marketplaces = models.ManyToManyField(Marketplace, blank=True)
     created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
+    # Заполняется триггером в БД (russian + english, sku/title — вес A, description — B)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            # NULL не конфликтуют — товары без артикула не ограничены
+            models.UniqueConstraint(fields=['store', 'sku'], name='uniq_product_store_sku'),
+        ]
+        indexes = [
+            # список товаров магазина с keyset-пагинацией по -id
+            models.Index(fields=['store', '-id'], name='product_store_id_idx'),
+            GinIndex(fields=['search_vector'], name='product_search_idx'),
+            # фильтры по характеристикам: specifications @> '{"color": "black"}'
+            GinIndex(fields=['specifications'], opclasses=['jsonb_path_ops'], name='product_specs_idx'),
+            # нечёткий поиск по названию (pg_trgm): опечатки, часть слова
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='product_title_trgm_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.store.name})"
 
 
 class ProductImage(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        PROCESSING = 'processing', 'Обрабатывается'
+        READY = 'ready', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='products/')
+    # Оригинал; загруженные через API файлы лежат по ключу от хэша содержимого
+    image = models.ImageField(upload_to='products/', max_length=255, blank=True)
     caption = models.CharField(max_length=255, blank=True)
+    # Откуда скачать оригинал (импорт каталога); пока не скачан, image пустой
+    source_url = models.URLField(max_length=1000, blank=True)
+    # sha256 оригинала: одинаковые фото разных товаров хранятся и обрабатываются один раз
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # {'webp': {'320': 'products/renditions/...', ...}, 'avif': {...}}
+    renditions = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # очередь обработки: только необработанные фото
+            models.Index(fields=['created_at'], condition=Q(status__in=['pending', 'processing']),
+                         name='image_pending_idx'),
+        ]
+
+
+class SpecKeyUsage(models.Model):
+    """
+    Как часто ключ specifications встречается в фильтрах списка товаров.
+    Самые частые ключи promote_spec_keys переводит на типизированные btree-индексы по выражению.
+    """
+    class ValueType(models.TextChoices):
+        TEXT = 'text', 'Текст'
+        NUMERIC = 'numeric', 'Число'
+
+    key = models.CharField(max_length=64, unique=True)
+    filter_count = models.PositiveBigIntegerField(default=0)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+    # Заполняются promote_spec_keys: тип индекса и его имя
+    value_type = models.CharField(max_length=16, choices=ValueType.choices, blank=True)
+    index_name = models.CharField(max_length=63, blank=True)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.filter_count})"
 
 
 # ────────────────────────────────────────
@@ -131,33 +200,127 @@ class MarketplaceIntegrationToken(models.Model):
     store = models.ForeignKey('Store', on_delete=models.CASCADE, related_name='api_tokens')
     marketplace = models.ForeignKey('Marketplace', on_delete=models.CASCADE)
     _token = models.TextField(db_column='token')
+    # Маска токена считается при записи, чтобы список токенов не требовал расшифровки
+    token_preview = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('store', 'marketplace')  # Один токен на магазин + маркетплейс
 
+    def _cache_key(self):
+        return token_cache_key(self.store_id, self.marketplace_id, self._token)
+
     def set_token(self, raw_token):
+        if self._token:
+            token_cache.delete(self._cache_key())
         self._token = encrypt_token(raw_token)
+        self.token_preview = mask_token(raw_token)
 
     def get_token(self):
-        return decrypt_token(self._token)
+        return token_cache.get_or_set(self._cache_key(), lambda: decrypt_token(self._token))
 
     def __str__(self):
         return f"{self.store.name} → {self.marketplace.name}"
 
 
+class MarketplaceSyncCursor(models.Model):
+    """Позиция инкрементальной синхронизации вопросов магазина с маркетплейсом (core.sync)."""
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='+')
+    marketplace = models.ForeignKey(Marketplace, on_delete=models.CASCADE, related_name='+')
+    # Непрозрачное для планировщика значение — его понимает только адаптер маркетплейса
+    cursor = models.CharField(max_length=255, blank=True)
+    fetched = models.PositiveBigIntegerField(default=0)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    # Подряд неудачных опросов и последняя ошибка — для мониторинга
+    failures = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'marketplace'], name='uniq_sync_cursor_store_marketplace'),
+        ]
+
+    def __str__(self):
+        return f"{self.store_id} → {self.marketplace_id}: {self.cursor or '—'}"
+
+
+class UnmatchedMarketplaceQuestion(models.Model):
+    """
+    Вопрос маркетплейса, для артикула которого в магазине ещё нет товара (core.sync).
+    Курсор синхронизации уходит дальше, поэтому вопрос хранится здесь и загружается
+    следующим опросом магазина, как только товар с таким артикулом появится.
+    Здесь же ждёт повтора вопрос, который не удалось загрузить (ошибка ingest_questions).
+    """
+    # одиночный индекс по store_id покрывается составным unmatched_question_sku_idx
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='+', db_index=False)
+    marketplace = models.ForeignKey(Marketplace, on_delete=models.CASCADE, related_name='+', db_index=False)
+    question_id = models.CharField(max_length=128)
+    sku = models.CharField(max_length=64, blank=True)
+    customer_id = models.CharField(max_length=128, blank=True)
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'marketplace', 'question_id'],
+                                    name='uniq_unmatched_question'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'sku'], name='unmatched_question_sku_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.store_id} → {self.marketplace_id}: {self.sku or '—'} / {self.question_id}"
+
+
 class ProductQuestion(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='questions')
-    user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
+    # одиночные индексы по product_id и user_id покрываются составными индексами ниже
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='questions', db_index=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, db_index=False)
     text = models.TextField()
     marketplace = models.ForeignKey(Marketplace, on_delete=models.SET_NULL, null=True, blank=True)
     is_resolved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # ID вопроса на стороне маркетплейса — ключ идемпотентности при повторной загрузке
+    external_question_id = models.CharField(max_length=128, null=True, blank=True)
+    # Заголовок Idempotency-Key одиночной загрузки (с префиксом клиента) — повтор запроса не создаёт дубль
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, editable=False)
+    # Копия product.store_id и tsvector из text — заполняются триггером в БД.
+    # store_id нужен поиску: индекс по магазину пересекается с GIN-индексом (BitmapAnd) без JOIN
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, null=True, editable=False, related_name='+',
+                              db_index=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['marketplace', 'external_question_id'],
+                name='uniq_question_marketplace_external_id',
+            ),
+            # частичный: ключ есть только у вопросов, загруженных с Idempotency-Key
+            models.UniqueConstraint(
+                fields=['idempotency_key'], condition=Q(idempotency_key__isnull=False),
+                name='uniq_question_idempotency_key',
+            ),
+        ]
+        indexes = [
+            # keyset-пагинация списка вопросов
+            models.Index(fields=['created_at', 'id'], name='question_created_id_idx'),
+            # переписка пользователя (/api/conversations/)
+            models.Index(fields=['user', '-created_at'], name='question_user_created_idx'),
+            models.Index(fields=['product', 'is_resolved'], name='question_product_resolved_idx'),
+            # очередь неотвеченных вопросов — малая доля таблицы, частичный индекс
+            models.Index(fields=['product', 'created_at'], condition=Q(is_resolved=False),
+                         name='question_unresolved_idx'),
+            models.Index(fields=['store'], name='question_store_idx'),
+            GinIndex(fields=['search_vector'], name='question_search_idx'),
+        ]
 
 
 class QuestionAnswer(models.Model):
-    question = models.ForeignKey(ProductQuestion, on_delete=models.CASCADE, related_name='answers')
-    responder = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    # одиночные индексы покрываются составными answer_question_sent_idx / answer_responder_sent_idx
+    question = models.ForeignKey(ProductQuestion, on_delete=models.CASCADE, related_name='answers', db_index=False)
+    responder = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
     text = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
     role = models.CharField(max_length=16, choices=[
@@ -167,9 +330,18 @@ class QuestionAnswer(models.Model):
     ])
     marketplace = models.ForeignKey(Marketplace, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'id'], name='answer_sent_id_idx'),
+            models.Index(fields=['question', 'sent_at'], name='answer_question_sent_idx'),
+            # ответы сотрудника (QuestionAnswerViewSet) в порядке пагинации
+            models.Index(fields=['responder', '-sent_at', '-id'], name='answer_responder_sent_idx'),
+        ]
+
 
 class ProductQuestionMessage(models.Model):
-    question = models.ForeignKey(ProductQuestion, on_delete=models.CASCADE, related_name='messages')
+    # одиночный индекс по question_id покрывается составным message_question_sent_idx
+    question = models.ForeignKey(ProductQuestion, on_delete=models.CASCADE, related_name='messages', db_index=False)
     sender = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     text = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
@@ -181,6 +353,166 @@ class ProductQuestionMessage(models.Model):
     ])
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies')
     marketplace = models.ForeignKey(Marketplace, on_delete=models.SET_NULL, null=True, blank=True)
+    # Копия question.store_id и tsvector из text — заполняются триггером в БД (см. ProductQuestion)
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, null=True, editable=False, related_name='+',
+                              db_index=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'id'], name='message_sent_id_idx'),
+            models.Index(fields=['question', 'sent_at'], name='message_question_sent_idx'),
+            models.Index(fields=['store'], name='message_store_idx'),
+            GinIndex(fields=['search_vector'], name='message_search_idx'),
+        ]
 
     def __str__(self):
         return f"{self.role} ({self.sender}): {self.text[:30]}"
+
+
+
+# ────────────────────────────────────────
+# Очередь генерации ИИ-ответов
+# ────────────────────────────────────────
+class AIAnswerJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'В работе'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    question = models.OneToOneField(ProductQuestion, on_delete=models.CASCADE, related_name='ai_job')
+    # Денормализовано из вопроса: воркер группирует задачи по товару
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # после ошибки бэкенда задача ждёт повтора с экспоненциальной паузой
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # воркеры выбирают только незавершённые задачи — индекс по ним маленький
+            models.Index(fields=['created_at'], condition=Q(status__in=['pending', 'running']),
+                         name='ai_job_active_idx'),
+        ]
+
+    def __str__(self):
+        return f"AI job #{self.pk} ({self.status}) for question {self.question_id}"
+
+
+
+# ────────────────────────────────────────
+# Отправка ответов на маркетплейсы (outbox)
+# ────────────────────────────────────────
+class AnswerDelivery(models.Model):
+    """
+    Ответ сотрудника или ИИ, который нужно отправить на маркетплейс вопроса. Строки создаёт
+    триггер на вставку ProductQuestionMessage (миграция 0022) в той же транзакции, что и
+    сообщение, отправляет core.sync.delivery.DeliveryWorker.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        SENDING = 'sending', 'Отправляется'
+        DELIVERED = 'delivered', 'Доставлено'
+        DEAD = 'dead', 'Не доставлено'
+
+    message = models.OneToOneField(ProductQuestionMessage, on_delete=models.CASCADE, related_name='delivery')
+    question = models.ForeignKey(ProductQuestion, on_delete=models.CASCADE, related_name='+')
+    # Денормализовано из вопроса: воркер группирует отправку по (магазин, маркетплейс)
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='+')
+    # маркетплейсы не удаляются — отдельный индекс для каскада не нужен
+    marketplace = models.ForeignKey(Marketplace, on_delete=models.CASCADE, related_name='+', db_index=False)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # доставленные — почти вся таблица; воркеру и метрикам нужны остальные
+            models.Index(fields=['marketplace', 'next_attempt_at'],
+                         condition=Q(status__in=['pending', 'sending', 'dead']),
+                         name='delivery_undelivered_idx'),
+        ]
+
+    def __str__(self):
+        return f"Delivery #{self.pk} ({self.status}) of message {self.message_id}"
+
+
+# ────────────────────────────────────────
+# Индекс похожих вопросов (повторное использование ответов)
+# ────────────────────────────────────────
+class AnsweredQuestionSignature(models.Model):
+    question = models.OneToOneField(ProductQuestion, on_delete=models.CASCADE, related_name='signature')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='+')
+    # MinHash-сигнатура текста вопроса: numpy uint32[SIMILARITY_NUM_PERM] в байтах
+    signature = models.BinaryField()
+    answer = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'updated_at'], name='signature_store_updated_idx'),
+        ]
+
+
+# ────────────────────────────────────────
+# Ограничение частоты запросов к API
+# ────────────────────────────────────────
+class RateLimitBucket(models.Model):
+    """
+    Token bucket core.throttling.DatabaseBuckets, общий для всех процессов. Таблица UNLOGGED
+    (миграция 0024): после сбоя БД корзины просто начинаются заново полными.
+    """
+    # эндпоинт:клиент:магазин
+    key = models.CharField(max_length=255, primary_key=True)
+    tokens = models.FloatField()
+    # пропущен ли последний запрос — UPSERT возвращает только новую строку
+    allowed = models.BooleanField(default=True)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f}"
+
+
+# ────────────────────────────────────────
+# API-ключи магазинов для интеграций
+# ────────────────────────────────────────
+class StoreAPIKey(models.Model):
+    """
+    Ключ интеграции магазина (заголовок X-API-KEY): загрузка вопросов только к товарам магазина.
+    Хранится sha256 ключа, сам ключ показывается один раз при создании. Проверку выполняет
+    core.authentication.StoreAPIKeyAuthentication.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='api_keys')
+    name = models.CharField(max_length=100, blank=True)
+    # Начало ключа — чтобы узнать его в списке
+    prefix = models.CharField(max_length=12, editable=False)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def generate(cls, **fields):
+        """Новый ключ: (несохранённая запись, ключ в открытом виде)."""
+        raw_key = generate_api_key()
+        return cls(prefix=raw_key[:12], key_hash=hash_api_key(raw_key), **fields), raw_key
+
+    def revoke(self):
+        if self.revoked_at is None:
+            self.revoked_at = timezone.now()
+            self.save(update_fields=['revoked_at'])
+
+    def __str__(self):
+        return f"{self.prefix}… ({self.store.name})"
@@ -0,0 +1,138 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.db.models.fields.tuple_lookups import Tuple, TupleGreaterThan, TupleLessThan
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.utils.urls import replace_query_param
+
+
+INVALID_CURSOR_MESSAGE = 'Invalid cursor'
+
+
+def encode_cursor(values):
+    """
+    Непрозрачный курсор для keyset-пагинации: позиция последней строки страницы.
+    Даты сериализуются в isoformat с микросекундами — иначе теряется точность ключа.
+    """
+    payload = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    return urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        raise NotFound(INVALID_CURSOR_MESSAGE)
+    if not isinstance(values, list) or len(values) != size:
+        raise NotFound(INVALID_CURSOR_MESSAGE)
+    return values
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset-пагинация по составному ключу, например (created_at, id).
+
+    В отличие от стандартного CursorPagination, курсор хранит значения всех полей
+    сортировки, а не только первого, поэтому следующая страница выбирается условием
+    WHERE (created_at, id) > (...) по индексу — без OFFSET при совпадающих датах.
+    Стоимость любой страницы — O(page_size).
+
+    Сортировка задаётся во view атрибутом `pagination_ordering`; последнее поле
+    должно быть уникальным (обычно id).
+    """
+    ordering = ('-pk',)
+    page_size_query_param = 'page_size'
+    max_page_size = settings.PAGINATION_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'pagination_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            *position, reverse = decode_cursor(cursor, len(self.ordering) + 1)
+            position = self._parse_position(queryset.model, position)
+            if not isinstance(reverse, bool):
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+        else:
+            position, reverse = None, False
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after_position(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        # Двигаясь назад, мы пришли со страницы после текущей — значит, она есть
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def _parse_position(self, model, position):
+        """Значения курсора в типы полей сортировки; подделанный курсор — 404, а не 500."""
+        values = []
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            model_field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            try:
+                value = model_field.to_python(value)
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+            if value is None:
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _after_position(ordering, position):
+        """
+        Строки после позиции. Все поля в одном направлении — сравнение строк
+        (a, b) > (x, y), которое PostgreSQL выполняет одним диапазоном по составному индексу.
+        Направления разные — a > x OR (a = x AND b < y) и т.д. для каждого поля.
+        """
+        descending = {field.startswith('-') for field in ordering}
+        if len(descending) == 1:
+            lookup = TupleLessThan if descending.pop() else TupleGreaterThan
+            return lookup(Tuple(*(F(field.lstrip('-')) for field in ordering)), position)
+
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            prefix = {ordering[j].lstrip('-'): position[j] for j in range(i)}
+            condition |= Q(**prefix, **{f'{name}__{lookup}': position[i]})
+        return condition
+
+    def _link(self, row, reverse):
+        values = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        cursor = encode_cursor([*values, reverse])
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
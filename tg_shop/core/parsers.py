@@ -0,0 +1,34 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    application/x-ndjson: один JSON-объект на строку.
+
+    Возвращает генератор — тело запроса читается построчно по мере обработки,
+    а не загружается в память целиком. Невалидная строка отдаётся как None,
+    чтобы вызывающий код сообщил об ошибке для конкретного элемента.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if stream is None:
+            return iter(())
+        return self._iter_items(codecs.getreader(encoding)(stream))
+
+    @staticmethod
+    def _iter_items(reader):
+        for line in reader:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
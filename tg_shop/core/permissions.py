@@ -1,6 +1,10 @@
+import hmac
+
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 from django.conf import settings
 
+from .authentication import is_api_secret, request_store_key
+
 class IsOwnerOrManager(BasePermission):
     """
     Только владельцы магазинов и менеджеры могут использовать методы, кроме чтения.
@@ -19,6 +23,7 @@ class IsAuthenticatedOrAPISecret(BasePermission):
     """
     Доступ разрешён, если:
     - пользователь авторизован, ИЛИ
+    - запрос с X-API-KEY магазина (StoreAPIKeyAuthentication), ИЛИ
     - X-API-SECRET равен системному значению
     """
 
@@ -27,6 +32,23 @@ class IsAuthenticatedOrAPISecret(BasePermission):
         if request.user and request.user.is_authenticated:
             return True
 
-        # Альтернатива — секретный ключ
-        api_key = request.headers.get("X-API-SECRET")
-        return api_key == settings.EXTERNAL_API_SECRET
+        if request_store_key(request) is not None:
+            return True
+
+        # Альтернатива — общий секретный ключ
+        return is_api_secret(request.headers.get("X-API-SECRET"))
+
+
+class IsStaffOrMetricsToken(BasePermission):
+    """
+    Доступ к метрикам: staff-пользователь или X-METRICS-TOKEN, равный METRICS_TOKEN
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+
+        # сравнение за постоянное время, как у is_api_secret
+        token = request.headers.get("X-METRICS-TOKEN")
+        return bool(settings.METRICS_TOKEN and token) and hmac.compare_digest(
+            token.encode(), settings.METRICS_TOKEN.encode())
@@ -0,0 +1,193 @@
+"""
+Рассылка новых сообщений подписчикам SSE.
+
+Триггер core_productquestionmessage_notify (миграция 0020) после COMMIT шлёт NOTIFY
+core_messages с магазином и id вставленных сообщений. В каждом процессе ASGI одно
+соединение слушает канал, вторым соединением читает строки (одним запросом на пачку
+уведомлений) и раскладывает их по очередям подписчиков своего магазина.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+from collections import defaultdict
+
+import psycopg
+from django.conf import settings
+from django.db import connections
+from psycopg.rows import dict_row
+
+from core.models import ProductQuestionMessage
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'core_messages'
+MESSAGE_FIELDS = (
+    'id', 'question_id', 'store_id', 'sender_id', 'role', 'text', 'sent_at', 'parent_id', 'marketplace_id',
+)
+FETCH_SQL = (
+    f"SELECT {', '.join(MESSAGE_FIELDS)} FROM {ProductQuestionMessage._meta.db_table} "
+    f"WHERE id = ANY(%s) ORDER BY id"
+)
+
+
+def connection_params():
+    """Параметры подключения Django без его адаптеров и фабрики курсоров — для async-соединений psycopg."""
+    params = connections['default'].get_connection_params()
+    for key in ('cursor_factory', 'context', 'prepare_threshold'):
+        params.pop(key, None)
+    # sent_at в UTC, как у соединений Django
+    params['options'] = f"{params.get('options', '')} -c timezone=UTC".strip()
+    return params
+
+
+class Subscription:
+    """Очередь сообщений одного SSE-клиента: магазин целиком или одна переписка (question_id)."""
+
+    def __init__(self, store_id, question_id=None):
+        self.store_id = store_id
+        self.question_id = question_id
+        self.queue = asyncio.Queue(maxsize=settings.REALTIME_QUEUE_SIZE)
+        # События могли потеряться (очередь переполнена, переподключение LISTEN) — клиент
+        # должен дочитать пропущенное из БД
+        self.stale = False
+
+    def deliver(self, message):
+        if self.question_id is not None and message['question_id'] != self.question_id:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.mark_stale()
+
+    def mark_stale(self):
+        self.stale = True
+        if self.queue.empty():
+            # разбудить ожидающий queue.get()
+            self.queue.put_nowait(None)
+
+
+class MessageHub:
+    """LISTEN core_messages на процесс; запускается при первой подписке."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._pending = defaultdict(set)
+        self._loop = None
+        self._listener = None
+        self._flusher = None
+        self._query_connection = None
+
+    def subscribe(self, store_id, question_id=None):
+        self._ensure_listening()
+        subscription = Subscription(store_id, question_id)
+        self._subscriptions[store_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is not None and running is not self._loop and not self._loop.is_closed():
+            # response.close() выполняется в потоке sync_to_async
+            self._loop.call_soon_threadsafe(self._unsubscribe, subscription)
+        else:
+            self._unsubscribe(subscription)
+
+    def _unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.store_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.store_id]
+
+    @property
+    def subscribers(self):
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def _ensure_listening(self):
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and not self._listener.done() and self._loop is loop:
+            return
+        if self._loop is not loop:
+            # Новый event loop (тесты, перезапуск сервера) — подписки старого недействительны
+            self._subscriptions.clear()
+            self._pending.clear()
+            self._query_connection = None
+        self._loop = loop
+        # Пустой контекст: слушатель живёт дольше запроса, который его запустил
+        self._listener = loop.create_task(self._listen(), context=contextvars.Context())
+
+    async def stop(self):
+        for task in (self._listener, self._flusher):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if self._query_connection is not None:
+            await self._query_connection.close()
+        self._listener = self._flusher = self._query_connection = None
+
+    async def _listen(self):
+        delay = settings.REALTIME_RECONNECT_DELAY
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(**connection_params(), autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {CHANNEL}")
+                    delay = settings.REALTIME_RECONNECT_DELAY
+                    # Пока LISTEN не работал, уведомления терялись
+                    self._mark_stale(self._subscriptions)
+                    async for notify in conn.notifies():
+                        self._on_notify(notify.payload)
+            except (psycopg.Error, OSError):
+                logger.exception("LISTEN %s прерван, переподключение через %s с", CHANNEL, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, settings.REALTIME_RECONNECT_MAX_DELAY)
+
+    def _on_notify(self, payload):
+        try:
+            data = json.loads(payload)
+            store_id, ids = data['store'], data['ids']
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Некорректное уведомление %s: %r", CHANNEL, payload[:200])
+            return
+        if store_id not in self._subscriptions:
+            # в этом процессе магазин никто не слушает — в БД не ходим
+            return
+        self._pending[store_id].update(ids)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        # Уведомления, пришедшие во время запроса, уходят следующей пачкой
+        while self._pending:
+            pending, self._pending = self._pending, defaultdict(set)
+            try:
+                rows = await self._fetch([message_id for ids in pending.values() for message_id in ids])
+            except psycopg.Error:
+                logger.exception("Не удалось прочитать новые сообщения")
+                self._query_connection = None
+                self._mark_stale(pending)
+                continue
+            for row in rows:
+                for subscription in list(self._subscriptions.get(row['store_id'], ())):
+                    subscription.deliver(row)
+
+    async def _fetch(self, ids):
+        if self._query_connection is None or self._query_connection.closed:
+            self._query_connection = await psycopg.AsyncConnection.connect(
+                **connection_params(), autocommit=True, row_factory=dict_row,
+            )
+        cursor = await self._query_connection.execute(FETCH_SQL, [ids])
+        return await cursor.fetchall()
+
+    def _mark_stale(self, store_ids):
+        for store_id in list(store_ids):
+            for subscription in list(self._subscriptions.get(store_id, ())):
+                subscription.mark_stale()
+
+
+hub = MessageHub()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from core.models import ProductQuestionMessage
+from .hub import MESSAGE_FIELDS, hub
+
+# Через сколько миллисекунд EventSource переподключается после обрыва
+RETRY_MS = 3000
+
+
+def _jwt_user(request):
+    """
+    Пользователь по JWT из заголовка Authorization или ?token= — EventSource в браузере
+    не умеет передавать заголовки.
+    """
+    authentication = JWTAuthentication()
+    try:
+        token = request.GET.get('token')
+        if token:
+            return authentication.get_user(authentication.get_validated_token(token))
+        result = authentication.authenticate(request)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+async def stream_user(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    return await sync_to_async(_jwt_user)(request)
+
+
+def format_event(message, event='message'):
+    data = json.dumps(message, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return f"id: {message['id']}\nevent: {event}\ndata: {data}\n\n"
+
+
+async def last_message_id():
+    return (await ProductQuestionMessage.objects.aaggregate(last=Max('id')))['last'] or 0
+
+
+async def _replay(store_id, question_id, after_id):
+    queryset = ProductQuestionMessage.objects.filter(store_id=store_id, id__gt=after_id)
+    if question_id is not None:
+        queryset = queryset.filter(question_id=question_id)
+    limit = settings.REALTIME_REPLAY_LIMIT
+    return [row async for row in queryset.order_by('id').values(*MESSAGE_FIELDS)[:limit + 1]]
+
+
+class _RecentIds:
+    """Последние отправленные id: одно сообщение может прийти и из дочитывания, и из уведомления."""
+
+    def __init__(self, size=1000):
+        self._order = deque(maxlen=size)
+        self._ids = set()
+
+    def __contains__(self, message_id):
+        return message_id in self._ids
+
+    def add(self, message_id):
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0])
+        self._order.append(message_id)
+        self._ids.add(message_id)
+
+
+class MessageStream:
+    """
+    SSE-поток новых сообщений магазина или одной переписки — тело StreamingHttpResponse.
+
+    id события — id сообщения; EventSource после обрыва присылает его в Last-Event-ID, и
+    пропущенное дочитывается из БД (id > last_event_id). Если пропущено больше
+    REALTIME_REPLAY_LIMIT, приходит событие reset — клиент перечитывает переписку через REST.
+    """
+
+    def __init__(self, store_id, question_id=None, last_event_id=None):
+        self.store_id = store_id
+        self.question_id = question_id
+        self.last_event_id = last_event_id
+        # Подписка до первого чтения из БД: сообщение между запросом и подпиской не потеряется
+        self.subscription = hub.subscribe(store_id, question_id)
+
+    def close(self):
+        # Django вызывает close() ответа после отправки или отключения клиента —
+        # отписка не ждёт, пока сборщик мусора финализирует генератор
+        hub.unsubscribe(self.subscription)
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        subscription = self.subscription
+        sent = _RecentIds()
+        if self.last_event_id is None:
+            last_id = await last_message_id()
+        else:
+            last_id = self.last_event_id
+            subscription.stale = True
+        yield f"retry: {RETRY_MS}\n\n"
+
+        while True:
+            if subscription.stale:
+                subscription.stale = False
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                rows = await _replay(self.store_id, self.question_id, last_id)
+                if len(rows) > settings.REALTIME_REPLAY_LIMIT:
+                    last_id = await last_message_id()
+                    yield format_event({'id': last_id}, event='reset')
+                    continue
+                for row in rows:
+                    sent.add(row['id'])
+                    last_id = max(last_id, row['id'])
+                    yield format_event(row)
+
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), settings.REALTIME_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # комментарий SSE: не даёт прокси закрыть простаивающее соединение
+                yield ": ping\n\n"
+                continue
+            # Сообщения с меньшим id могут закоммититься позже — фильтруем по отправленным, а не по last_id
+            if message is None or message['id'] in sent:
+                continue
+            sent.add(message['id'])
+            last_id = max(last_id, message['id'])
+            yield format_event(message)
@@ -1,14 +1,20 @@
+from django.conf import settings
+from django.db.models import Prefetch
 from django.utils.crypto import get_random_string
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 
+from .authentication import request_store_key
+from .images.storage import parse_original_key, save_originals, smallest_rendition_url, srcset
+from .metrics import TimedSerializerMixin
+
 User = get_user_model()
 
 # --- Регистрация владельца и менеджера ---
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Store, MarketplaceIntegrationToken, ProductImage, Product, Marketplace, QuestionAnswer, \
-    ProductQuestion, ProductQuestionMessage, CustomUser
+    ProductQuestion, ProductQuestionMessage, CustomUser, StoreAPIKey
 
 User = get_user_model()
 
@@ -56,7 +62,7 @@ class ManagerInviteSerializer(serializers.ModelSerializer):
         return user
 
 # --- CRUD для менеджеров ---
-class ManagerSerializer(serializers.ModelSerializer):
+class ManagerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'telegram_id', 'contact_phone', 'store']
@@ -89,9 +95,8 @@ class InviteByTokenSerializer(serializers.ModelSerializer):
         token.save()
         return user
 
-class MarketplaceTokenSerializer(serializers.ModelSerializer):
+class MarketplaceTokenSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     token = serializers.CharField(write_only=True)
-    token_preview = serializers.SerializerMethodField(read_only=True)
     marketplace = serializers.SlugRelatedField(
         slug_field='name',
         queryset=Marketplace.objects.all()
@@ -117,22 +122,66 @@ class MarketplaceTokenSerializer(serializers.ModelSerializer):
             instance.save()
         return instance
 
-    def get_token_preview(self, obj):
-        try:
-            token = obj.get_token()
-            if len(token) <= 8:
-                return '*' * len(token)
-            return f"{token[:4]}{'*' * (len(token)-8)}{token[-4:]}"
-        except Exception:
-            return "********"
+class StoreAPIKeySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Ключ в открытом виде есть только в ответе на создание — в БД хранится его хэш
+    key = serializers.SerializerMethodField()
+
+    class Meta:
+        model = StoreAPIKey
+        fields = ['id', 'name', 'prefix', 'key', 'created_at', 'revoked_at']
+        read_only_fields = ['id', 'prefix', 'created_at', 'revoked_at']
+
+    def get_key(self, obj):
+        return getattr(obj, 'raw_key', None)
+
+    def create(self, validated_data):
+        instance, raw_key = StoreAPIKey.generate(**validated_data)
+        instance.save()
+        instance.raw_key = raw_key
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data['key'] is None:
+            del data['key']
+        return data
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'caption']
-        read_only_fields = ['id']
+        fields = ['id', 'image', 'caption', 'width', 'height', 'status', 'srcset']
+        read_only_fields = ['id', 'width', 'height', 'status']
+
+    def get_srcset(self, obj):
+        # Пока превью не готовы — пустой словарь, клиент показывает оригинал
+        return srcset(obj.renditions)
+
 
+class ImageUploadRequestSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    content_type = serializers.RegexField(r'^image/[a-z0-9.+-]+$', max_length=100)
+    size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$', help_text="sha256 содержимого файла (hex)")
 
-class ProductSerializer(serializers.ModelSerializer):
+    def validate_size(self, value):
+        if value > settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Файл больше {settings.IMAGE_UPLOAD_MAX_SIZE} байт")
+        return value
+
+
+class ImageConfirmSerializer(serializers.Serializer):
+    key = serializers.CharField(max_length=255)
+    caption = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+    def validate_key(self, value):
+        if parse_original_key(value) is None:
+            raise serializers.ValidationError("Ключ не получен через images/presign")
+        return value
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, required=False, read_only=True)
     marketplaces = serializers.SlugRelatedField(
         many=True,
@@ -142,9 +191,19 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'title', 'description', 'specifications', 'marketplaces', 'images']
+        fields = ['id', 'sku', 'title', 'description', 'specifications', 'marketplaces', 'images']
         read_only_fields = ['id']
 
+    def validate_sku(self, value):
+        if not value:
+            return None
+        duplicates = Product.objects.filter(store=self.context['store'], sku=value)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError("Товар с таким артикулом уже есть в магазине")
+        return value
+
     def create(self, validated_data):
         # забираем данные из context
         store = self.context['store']
@@ -158,10 +217,13 @@ class ProductSerializer(serializers.ModelSerializer):
         product = Product.objects.create(store=store, created_by=user, **validated_data)
         product.marketplaces.set(marketplaces)
 
-        # обработка изображений (multipart)
+        # обработка изображений (multipart): оригинал — по хэшу содержимого,
+        # превью создаёт run_image_workers
         images = self.context['request'].FILES.getlist('images')
-        for image in images:
-            ProductImage.objects.create(product=product, image=image)
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=key, content_hash=content_hash)
+            for key, content_hash in save_originals(images)
+        ])
 
         return product
 
@@ -176,7 +238,7 @@ class ProductSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class QuestionAnswerSerializer(serializers.ModelSerializer):
+class QuestionAnswerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     responder_role = serializers.SerializerMethodField()
     marketplace = serializers.SerializerMethodField(read_only=True)
 
@@ -206,7 +268,7 @@ class QuestionAnswerSerializer(serializers.ModelSerializer):
 
         return super().create(validated_data)
 
-class ProductQuestionSerializer(serializers.ModelSerializer):
+class ProductQuestionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     marketplace = serializers.SlugRelatedField(
         queryset=Marketplace.objects.all(),
         slug_field='name',
@@ -235,7 +297,7 @@ class QuestionMessageSerializer(serializers.ModelSerializer):
         model = ProductQuestionMessage
         fields = ['id', 'text', 'role', 'sender', 'sent_at']
 
-class QuestionWithMessagesSerializer(serializers.ModelSerializer):
+class QuestionWithMessagesSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = serializers.SerializerMethodField()
     messages = serializers.SerializerMethodField()
     marketplace = serializers.SerializerMethodField()
@@ -253,11 +315,24 @@ class QuestionWithMessagesSerializer(serializers.ModelSerializer):
     def get_marketplace(self, obj):
         return obj.marketplace.name if obj.marketplace else None
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        План загрузки для списка вопросов: товар и маркетплейс — через JOIN,
+        сообщения с отправителями — одним дополнительным запросом на весь список.
+        """
+        return queryset.select_related('product', 'marketplace').prefetch_related(
+            Prefetch(
+                'messages',
+                queryset=ProductQuestionMessage.objects.select_related('sender').order_by('sent_at', 'id'),
+            )
+        )
+
     def get_messages(self, obj):
-        messages = ProductQuestionMessage.objects.filter(question=obj).order_by("sent_at")
-        return QuestionMessageSerializer(messages, many=True).data
+        # Используем prefetch из setup_eager_loading, а не новый запрос на каждый вопрос
+        return QuestionMessageSerializer(obj.messages.all(), many=True).data
 
-class ProductQuestionMessageSerializer(serializers.ModelSerializer):
+class ProductQuestionMessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     marketplace = serializers.SerializerMethodField(read_only=True)
     sender_role = serializers.SerializerMethodField()
 
@@ -272,6 +347,23 @@ class ProductQuestionMessageSerializer(serializers.ModelSerializer):
     def get_sender_role(self, obj):
         return obj.role
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # сообщение не переносится в другой вопрос
+        if self.instance is not None:
+            fields['question'].read_only = True
+        return fields
+
+    def validate(self, attrs):
+        question = attrs.get('question') or getattr(self.instance, 'question', None)
+        store_key = request_store_key(self.context.get('request'))
+        if store_key is not None and question is not None and question.store_id != store_key.store_id:
+            raise serializers.ValidationError({'question': 'Вопрос другого магазина'})
+        parent = attrs.get('parent')
+        if parent is not None and question is not None and parent.question_id != question.id:
+            raise serializers.ValidationError({'parent': 'Сообщение другого вопроса'})
+        return attrs
+
     def create(self, validated_data):
         request = self.context.get('request')
         user = getattr(request, 'user', None)
@@ -296,12 +388,22 @@ class ProductListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = [
-            "id", "title", "description", "characteristics",
-            "marketplaces", "images", "created_at"
+            "id", "title", "description", "specifications",
+            "marketplaces", "images"
         ]
 
     def get_images(self, obj):
-        return [img.image.url for img in obj.images.all()]
+        # Для сетки товаров — самое маленькое превью и srcset вместо оригинала
+        return [
+            {
+                "id": img.id,
+                "src": smallest_rendition_url(img.renditions) or img.image.url,
+                "srcset": srcset(img.renditions),
+                "width": img.width,
+                "height": img.height,
+            }
+            for img in obj.images.all()
+        ]
 
 
 
@@ -0,0 +1,89 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .ai.context import invalidate_product_context, ANSWER_ROLES
+from .ai.queue import enqueue_questions
+from .ai.similarity import remember_answer
+from .authentication import invalidate_api_key
+from .metrics import execute_hook
+from .models import Store, CustomUser, ProductQuestion, Product, ProductImage, ProductQuestionMessage, \
+    QuestionAnswer, StoreAPIKey
+from .utils.utils import invalidate_store_cache
+
+
+# ────────────────────────────────────────
+# Метрики SQL-запросов (QueryMetricsMiddleware)
+# ────────────────────────────────────────
+@receiver(connection_created)
+def install_metrics_hook(sender, connection, **kwargs):
+    # Сигнал приходит и при переподключении той же обёртки соединения
+    if execute_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_hook)
+
+
+# ────────────────────────────────────────
+# Кэш магазина пользователя
+# ────────────────────────────────────────
+@receiver([post_save, post_delete], sender=Store)
+def store_changed(sender, instance, **kwargs):
+    # Магазин меняется редко, а ссылаются на него и владелец, и все менеджеры
+    invalidate_store_cache()
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    invalidate_store_cache(instance.pk)
+
+
+# ────────────────────────────────────────
+# Кэш API-ключей магазинов
+# ────────────────────────────────────────
+@receiver([post_save, post_delete], sender=StoreAPIKey)
+def api_key_changed(sender, instance, **kwargs):
+    # отзыв действует в этом процессе сразу, в остальных — по истечении API_KEY_CACHE_TTL
+    invalidate_api_key(instance.key_hash)
+
+
+# ────────────────────────────────────────
+# Очередь ИИ-ответов
+# ────────────────────────────────────────
+@receiver(post_save, sender=ProductQuestion)
+def question_created(sender, instance, created, **kwargs):
+    if created and not instance.is_resolved:
+        enqueue_questions([(instance.id, instance.product_id)])
+
+
+# ────────────────────────────────────────
+# Кэш контекста товара для ИИ
+# ────────────────────────────────────────
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    invalidate_product_context(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    invalidate_product_context(instance.product_id)
+
+
+@receiver(m2m_changed, sender=Product.marketplaces.through)
+def product_marketplaces_changed(sender, instance, reverse, pk_set, **kwargs):
+    if kwargs['action'] not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_product_context(instance.pk)
+    else:
+        # marketplace.product_set.add(...) — instance это маркетплейс
+        for product_id in pk_set or ():
+            invalidate_product_context(product_id)
+
+
+@receiver(post_save, sender=ProductQuestionMessage)
+@receiver(post_save, sender=QuestionAnswer)
+def answer_created(sender, instance, created, **kwargs):
+    # В контекст и индекс похожих вопросов попадают только ответы сотрудников
+    if created and instance.role in ANSWER_ROLES:
+        question = instance.question
+        invalidate_product_context(question.product_id)
+        remember_answer(question, instance.text)
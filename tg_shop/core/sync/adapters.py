@@ -0,0 +1,221 @@
+"""
+Адаптеры API вопросов маркетплейсов.
+
+Адаптер читает вопросы (fetch_questions) и отправляет ответы на них (send_answer).
+Вопросы переводятся в общий вид:
+{'question_id', 'sku', 'text', 'customer_id', 'created_at'}, где sku — артикул продавца
+(Product.sku), customer_id — постоянный ID покупателя на маркетплейсе или None,
+а created_at — строка в формате маркетплейса. Отображаемое имя автора не передаётся:
+по нему разных покупателей не различить.
+
+Вопросы запрашиваются по возрастанию даты начиная с курсора (включительно), поэтому
+курсор страницы — дата последнего вопроса на ней. Вопросы на границе приходят повторно
+и отбрасываются ingest_questions как дубли по (marketplace, question_id).
+"""
+from collections import namedtuple
+
+import httpx
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+
+class SyncError(Exception):
+    """Опрос маркетплейса не удался; retry_after — пауза в секундах, если её назвал маркетплейс."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(SyncError):
+    pass
+
+
+class InvalidTokenError(SyncError):
+    pass
+
+
+# cursor — курсор после этой страницы (None — страница пуста, курсор не меняется),
+# next_page — продолжение в рамках того же прохода (None — вопросы кончились)
+Page = namedtuple('Page', 'questions cursor next_page')
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+class BaseMarketplaceAdapter:
+    name = None
+    base_url = None
+    page_size = 100
+
+    def fetch_questions(self, client, token, cursor, page=None):
+        """
+        Корутина: страница вопросов, созданных не раньше cursor ('' — с самого начала).
+        Все страницы одного прохода запрашиваются с курсором на начало прохода.
+        """
+        raise NotImplementedError
+
+    def send_answer(self, client, token, question_id, text):
+        """Корутина: опубликовать ответ на вопрос question_id (ID вопроса на маркетплейсе)."""
+        raise NotImplementedError
+
+    def split_token(self, token):
+        """Токены из двух частей хранятся как '<id>:<ключ>'."""
+        identifier, sep, key = token.partition(':')
+        if not sep or not identifier or not key:
+            raise InvalidTokenError(f"{self.name}: токен должен иметь вид '<id>:<ключ>'")
+        return identifier, key
+
+    async def request(self, client, method, url, **kwargs):
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            raise SyncError(f"{self.name}: {exc.__class__.__name__}: {exc}") from exc
+        if response.status_code == 429:
+            raise RateLimitedError(f"{self.name}: превышен лимит запросов", _retry_after(response))
+        if response.status_code in (401, 403):
+            raise InvalidTokenError(f"{self.name}: токен отклонён ({response.status_code})")
+        if response.status_code >= 400:
+            raise SyncError(f"{self.name}: HTTP {response.status_code}", _retry_after(response))
+        if not response.content:
+            return {}
+        try:
+            return response.json()
+        except ValueError as exc:
+            raise SyncError(f"{self.name}: некорректный JSON в ответе") from exc
+
+    def page(self, questions, next_page):
+        return Page(questions, questions[-1]['created_at'] if questions else None, next_page)
+
+
+class OzonAdapter(BaseMarketplaceAdapter):
+    """Ozon Seller API, /v1/question/list. Токен — '<Client-Id>:<Api-Key>'."""
+
+    name = 'ozon'
+    base_url = 'https://api-seller.ozon.ru'
+
+    async def fetch_questions(self, client, token, cursor, page=None):
+        client_id, api_key = self.split_token(token)
+        data = await self.request(client, 'POST', '/v1/question/list', headers={
+            'Client-Id': client_id, 'Api-Key': api_key,
+        }, json={
+            'filter': {'date_from': cursor or None, 'status': 'ALL'},
+            'sort_dir': 'ASC',
+            'limit': self.page_size,
+            'last_id': page or '',
+        })
+        questions = [
+            {
+                'question_id': str(item['id']),
+                'sku': item.get('offer_id'),
+                'text': item.get('text') or '',
+                # API отдаёт только имя автора, ID покупателя нет
+                'customer_id': None,
+                'created_at': item['published_at'],
+            }
+            for item in data.get('questions', [])
+        ]
+        last_id = data.get('last_id')
+        return self.page(questions, last_id if questions and last_id else None)
+
+    async def send_answer(self, client, token, question_id, text):
+        client_id, api_key = self.split_token(token)
+        await self.request(client, 'POST', '/v1/question/answer/create', headers={
+            'Client-Id': client_id, 'Api-Key': api_key,
+        }, json={'question_id': question_id, 'text': text})
+
+
+class WildberriesAdapter(BaseMarketplaceAdapter):
+    """Wildberries Feedbacks API, /api/v1/questions. Токен — JWT из личного кабинета."""
+
+    name = 'wildberries'
+    base_url = 'https://feedbacks-api.wildberries.ru'
+
+    async def fetch_questions(self, client, token, cursor, page=None):
+        skip = page or 0
+        params = {'isAnswered': 'false', 'take': self.page_size, 'skip': skip, 'order': 'dateAsc'}
+        if cursor:
+            params['dateFrom'] = cursor
+        data = await self.request(client, 'GET', '/api/v1/questions', headers={'Authorization': token},
+                                  params=params)
+        items = (data.get('data') or {}).get('questions') or []
+        questions = [
+            {
+                'question_id': str(item['id']),
+                'sku': (item.get('productDetails') or {}).get('supplierArticle'),
+                'text': item.get('text') or '',
+                # API отдаёт только имя автора, ID покупателя нет
+                'customer_id': None,
+                'created_at': item['createdDate'],
+            }
+            for item in items
+        ]
+        # dateFrom в API — unix-время в секундах
+        page_cursor = str(int(_parse_time(questions[-1]['created_at']))) if questions else None
+        next_page = skip + len(items) if len(items) == self.page_size else None
+        return Page(questions, page_cursor, next_page)
+
+    async def send_answer(self, client, token, question_id, text):
+        await self.request(client, 'PATCH', '/api/v1/questions', headers={'Authorization': token}, json={
+            'id': question_id, 'answer': {'text': text}, 'state': 'wbRu',
+        })
+
+
+class YandexMarketAdapter(BaseMarketplaceAdapter):
+    """Партнёрский API Маркета, /businesses/{id}/goods-questions. Токен — '<businessId>:<Api-Key>'."""
+
+    name = 'yandex_market'
+    base_url = 'https://api.partner.market.yandex.ru'
+
+    async def fetch_questions(self, client, token, cursor, page=None):
+        business_id, api_key = self.split_token(token)
+        params = {'limit': self.page_size}
+        if page:
+            params['page_token'] = page
+        body = {'dateTimeFrom': cursor} if cursor else {}
+        data = await self.request(client, 'POST', f'/businesses/{business_id}/goods-questions',
+                                  headers={'Api-Key': api_key}, params=params, json=body)
+        result = data.get('result') or {}
+        questions = [
+            {
+                'question_id': str(item['questionIdentifiers']['id']),
+                'sku': item.get('offerId'),
+                'text': item.get('text') or '',
+                # API отдаёт только имя автора, ID покупателя нет
+                'customer_id': None,
+                'created_at': item['createdAt'],
+            }
+            for item in result.get('questions', [])
+        ]
+        return self.page(questions, (result.get('paging') or {}).get('nextPageToken'))
+
+    async def send_answer(self, client, token, question_id, text):
+        business_id, api_key = self.split_token(token)
+        await self.request(client, 'POST', f'/businesses/{business_id}/goods-questions/update',
+                           headers={'Api-Key': api_key}, json={
+                               'operationType': 'CREATE',
+                               'parentEntityId': {'id': int(question_id), 'type': 'QUESTION'},
+                               'text': text,
+                           })
+
+
+def _parse_time(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise SyncError(f"Некорректная дата вопроса: {value!r}")
+    return parsed.timestamp()
+
+
+def get_adapters():
+    """Адаптеры из SYNC_ADAPTERS: имя маркетплейса → экземпляр; base_url можно переопределить SYNC_API_URLS."""
+    adapters = {}
+    for name, path in settings.SYNC_ADAPTERS.items():
+        adapter = import_string(path)()
+        adapter.base_url = settings.SYNC_API_URLS.get(name, adapter.base_url)
+        adapters[name] = adapter
+    return adapters
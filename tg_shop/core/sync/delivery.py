@@ -0,0 +1,172 @@
+"""
+Отправка ответов на маркетплейсы из очереди AnswerDelivery.
+
+Воркер забирает готовые ответы отдельно по каждому маркетплейсу, группирует их по магазину
+(один токен на группу) и отправляет группы параллельно под общим для маркетплейса
+RateLimiter. Число ответов в работе ограничено на маркетплейс (DELIVERY_MAX_IN_FLIGHT):
+медленный маркетплейс занимает только свои слоты, остальные продолжают забираться.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import Counter, defaultdict, deque
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .adapters import RateLimitedError, SyncError, get_adapters
+from .outbox import claim, finish, marketplace_ids
+from .scheduler import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryStats:
+    """Пропускная способность и задержка доставки (от создания сообщения до ответа маркетплейса)."""
+
+    def __init__(self, window=10_000):
+        self.started = time.monotonic()
+        self.delivered = Counter()
+        self.retried = 0
+        self.dead = 0
+        self.groups = 0
+        self.lags = deque(maxlen=window)
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        delivered = sum(self.delivered.values())
+        lags = sorted(self.lags)
+        return {
+            'delivered': delivered,
+            'by_marketplace': dict(self.delivered),
+            'retried': self.retried,
+            'dead': self.dead,
+            'groups': self.groups,
+            'elapsed_s': round(elapsed, 3),
+            'delivered_per_s': round(delivered / elapsed, 2) if elapsed else 0.0,
+            # по последним window доставкам
+            'lag_ms': {
+                'p50': round(lags[len(lags) // 2] * 1000, 1) if lags else 0.0,
+                'p95': round(lags[min(len(lags) - 1, len(lags) * 95 // 100)] * 1000, 1) if lags else 0.0,
+            },
+        }
+
+
+class DeliveryWorker:
+
+    def __init__(self, adapters=None, transport=None, batch_size=None, worker_id=None):
+        self.adapters = adapters or get_adapters()
+        # transport — для тестов (httpx.ASGITransport с фейковым маркетплейсом)
+        self.transport = transport
+        self.batch_size = batch_size or settings.DELIVERY_BATCH_SIZE
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.limiters = {
+            name: RateLimiter(settings.DELIVERY_RATE_LIMITS.get(name, 0)) for name in self.adapters
+        }
+        self.stats = DeliveryStats()
+        self.clients = {}
+        self._in_flight = Counter()
+        self._tasks = set()
+
+    async def run(self, poll_interval=1.0, stop_when_empty=False, report_every=30.0):
+        limits = httpx.Limits(max_connections=settings.SYNC_MAX_CONNECTIONS,
+                              max_keepalive_connections=settings.SYNC_MAX_CONNECTIONS)
+        self.clients = {
+            name: httpx.AsyncClient(base_url=adapter.base_url, limits=limits, transport=self.transport,
+                                    timeout=settings.SYNC_HTTP_TIMEOUT)
+            for name, adapter in self.adapters.items()
+        }
+        ids = await sync_to_async(marketplace_ids)(list(self.adapters))
+        last_report = time.monotonic()
+        try:
+            while True:
+                claimed = await self.claim_all(ids)
+                if time.monotonic() - last_report >= report_every:
+                    logger.info("Delivery worker %s: %s", self.worker_id, self.stats.as_dict())
+                    last_report = time.monotonic()
+                if claimed:
+                    if all(self._in_flight[name] >= settings.DELIVERY_MAX_IN_FLIGHT for name in self.adapters):
+                        await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                if not self._tasks:
+                    if stop_when_empty:
+                        return self.stats
+                    await asyncio.sleep(poll_interval)
+                else:
+                    await asyncio.wait(self._tasks, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Недоотправленные останутся в sending и будут забраны повторно после DELIVERY_LOCK_TIMEOUT
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            for client in self.clients.values():
+                await client.aclose()
+
+    async def claim_all(self, ids):
+        """Забрать ответы для маркетплейсов со свободными слотами и запустить отправку групп."""
+        claimed = 0
+        for name in self.adapters:
+            free = settings.DELIVERY_MAX_IN_FLIGHT - self._in_flight[name]
+            if free <= 0 or not ids.get(name):
+                continue
+            entries = await sync_to_async(claim)(ids[name], min(free, self.batch_size), self.worker_id)
+            groups = defaultdict(list)
+            for entry in entries:
+                groups[entry['store_id']].append(entry)
+            for group in groups.values():
+                self._start(name, group)
+            claimed += len(entries)
+        return claimed
+
+    def _start(self, name, group):
+        self._in_flight[name] += len(group)
+        task = asyncio.create_task(self.deliver(name, group))
+        self._tasks.add(task)
+
+        def done(task):
+            self._in_flight[name] -= len(group)
+            self._tasks.discard(task)
+        task.add_done_callback(done)
+
+    async def deliver(self, name, group):
+        """Отправить ответы одного магазина и записать результат одной транзакцией."""
+        results = await asyncio.gather(*(self._send(name, entry) for entry in group))
+        delivered = [entry for entry, exc in results if exc is None]
+        failed = [
+            (entry, str(exc), getattr(exc, 'retry_after', None), isinstance(exc, RateLimitedError))
+            for entry, exc in results if exc is not None
+        ]
+        try:
+            dead = await sync_to_async(finish)(delivered, failed)
+        except Exception:
+            logger.exception("Не удалось сохранить результат отправки %s ответов", len(group))
+            return
+        now = timezone.now()
+        self.stats.groups += 1
+        self.stats.delivered[name] += len(delivered)
+        self.stats.lags.extend((now - entry['created_at']).total_seconds() for entry in delivered)
+        self.stats.retried += len(failed) - dead
+        self.stats.dead += dead
+
+    async def _send(self, name, entry):
+        if entry['token'] is None:
+            return entry, SyncError(f"{name}: у магазина нет токена маркетплейса")
+        limiter = self.limiters[name]
+        await limiter.acquire()
+        try:
+            await self.adapters[name].send_answer(
+                self.clients[name], entry['token'], entry['external_question_id'], entry['text'],
+            )
+        except RateLimitedError as exc:
+            limiter.pause(exc.retry_after or settings.DELIVERY_RETRY_DELAY)
+            return entry, exc
+        except SyncError as exc:
+            return entry, exc
+        except Exception as exc:
+            logger.exception("Ошибка отправки ответа %s на %s", entry['id'], name)
+            return entry, exc
+        return entry, None
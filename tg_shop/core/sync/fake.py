@@ -0,0 +1,186 @@
+"""
+Фейковый маркетплейс для тестов и нагрузочных прогонов синхронизации.
+
+ASGI-приложение с эндпоинтами вопросов и ответов Ozon, Wildberries и Яндекс.Маркета
+в том виде, в каком их используют адаптеры core.sync.adapters; опубликованные ответы
+копятся в answers. В тестах подключается к httpx через ASGITransport, для прогона
+на тысячах магазинов запускается отдельно:
+
+    FAKE_MARKETPLACE_QUESTIONS=50 uvicorn core.sync.fake:app --port 9000
+    SYNC_API_URLS='{"ozon": "http://127.0.0.1:9000", ...}' python manage.py sync_marketplaces
+
+С FAKE_MARKETPLACE_QUESTIONS любой токен принимается и получает столько вопросов
+к артикулам sku-0 … sku-9. Модуль не зависит от Django.
+"""
+import asyncio
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _iso(moment):
+    return moment.isoformat().replace('+00:00', 'Z')
+
+
+def _parse(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class FakeMarketplace:
+
+    def __init__(self, generate=0, skus=10):
+        # marketplace → token → вопросы по возрастанию created_at
+        self.questions = defaultdict(lambda: defaultdict(list))
+        self.tokens = defaultdict(set)
+        self.generate = generate
+        self.skus = skus
+        # marketplace → [(token, question_id, text)]
+        self.answers = defaultdict(list)
+        self.requests = Counter()
+        self.delays = {}
+        self._throttled = Counter()
+        self._retry_after = {}
+        self._next_id = 1
+
+    def add_token(self, marketplace, token):
+        self.tokens[marketplace].add(token)
+
+    def add_question(self, marketplace, token, sku, text, author=None, created_at=None):
+        self.add_token(marketplace, token)
+        questions = self.questions[marketplace][token]
+        if created_at is None:
+            created_at = (_parse(questions[-1]['created_at']) + timedelta(seconds=1)) if questions else EPOCH
+        question = {
+            'id': self._next_id, 'sku': sku, 'text': text, 'author': author,
+            'created_at': _iso(created_at),
+        }
+        self._next_id += 1
+        questions.append(question)
+        questions.sort(key=lambda item: _parse(item['created_at']))
+        return question['id']
+
+    def throttle(self, marketplace, requests=1, retry_after=1):
+        """Следующие requests запросов к маркетплейсу получат 429 с Retry-After."""
+        self._throttled[marketplace] += requests
+        self._retry_after[marketplace] = retry_after
+
+    def slow_down(self, marketplace, seconds):
+        """Отвечать на запросы к маркетплейсу с задержкой."""
+        self.delays[marketplace] = seconds
+
+    def _questions(self, marketplace, token):
+        if token in self.tokens[marketplace]:
+            return self.questions[marketplace][token]
+        if not self.generate:
+            return None
+        for i in range(self.generate):
+            self.add_question(marketplace, token, f'sku-{i % self.skus}', f'Вопрос {i}', author=f'buyer-{i}')
+        return self.questions[marketplace][token]
+
+    # ── ASGI ──────────
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        headers = {name.decode().lower(): value.decode() for name, value in scope['headers']}
+        query = {key: values[0] for key, values in parse_qs(scope['query_string'].decode()).items()}
+        payload = json.loads(body) if body else {}
+        status, data, extra = await self.handle(scope['method'], scope['path'], headers, query, payload)
+        response_headers = [(b'content-type', b'application/json')]
+        response_headers += [(name.encode(), str(value).encode()) for name, value in extra.items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': json.dumps(data, ensure_ascii=False).encode()})
+
+    async def handle(self, method, path, headers, query, payload):
+        ozon_token = f"{headers.get('client-id')}:{headers.get('api-key')}"
+        if method == 'POST' and path == '/v1/question/list':
+            marketplace, token, handler = 'ozon', ozon_token, self._ozon
+        elif method == 'POST' and path == '/v1/question/answer/create':
+            marketplace, token, handler = 'ozon', ozon_token, self._ozon_answer
+        elif path == '/api/v1/questions':
+            marketplace, token = 'wildberries', headers.get('authorization')
+            handler = self._wildberries if method == 'GET' else self._wildberries_answer
+        elif method == 'POST' and path.startswith('/businesses/'):
+            marketplace, token = 'yandex_market', f"{path.split('/')[2]}:{headers.get('api-key')}"
+            handler = self._yandex_market_answer if path.endswith('/update') else self._yandex_market
+        else:
+            return 404, {'error': 'not found'}, {}
+
+        self.requests[marketplace] += 1
+        if self.delays.get(marketplace):
+            await asyncio.sleep(self.delays[marketplace])
+        if self._throttled[marketplace]:
+            self._throttled[marketplace] -= 1
+            return 429, {'error': 'too many requests'}, {'Retry-After': self._retry_after[marketplace]}
+        questions = self._questions(marketplace, token)
+        if questions is None:
+            return 401, {'error': 'unauthorized'}, {}
+        return 200, handler(marketplace, token, questions, query, payload), {}
+
+    def _ozon(self, marketplace, token, questions, query, payload):
+        date_from = (payload.get('filter') or {}).get('date_from')
+        items = [q for q in questions if not date_from or _parse(q['created_at']) >= _parse(date_from)]
+        if payload.get('last_id'):
+            ids = [str(q['id']) for q in items]
+            position = ids.index(payload['last_id']) + 1 if payload['last_id'] in ids else len(items)
+            items = items[position:]
+        items = items[:int(payload.get('limit') or 100)]
+        return {
+            'questions': [
+                {'id': q['id'], 'offer_id': q['sku'], 'text': q['text'], 'author_name': q['author'],
+                 'published_at': q['created_at']}
+                for q in items
+            ],
+            'last_id': str(items[-1]['id']) if items else '',
+        }
+
+    def _wildberries(self, marketplace, token, questions, query, payload):
+        date_from = int(query.get('dateFrom', 0))
+        items = [q for q in questions if _parse(q['created_at']).timestamp() >= date_from]
+        skip, take = int(query.get('skip', 0)), int(query.get('take', 100))
+        return {'data': {'questions': [
+            {'id': str(q['id']), 'text': q['text'], 'userName': q['author'], 'createdDate': q['created_at'],
+             'productDetails': {'supplierArticle': q['sku']}}
+            for q in items[skip:skip + take]
+        ]}}
+
+    def _yandex_market(self, marketplace, token, questions, query, payload):
+        date_from = payload.get('dateTimeFrom')
+        items = [q for q in questions if not date_from or _parse(q['created_at']) >= _parse(date_from)]
+        offset, limit = int(query.get('page_token') or 0), int(query.get('limit', 100))
+        page = items[offset:offset + limit]
+        paging = {'nextPageToken': str(offset + limit)} if offset + limit < len(items) else {}
+        return {'result': {
+            'questions': [
+                {'questionIdentifiers': {'id': q['id']}, 'offerId': q['sku'], 'text': q['text'],
+                 'author': {'name': q['author']}, 'createdAt': q['created_at']}
+                for q in page
+            ],
+            'paging': paging,
+        }}
+
+
+    def _ozon_answer(self, marketplace, token, questions, query, payload):
+        self.answers[marketplace].append((token, str(payload['question_id']), payload['text']))
+        return {'result': 'ok'}
+
+    def _wildberries_answer(self, marketplace, token, questions, query, payload):
+        self.answers[marketplace].append((token, str(payload['id']), payload['answer']['text']))
+        return {'data': None, 'error': False}
+
+    def _yandex_market_answer(self, marketplace, token, questions, query, payload):
+        self.answers[marketplace].append((token, str(payload['parentEntityId']['id']), payload['text']))
+        return {'status': 'OK'}
+
+
+app = FakeMarketplace(generate=int(os.getenv('FAKE_MARKETPLACE_QUESTIONS', 0)))
@@ -0,0 +1,141 @@
+"""
+Очередь AnswerDelivery в БД: выборка для воркера, результаты отправки и метрики очереди.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from core.models import AnswerDelivery, Marketplace, MarketplaceIntegrationToken, ProductQuestion
+
+
+def marketplace_ids(names):
+    """name → [id]: имя маркетплейса не уникально."""
+    ids = {name: [] for name in names}
+    for marketplace_id, name in Marketplace.objects.filter(name__in=names).values_list('id', 'name'):
+        ids[name].append(marketplace_id)
+    return ids
+
+
+def claim(marketplace_ids, limit, worker_id):
+    """
+    Забрать до limit готовых к отправке ответов одного маркетплейса (SKIP LOCKED — воркеры
+    не мешают друг другу). Зависшие в sending дольше DELIVERY_LOCK_TIMEOUT забираются повторно,
+    пока не исчерпаны DELIVERY_MAX_ATTEMPTS попыток, после — dead.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.DELIVERY_LOCK_TIMEOUT)
+    abandoned = Q(marketplace_id__in=marketplace_ids, status=AnswerDelivery.Status.SENDING, locked_at__lt=stale)
+    with transaction.atomic():
+        AnswerDelivery.objects.filter(abandoned, attempts__gte=settings.DELIVERY_MAX_ATTEMPTS).update(
+            status=AnswerDelivery.Status.DEAD, error='Превышено время отправки', locked_by='', locked_at=None,
+        )
+        deliveries = list(
+            AnswerDelivery.objects
+            .select_related('message', 'question')
+            .select_for_update(skip_locked=True, of=('self',))
+            .filter(marketplace_id__in=marketplace_ids)
+            .filter(Q(status=AnswerDelivery.Status.PENDING, next_attempt_at__lte=now) |
+                    abandoned & Q(attempts__lt=settings.DELIVERY_MAX_ATTEMPTS))
+            .order_by('next_attempt_at')[:limit]
+        )
+        if not deliveries:
+            return []
+        AnswerDelivery.objects.filter(id__in=[delivery.id for delivery in deliveries]).update(
+            status=AnswerDelivery.Status.SENDING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+
+    tokens = {
+        (token.store_id, token.marketplace_id): token
+        for token in MarketplaceIntegrationToken.objects.filter(
+            store_id__in={delivery.store_id for delivery in deliveries},
+            marketplace_id__in={delivery.marketplace_id for delivery in deliveries},
+        )
+    }
+    entries = []
+    for delivery in deliveries:
+        token = tokens.get((delivery.store_id, delivery.marketplace_id))
+        entries.append({
+            'id': delivery.id,
+            'store_id': delivery.store_id,
+            'marketplace_id': delivery.marketplace_id,
+            'question_id': delivery.question_id,
+            'external_question_id': delivery.question.external_question_id,
+            'text': delivery.message.text,
+            'attempts': delivery.attempts + 1,
+            'created_at': delivery.created_at,
+            'token': token.get_token() if token else None,
+        })
+    return entries
+
+
+def retry_delay(attempts):
+    return min(settings.DELIVERY_RETRY_DELAY * 2 ** (attempts - 1), settings.DELIVERY_MAX_BACKOFF)
+
+
+def finish(delivered, failed):
+    """
+    delivered — отправленные записи claim(): вопрос считается решённым.
+    failed — [(запись, ошибка, retry_after, rate_limited)]: повтор с экспоненциальной паузой,
+    после DELIVERY_MAX_ATTEMPTS — dead. Отказ по лимиту запросов попыткой не считается.
+    Возвращает число записей, ушедших в dead.
+    """
+    now = timezone.now()
+    dead = 0
+    with transaction.atomic():
+        if delivered:
+            AnswerDelivery.objects.filter(id__in=[entry['id'] for entry in delivered]).update(
+                status=AnswerDelivery.Status.DELIVERED, delivered_at=now, error='', locked_by='', locked_at=None,
+            )
+            ProductQuestion.objects.filter(
+                id__in={entry['question_id'] for entry in delivered}, is_resolved=False,
+            ).update(is_resolved=True)
+
+        for entry, error, retry_after, rate_limited in failed:
+            updates = {'error': error[:1000], 'locked_by': '', 'locked_at': None}
+            if rate_limited:
+                updates.update(status=AnswerDelivery.Status.PENDING, attempts=F('attempts') - 1,
+                               next_attempt_at=now + timedelta(seconds=retry_after or settings.DELIVERY_RETRY_DELAY))
+            elif entry['attempts'] >= settings.DELIVERY_MAX_ATTEMPTS:
+                updates['status'] = AnswerDelivery.Status.DEAD
+                dead += 1
+            else:
+                delay = retry_after or retry_delay(entry['attempts'])
+                updates.update(status=AnswerDelivery.Status.PENDING, next_attempt_at=now + timedelta(seconds=delay))
+            AnswerDelivery.objects.filter(id=entry['id']).update(**updates)
+    return dead
+
+
+def render_delivery_metrics(prefix='tgshop'):
+    """
+    Очередь отправки ответов в формате Prometheus: размер по маркетплейсам и статусам
+    и возраст самого старого неотправленного ответа — текущая задержка доставки.
+    """
+    rows = (
+        AnswerDelivery.objects
+        .filter(status__in=[AnswerDelivery.Status.PENDING, AnswerDelivery.Status.SENDING,
+                            AnswerDelivery.Status.DEAD])
+        .values('marketplace__name', 'status')
+        .annotate(count=Count('id'), oldest=Min('created_at'))
+        .order_by('marketplace__name', 'status')
+    )
+    now = timezone.now()
+    queue, lag = [], {}
+    for row in rows:
+        queue.append(f'{prefix}_delivery_queue{{marketplace="{row["marketplace__name"]}",'
+                     f'status="{row["status"]}"}} {row["count"]}')
+        if row['status'] != AnswerDelivery.Status.DEAD:
+            age = (now - row['oldest']).total_seconds()
+            lag[row['marketplace__name']] = max(lag.get(row['marketplace__name'], 0.0), age)
+
+    name = f'{prefix}_delivery_queue'
+    lines = [f'# HELP {name} Ответов в очереди отправки на маркетплейсы', f'# TYPE {name} gauge', *queue]
+    name = f'{prefix}_delivery_lag_seconds'
+    lines += [f'# HELP {name} Возраст самого старого неотправленного ответа', f'# TYPE {name} gauge']
+    lines += [f'{name}{{marketplace="{marketplace}"}} {age:.3f}' for marketplace, age in sorted(lag.items())]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,233 @@
+"""
+Планировщик синхронизации вопросов с маркетплейсами.
+
+Один процесс опрашивает все пары (магазин, маркетплейс) с токеном: на каждую — корутина,
+которая проходит новые вопросы постранично и засыпает на SYNC_POLL_INTERVAL. HTTP-клиент
+(и пул соединений) — один на маркетплейс, частота запросов к маркетплейсу ограничена
+общим RateLimiter. Страницы всех магазинов пишет в БД одна корутина, объединяя накопившиеся
+за время предыдущей записи страницы в пачку (store_updates).
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .adapters import InvalidTokenError, RateLimitedError, SyncError, get_adapters
+from .store import load_feeds, store_updates
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket для корутин: rate запросов в секунду, всплеск до burst. Очередной acquire()
+    резервирует токен заранее (баланс уходит в минус) и спит до его появления — ожидающие
+    обслуживаются по порядку, без гонки за освободившийся токен.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def pause(self, seconds):
+        """Маркетплейс ответил 429 — следующие запросы не раньше чем через seconds."""
+        if self.rate:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class Feed:
+    """Состояние опроса одной пары (магазин, маркетплейс)."""
+
+    def __init__(self, store_id, marketplace_id, marketplace, token, cursor='', fetched=0, failures=0):
+        self.store_id = store_id
+        self.marketplace_id = marketplace_id
+        self.marketplace = marketplace
+        self.token = token
+        self.cursor = cursor
+        self.fetched = fetched
+        self.failures = failures
+
+    @property
+    def key(self):
+        return self.store_id, self.marketplace_id
+
+    def update(self, questions=(), cursor=None, error=''):
+        return {
+            'store_id': self.store_id,
+            'marketplace_id': self.marketplace_id,
+            'marketplace': self.marketplace,
+            'questions': list(questions),
+            'cursor': cursor if cursor is not None else self.cursor,
+            'fetched': self.fetched + len(questions),
+            'failures': self.failures if error else 0,
+            'error': error,
+        }
+
+
+class SyncScheduler:
+
+    def __init__(self, adapters=None, transport=None, poll_interval=None, batch_size=None):
+        self.adapters = adapters or get_adapters()
+        # transport — для тестов (httpx.ASGITransport с фейковым маркетплейсом)
+        self.transport = transport
+        self.poll_interval = poll_interval if poll_interval is not None else settings.SYNC_POLL_INTERVAL
+        self.batch_size = batch_size or settings.SYNC_BATCH_SIZE
+        self.limiters = {
+            name: RateLimiter(settings.SYNC_RATE_LIMITS.get(name, 0)) for name in self.adapters
+        }
+        self.stats = Counter()
+        self.feeds = {}
+        self.clients = {}
+        self._tasks = {}
+        self._writes = None
+
+    async def run(self, once=False):
+        """
+        once=True — один проход по всем парам (cron, тесты); иначе работает, пока не отменят,
+        и раз в SYNC_RELOAD_INTERVAL подхватывает новые и удалённые токены.
+        """
+        self._writes = asyncio.Queue()
+        limits = httpx.Limits(max_connections=settings.SYNC_MAX_CONNECTIONS,
+                              max_keepalive_connections=settings.SYNC_MAX_CONNECTIONS)
+        self.clients = {
+            name: httpx.AsyncClient(base_url=adapter.base_url, limits=limits, transport=self.transport,
+                                    timeout=settings.SYNC_HTTP_TIMEOUT)
+            for name, adapter in self.adapters.items()
+        }
+        writer = asyncio.create_task(self._writer())
+        try:
+            while True:
+                await self._reload(once)
+                if once:
+                    await asyncio.gather(*self._tasks.values())
+                    break
+                await asyncio.sleep(settings.SYNC_RELOAD_INTERVAL)
+        finally:
+            for task in [*self._tasks.values(), writer]:
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), writer, return_exceptions=True)
+            self._tasks.clear()
+            for client in self.clients.values():
+                await client.aclose()
+        return dict(self.stats)
+
+    async def _reload(self, once):
+        feeds = {}
+        for data in await sync_to_async(load_feeds)(list(self.adapters)):
+            feed = Feed(**data)
+            feeds[feed.key] = feed
+        for key in self._tasks.keys() - feeds.keys():
+            # токен удалён
+            self._tasks.pop(key).cancel()
+            self.feeds.pop(key, None)
+        for key, feed in feeds.items():
+            if key in self.feeds:
+                # курсор и счётчики — в памяти, из БД берём только токен (мог смениться)
+                self.feeds[key].token = feed.token
+                continue
+            self.feeds[key] = feed
+            self._tasks[key] = asyncio.create_task(self._poll_forever(feed, once))
+
+    async def _poll_forever(self, feed, once):
+        if not once:
+            # разнести первые опросы тысяч магазинов по интервалу
+            await asyncio.sleep(random.uniform(0, self.poll_interval))
+        while True:
+            delay = self.poll_interval
+            try:
+                await self.poll(feed)
+            except Exception as exc:
+                if not isinstance(exc, SyncError):
+                    # неожиданный формат ответа — не должен останавливать опрос магазина
+                    logger.exception("Ошибка опроса %s магазина %s", feed.marketplace, feed.store_id)
+                    exc = SyncError(f"{exc.__class__.__name__}: {exc}")
+                delay = self._backoff(feed, exc)
+                logger.warning("Синхронизация магазина %s с %s: %s", feed.store_id, feed.marketplace, exc)
+                try:
+                    await self._write(feed.update(error=str(exc)))
+                except Exception:
+                    logger.exception("Не удалось сохранить ошибку синхронизации")
+            if once:
+                return
+            await asyncio.sleep(delay * random.uniform(0.9, 1.1))
+
+    async def poll(self, feed):
+        """Один проход: страницы новых вопросов от курсора до конца."""
+        adapter = self.adapters[feed.marketplace]
+        limiter = self.limiters[feed.marketplace]
+        start, page = feed.cursor, None
+        self.stats['polls'] += 1
+        while True:
+            await limiter.acquire()
+            try:
+                result = await adapter.fetch_questions(self.clients[feed.marketplace], feed.token, start, page)
+            except RateLimitedError as exc:
+                limiter.pause(exc.retry_after or self.poll_interval)
+                raise
+            self.stats['pages'] += 1
+            self.stats['fetched'] += len(result.questions)
+            counts = await self._write(feed.update(result.questions, result.cursor))
+            self.stats.update(counts)
+            feed.fetched += len(result.questions)
+            feed.cursor = result.cursor if result.cursor is not None else feed.cursor
+            feed.failures = 0
+            if result.next_page is None:
+                return
+            page = result.next_page
+
+    def _backoff(self, feed, exc):
+        self.stats['failed_polls'] += 1
+        feed.failures += 1
+        if exc.retry_after:
+            return exc.retry_after
+        if isinstance(exc, InvalidTokenError):
+            # токен не починится сам — опрашиваем редко, пока его не заменят
+            return settings.SYNC_MAX_BACKOFF
+        return min(self.poll_interval * 2 ** feed.failures, settings.SYNC_MAX_BACKOFF)
+
+    async def _write(self, update):
+        future = asyncio.get_running_loop().create_future()
+        await self._writes.put((update, future))
+        return await future
+
+    async def _writer(self):
+        while True:
+            batch = [await self._writes.get()]
+            size = len(batch[0][0]['questions'])
+            while size < self.batch_size and not self._writes.empty():
+                entry = self._writes.get_nowait()
+                batch.append(entry)
+                size += len(entry[0]['questions'])
+            try:
+                results = await sync_to_async(store_updates)([update for update, _ in batch])
+            except Exception as exc:
+                logger.exception("Не удалось сохранить пачку синхронизации (%s обновлений)", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(SyncError(f"Ошибка записи: {exc.__class__.__name__}"))
+                continue
+            self.stats['batches'] += 1
+            for (_, future), counts in zip(batch, results):
+                if not future.done():
+                    future.set_result(counts)
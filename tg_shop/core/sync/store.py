@@ -0,0 +1,152 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import MarketplaceIntegrationToken, MarketplaceSyncCursor, Product, UnmatchedMarketplaceQuestion
+from core.utils.ingestion import ingest_questions
+
+
+def load_feeds(marketplaces):
+    """
+    Токены магазинов для указанных маркетплейсов с сохранёнными курсорами:
+    [{'store_id', 'marketplace_id', 'marketplace', 'token', 'cursor', 'fetched', 'failures'}].
+    """
+    cursors = {
+        (cursor.store_id, cursor.marketplace_id): cursor
+        for cursor in MarketplaceSyncCursor.objects.filter(marketplace__name__in=marketplaces)
+    }
+    feeds = []
+    for token in MarketplaceIntegrationToken.objects.filter(
+        marketplace__name__in=marketplaces,
+    ).select_related('marketplace').order_by('id'):
+        cursor = cursors.get((token.store_id, token.marketplace_id))
+        feeds.append({
+            'store_id': token.store_id,
+            'marketplace_id': token.marketplace_id,
+            'marketplace': token.marketplace.name,
+            'token': token.get_token(),
+            'cursor': cursor.cursor if cursor else '',
+            'fetched': cursor.fetched if cursor else 0,
+            'failures': cursor.failures if cursor else 0,
+        })
+    return feeds
+
+
+def author_external_id(marketplace, question):
+    # Покупатель маркетплейса не совпадает с пользователями других площадок и Telegram.
+    # Отображаемое имя («Покупатель», «Анна») не уникально — без ID покупателя
+    # каждый вопрос получает своего пользователя
+    if question['customer_id']:
+        return f"customer:{question['customer_id']}@{marketplace}"
+    return f"question:{question['question_id']}@{marketplace}"
+
+
+def load_unmatched(updates):
+    """
+    Отложенные вопросы пар (магазин, маркетплейс) из updates, для артикула которых товар уже
+    появился: {позиция update: [(id, question)]}.
+    """
+    positions = {(update['store_id'], update['marketplace_id']): position for position, update in enumerate(updates)}
+    rows = (
+        UnmatchedMarketplaceQuestion.objects
+        .filter(store_id__in={store_id for store_id, _ in positions},
+                marketplace_id__in={marketplace_id for _, marketplace_id in positions})
+        .exclude(sku='')
+        .filter(Exists(Product.objects.filter(store_id=OuterRef('store_id'), sku=OuterRef('sku'))))
+        .values_list('id', 'store_id', 'marketplace_id', 'question_id', 'sku', 'customer_id', 'text')
+    )
+    unmatched = {}
+    for row_id, store_id, marketplace_id, question_id, sku, customer_id, text in rows:
+        position = positions.get((store_id, marketplace_id))
+        if position is not None:
+            unmatched.setdefault(position, []).append(
+                (row_id, {'question_id': question_id, 'sku': sku, 'customer_id': customer_id, 'text': text}),
+            )
+    return unmatched
+
+
+def _park(update, question):
+    return UnmatchedMarketplaceQuestion(
+        store_id=update['store_id'],
+        marketplace_id=update['marketplace_id'],
+        question_id=question['question_id'],
+        sku=(question['sku'] or '')[:64],
+        customer_id=(question['customer_id'] or '')[:128],
+        text=question['text'],
+    )
+
+
+def store_updates(updates):
+    """
+    Пачка результатов опроса нескольких магазинов: вопросы через ingest_questions и новые
+    курсоры — в одной транзакции, чтобы курсор не ушёл вперёд не сохранённых вопросов.
+
+    Вопросы с артикулом, которого нет среди товаров магазина, откладываются в
+    UnmatchedMarketplaceQuestion (курсор идёт дальше) и загружаются опросом этого магазина
+    после появления товара. Туда же попадают вопросы, которые ingest_questions вернул
+    с ошибкой: они повторяются следующим опросом магазина, а не теряются за курсором.
+
+    update: {'store_id', 'marketplace_id', 'marketplace', 'questions', 'cursor', 'fetched', 'failures', 'error'}.
+    Возвращает счётчики по каждому update: created / duplicate / unmatched (отложено) /
+    error (отложено до следующего опроса).
+    """
+    unmatched = load_unmatched(updates)
+    # Товар вопроса — по артикулу продавца в пределах магазина
+    skus = {question['sku'] for update in updates for question in update['questions'] if question['sku']}
+    skus.update(question['sku'] for rows in unmatched.values() for _, question in rows)
+    products = {}
+    if skus:
+        for product_id, store_id, sku in Product.objects.filter(
+            store_id__in={update['store_id'] for update in updates}, sku__in=skus,
+        ).values_list('id', 'store_id', 'sku'):
+            products[(store_id, sku)] = product_id
+
+    items, owners, parked, stats = [], [], [], [Counter() for _ in updates]
+    for position, update in enumerate(updates):
+        retried = unmatched.get(position, [])
+        for question in [question for _, question in retried] + update['questions']:
+            product_id = products.get((update['store_id'], question['sku']))
+            if product_id is None:
+                stats[position]['unmatched'] += 1
+                parked.append(_park(update, question))
+                continue
+            items.append({
+                'external_id': author_external_id(update['marketplace'], question),
+                'product': product_id,
+                'text': question['text'],
+                'marketplace': update['marketplace'],
+                'question_id': question['question_id'],
+            })
+            owners.append((position, question))
+
+    now = timezone.now()
+    with transaction.atomic():
+        for (position, question), result in zip(owners, ingest_questions(items) if items else []):
+            stats[position][result['status']] += 1
+            if result['status'] == 'error':
+                parked.append(_park(updates[position], question))
+        UnmatchedMarketplaceQuestion.objects.filter(
+            id__in=[row_id for rows in unmatched.values() for row_id, _ in rows],
+        ).delete()
+        # Повторно полученный отложенный вопрос уже лежит в таблице
+        UnmatchedMarketplaceQuestion.objects.bulk_create(parked, ignore_conflicts=True)
+        MarketplaceSyncCursor.objects.bulk_create(
+            [
+                MarketplaceSyncCursor(
+                    store_id=update['store_id'],
+                    marketplace_id=update['marketplace_id'],
+                    cursor=update['cursor'],
+                    fetched=update['fetched'],
+                    failures=update['failures'],
+                    error=update['error'],
+                    synced_at=now,
+                )
+                for update in updates
+            ],
+            update_conflicts=True,
+            unique_fields=['store', 'marketplace'],
+            update_fields=['cursor', 'fetched', 'failures', 'error', 'synced_at'],
+        )
+    return stats
@@ -1,3 +1,1465 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import socket
+import time
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from cryptography.fernet import Fernet, MultiFernet
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.core.management import call_command
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .ai import similarity
+from .ai.context import _cache_key as context_cache_key, get_product_context
+from .ai.backends import BaseAnswerBackend
+from .ai.worker import AnswerWorker
+from .authentication import api_key_cache, resolve_api_key
+from .db import ReplicaRouter, reading_from_replica, render_pool_metrics
+from .images import fetch
+from .images.worker import ImageWorker
+from .metrics import RequestMetrics, registry
+from .middleware import QueryMetricsMiddleware, ReplicaMiddleware
+from .pagination import KeysetPagination, encode_cursor
+from .realtime.hub import hub
+from .sync.adapters import get_adapters
+from .sync.delivery import DeliveryWorker
+from .sync.fake import FakeMarketplace
+from .sync import outbox
+from .sync.outbox import render_delivery_metrics
+from .sync.scheduler import SyncScheduler
+from .throttling import BACKENDS, render_throttle_metrics
+from .throttling import _latency as shed_latency
+from .utils import crypto
+from .utils.catalog import _is_image_url
+from .utils import ingestion
+from .utils.ingestion import external_username, idempotency_cache
+from .utils.utils import get_store_for_user, invalidate_store_cache
+from .views import AsyncExternalQuestionCreateView, AsyncUserConversationView
+from .models import CustomUser, Store, Product, Marketplace, ProductQuestion, ProductQuestionMessage, AIAnswerJob, \
+    ProductImage, SpecKeyUsage, MarketplaceIntegrationToken, MarketplaceSyncCursor, AnswerDelivery, StoreAPIKey, \
+    AnsweredQuestionSignature, UnmatchedMarketplaceQuestion
+
+
+class UserConversationQueryCountTests(TestCase):
+    """
+    /api/conversations/ должен выполнять постоянное число запросов
+    независимо от количества вопросов и сообщений пользователя.
+    """
+
+    # пользователь по external_id + вопросы с товаром/маркетплейсом + сообщения с отправителями
+    EXPECTED_QUERIES = 3
+
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        self.manager = CustomUser.objects.create_user(username='manager', password='secret', role='manager')
+        self.store = Store.objects.create(name='Магазин', owner=owner)
+        self.marketplace = Marketplace.objects.create(name='ozon')
+        self.customer = CustomUser.objects.create_user(username='customer', external_id='ext-1')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def _add_history(self, questions):
+        for i in range(questions):
+            product = Product.objects.create(store=self.store, title=f'Товар {i}', description='')
+            question = ProductQuestion.objects.create(
+                product=product, user=self.customer, text=f'Вопрос {i}', marketplace=self.marketplace,
+            )
+            ProductQuestionMessage.objects.create(question=question, sender=self.customer, role='user', text='?')
+            ProductQuestionMessage.objects.create(question=question, sender=self.manager, role='manager', text='!')
+
+    def _fetch(self):
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get('/api/conversations/', {'external_id': 'ext-1'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_query_count_does_not_grow_with_history(self):
+        self._add_history(1)
+        self.assertEqual(len(self._fetch()), 1)
+
+        self._add_history(30)
+        data = self._fetch()
+        self.assertEqual(len(data), 31)
+
+        messages = data[0]['messages']
+        self.assertEqual([m['role'] for m in messages], ['user', 'manager'])
+        self.assertEqual(messages[1]['sender']['username'], 'manager')
+        self.assertEqual(data[0]['marketplace'], 'ozon')
+
+    async def test_async_view_matches_sync(self):
+        await sync_to_async(self._add_history)(3)
+        expected = await sync_to_async(self._fetch)()
+
+        request = AsyncRequestFactory().get(
+            '/api/conversations/', {'external_id': 'ext-1'},
+            headers={'Authorization': f'Bearer {AccessToken.for_user(self.manager)}'},
+        )
+        response = await AsyncUserConversationView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected)
+
+        anonymous = AsyncRequestFactory().get('/api/conversations/', {'external_id': 'ext-1'})
+        self.assertEqual((await AsyncUserConversationView.as_view()(anonymous)).status_code, 403)
+
+
+class StoreCacheTests(TestCase):
+    def setUp(self):
+        invalidate_store_cache()
+        self.owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        self.store = Store.objects.create(name='Магазин', owner=self.owner)
+        self.manager = CustomUser.objects.create_user(username='manager', password='secret', role='manager',
+                                                      store=self.store)
+
+    def _client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client
+
+    def test_removed_manager_loses_access_without_invalidation(self):
+        client = self._client(self.manager)
+        self.assertEqual(client.get('/api/products/').status_code, 200)
+
+        # как в другом процессе: сигнал до кэша этого процесса не доходит
+        CustomUser.objects.filter(pk=self.manager.pk).update(store=None)
+
+        self.assertEqual(client.get('/api/products/').status_code, 403)
+
+    def test_cached_store_is_copied_per_call(self):
+        first, second = get_store_for_user(self.manager), get_store_for_user(self.manager)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    def test_owned_store_checks(self):
+        foreign = Store.objects.create(name='Чужой', owner=CustomUser.objects.create_user(username='other'))
+        client = self._client(self.owner)
+
+        self.assertEqual(client.post(f'/api/owners/{self.store.pk}/generate-invite/').status_code, 200)
+        self.assertEqual(client.post(f'/api/owners/{foreign.pk}/generate-invite/').status_code, 403)
+        self.assertEqual(client.post('/api/owners/999999/generate-invite/').status_code, 404)
+
+
+@override_settings(AI_ANSWER_BACKEND='core.tests.StubAnswerBackend')
+@override_settings(EXTERNAL_API_SECRET='secret')
+class AsyncExternalQuestionTests(TestCase):
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        store = Store.objects.create(name='Магазин', owner=owner)
+        self.product = Product.objects.create(store=store, title='Чайник', description='')
+        Marketplace.objects.create(name='ozon')
+        idempotency_cache.clear()
+
+    async def _post(self, data, secret=None, headers=None):
+        request = AsyncRequestFactory().post(
+            '/api/external/questions/', data, content_type='application/json',
+            headers={**({'X-API-Secret': secret} if secret else {}), **(headers or {})},
+        )
+        return await AsyncExternalQuestionCreateView.as_view()(request)
+
+    async def test_creates_question_by_api_secret(self):
+        data = {'external_id': 'ext-1', 'product': self.product.pk, 'text': 'Есть в наличии?', 'marketplace': 'ozon'}
+        response = await self._post(data, secret='secret')
+
+        self.assertEqual(response.status_code, 201)
+        question = await ProductQuestion.objects.select_related('user', 'marketplace').aget(
+            pk=json.loads(response.content)['question_id'],
+        )
+        self.assertEqual(question.user.external_id, 'ext-1')
+        self.assertEqual(question.marketplace.name, 'ozon')
+        self.assertTrue(await AIAnswerJob.objects.filter(question=question).aexists())
+
+    async def test_retry_with_idempotency_key(self):
+        data = {'external_id': 'ext-1', 'product': self.product.pk, 'text': 'Есть в наличии?'}
+        first = await self._post(data, secret='secret', headers={'Idempotency-Key': 'k-1'})
+        idempotency_cache.clear()
+        retry = await self._post(data, secret='secret', headers={'Idempotency-Key': 'k-1'})
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 200))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(retry.content)['question_id'], json.loads(first.content)['question_id'])
+        self.assertEqual(await ProductQuestion.objects.acount(), 1)
+
+    async def test_rejects_invalid_requests(self):
+        data = {'external_id': 'ext-1', 'product': self.product.pk, 'text': '?'}
+        self.assertEqual((await self._post(data)).status_code, 403)
+        self.assertEqual((await self._post(data, secret='wrong')).status_code, 403)
+        self.assertEqual((await self._post({'text': '?'}, secret='secret')).status_code, 400)
+        missing = await self._post({**data, 'product': 10 ** 9}, secret='secret')
+        self.assertEqual(missing.status_code, 404)
+        self.assertFalse(await CustomUser.objects.filter(external_id='ext-1').aexists())
+
+
+@override_settings(EXTERNAL_API_SECRET='secret')
+class ExternalQuestionIdempotencyTests(TestCase):
+    def setUp(self):
+        store = Store.objects.create(name='Магазин')
+        self.product = Product.objects.create(store=store, title='Чайник', description='')
+        Marketplace.objects.create(name='ozon')
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_SECRET='secret')
+        self.data = {'external_id': 'ext-1', 'product': self.product.pk, 'text': 'Есть в наличии?'}
+        idempotency_cache.clear()
+
+    def _post(self, data, **headers):
+        return self.client.post('/api/external/questions/', data, format='json', headers=headers)
+
+    def test_marketplace_question_id_is_deduplicated(self):
+        data = {**self.data, 'marketplace': 'ozon', 'question_id': 'oz-1'}
+        first = self._post(data)
+        # повтор из кэша — без запросов к БД
+        with self.assertNumQueries(0):
+            retry = self._post(data)
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 200))
+        self.assertEqual(retry.json()['question_id'], first.json()['question_id'])
+        self.assertEqual(ProductQuestion.objects.get().external_question_id, 'oz-1')
+        self.assertEqual(AIAnswerJob.objects.count(), 1)
+
+    def test_unknown_marketplace_creates_new_question(self):
+        ProductQuestion.objects.create(product=self.product, text='Старый вопрос')
+        response = self._post({**self.data, 'marketplace': 'unknown', 'question_id': 'q-1'})
+
+        self.assertEqual(response.status_code, 201)
+        question = ProductQuestion.objects.get(pk=response.json()['question_id'])
+        self.assertEqual((question.text, question.external_question_id), (self.data['text'], None))
+        self.assertTrue(AIAnswerJob.objects.filter(question=question).exists())
+
+    def test_marketplace_question_id_is_scoped_to_store(self):
+        self._post({**self.data, 'marketplace': 'ozon', 'question_id': 'oz-1'})
+        other = Product.objects.create(store=Store.objects.create(name='Другой'), title='Утюг', description='')
+        response = self._post({**self.data, 'product': other.pk, 'marketplace': 'ozon', 'question_id': 'oz-1'})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('question_id', response.json())
+        self.assertEqual(ProductQuestion.objects.count(), 1)
+
+    def test_idempotency_key_is_scoped_to_client(self):
+        first = self._post(self.data, **{'Idempotency-Key': 'k-1'})
+        idempotency_cache.clear()
+        # без кэша (другой процесс) повтор стоит одного запроса по уникальному индексу
+        with self.assertNumQueries(1):
+            retry = self._post(self.data, **{'Idempotency-Key': 'k-1'})
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()['question_id'], first.json()['question_id'])
+
+        manager = CustomUser.objects.create_user(username='manager', password='secret', role='manager')
+        self.client.force_authenticate(manager)
+        other = self._post(self.data, **{'Idempotency-Key': 'k-1'})
+        self.assertEqual(other.status_code, 201)
+        self.assertEqual(ProductQuestion.objects.count(), 2)
+
+        self.assertEqual(self._post(self.data, **{'Idempotency-Key': 'k' * 201}).status_code, 400)
+
+
+@override_settings(EXTERNAL_API_SECRET='secret')
+class ExternalQuestionBatchTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='Магазин')
+        self.product = Product.objects.create(store=self.store, title='Чайник', description='')
+        Marketplace.objects.create(name='ozon')
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_SECRET='secret')
+
+    def _item(self, question_id, **fields):
+        return {'external_id': 'ext-1', 'product': self.product.pk, 'text': 'Есть в наличии?',
+                'marketplace': 'ozon', 'question_id': question_id, **fields}
+
+    def _post(self, items):
+        response = self.client.post('/api/external/questions/batch/', items, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_batch_and_retry_are_deduplicated(self):
+        first = self._post([self._item('oz-1'), self._item('oz-1'), self._item('oz-2'), {'text': '?'}])
+        self.assertEqual((first['created'], first['duplicates'], first['errors']), (2, 1, 1))
+        statuses = [(item['status'], item.get('question_id')) for item in first['results']]
+        self.assertEqual(statuses[1], ('duplicate', statuses[0][1]))
+
+        retry = self._post([self._item('oz-2'), self._item('oz-1')])
+        self.assertEqual([(item['status'], item['question_id']) for item in retry['results']],
+                         [('duplicate', statuses[2][1]), ('duplicate', statuses[0][1])])
+        self.assertEqual(ProductQuestion.objects.count(), 2)
+        self.assertEqual(AIAnswerJob.objects.count(), 2)
+
+    def test_ndjson_body(self):
+        lines = [json.dumps(self._item('oz-1')), 'не json', json.dumps(self._item('oz-1'))]
+        response = self.client.post('/api/external/questions/batch/', '\n'.join(lines),
+                                    content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['index'], item['status']) for item in response.json()['results']],
+                         [(0, 'created'), (1, 'error'), (2, 'duplicate')])
+
+    def test_question_of_another_store_is_not_disclosed(self):
+        other = Product.objects.create(store=Store.objects.create(name='Другой'), title='Утюг', description='')
+        self._post([self._item('oz-1', product=other.pk)])
+
+        result = self._post([self._item('oz-1')])['results'][0]
+        self.assertEqual((result['status'], result.get('question_id')), ('error', None))
+        self.assertEqual(ProductQuestion.objects.count(), 1)
+
+    def test_row_lost_to_concurrent_retry_is_duplicate(self):
+        load_questions = ingestion._load_questions
+        calls = []
+
+        def concurrent_retry(keys):
+            # первое чтение не видит вопрос — параллельный повтор вставляет его до нашего INSERT
+            if not calls:
+                calls.append(ProductQuestion.objects.create(
+                    product=self.product, text='?', marketplace=Marketplace.objects.get(),
+                    external_question_id='oz-1',
+                ))
+                return {}
+            return load_questions(keys)
+
+        with mock.patch.object(ingestion, '_load_questions', side_effect=concurrent_retry):
+            result = self._post([self._item('oz-1'), self._item('oz-2')])
+
+        self.assertEqual([(item['status'], item['question_id']) for item in result['results']][0],
+                         ('duplicate', calls[0].pk))
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(ProductQuestion.objects.count(), 2)
+
+@override_settings(EXTERNAL_API_SECRET='secret', API_RATE_LIMITS={'external-questions': (1, 2)})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(store=Store.objects.create(name=f'Магазин {i}'), title='Чайник', description='')
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_SECRET='secret')
+        for backend in BACKENDS.values():
+            backend.clear()
+        shed_latency.clear()
+
+    def _post(self, product, n=1):
+        data = {'external_id': 'ext-1', 'product': product.pk, 'text': 'Есть в наличии?'}
+        return [self.client.post('/api/external/questions/', data, format='json') for _ in range(n)]
+
+    def _assert_limited_per_store(self):
+        first, second, third = self._post(self.products[0], 3)
+        self.assertEqual((first.status_code, second.status_code, third.status_code), (201, 201, 429))
+        self.assertEqual(third['Retry-After'], '1')
+        # у другого магазина своя корзина
+        self.assertEqual(self._post(self.products[1])[0].status_code, 201)
+
+    def test_bucket_per_store(self):
+        self._assert_limited_per_store()
+        self.assertIn('tgshop_throttled_requests_total{scope="external-questions",reason="limit"}',
+                      render_throttle_metrics())
+
+    @override_settings(API_RATE_LIMIT_BACKEND='database')
+    def test_database_backend(self):
+        self._assert_limited_per_store()
+
+    @override_settings(API_SHED_LATENCY_MS=100, API_SHED_FACTOR=0.5)
+    def test_sheds_api_secret_clients_when_database_is_slow(self):
+        with mock.patch('core.throttling.db_latency', return_value=500):
+            first, second = self._post(self.products[0], 2)
+            self.assertEqual((first.status_code, second.status_code), (201, 429))
+            self.assertEqual(second['Retry-After'], '2')
+
+            # пользователи панели магазина не ограничиваются сильнее
+            owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+            self.client.force_authenticate(owner)
+            self.assertEqual([r.status_code for r in self._post(self.products[0], 2)], [201, 201])
+
+    def test_async_view(self):
+        request_factory = AsyncRequestFactory()
+        data = {'external_id': 'ext-1', 'product': self.products[0].pk, 'text': '?'}
+
+        async def post():
+            request = request_factory.post('/api/external/questions/', data, content_type='application/json',
+                                           headers={'X-API-Secret': 'secret'})
+            return await AsyncExternalQuestionCreateView.as_view()(request)
+
+        statuses = [async_to_sync(post)() for _ in range(3)]
+        self.assertEqual([response.status_code for response in statuses], [201, 201, 429])
+        self.assertEqual(statuses[-1]['Retry-After'], '1')
+
+
+class StoreAPIKeyTests(TestCase):
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        self.store = Store.objects.create(name='Магазин', owner=self.owner)
+        self.product = Product.objects.create(store=self.store, title='Чайник', description='')
+        self.other_product = Product.objects.create(store=Store.objects.create(name='Чужой'), title='Утюг',
+                                                    description='')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        api_key_cache.clear()
+        idempotency_cache.clear()
+
+    def _create_key(self):
+        response = self.client.post(f'/api/stores/{self.store.pk}/api-keys/', {'name': 'CRM'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def _ingest(self, key, product, path='/api/external/questions/'):
+        data = {'external_id': 'ext-1', 'product': product.pk, 'text': 'Есть в наличии?'}
+        return APIClient().post(path, data, format='json', headers={'X-API-KEY': key})
+
+    def test_key_is_shown_once_and_stored_hashed(self):
+        created = self._create_key()
+        self.assertTrue(created['key'].startswith(created['prefix']))
+        listed = self.client.get(f'/api/stores/{self.store.pk}/api-keys/').json()['results']
+        self.assertEqual([item['id'] for item in listed], [created['id']])
+        self.assertNotIn('key', listed[0])
+        self.assertNotEqual(StoreAPIKey.objects.get().key_hash, created['key'])
+
+        stranger = CustomUser.objects.create_user(username='stranger', password='secret', role='owner')
+        self.client.force_authenticate(stranger)
+        self.assertEqual(self.client.get(f'/api/stores/{self.store.pk}/api-keys/').status_code, 403)
+
+    def test_ingestion_is_scoped_to_key_store(self):
+        key = self._create_key()['key']
+        self.assertEqual(self._ingest(key, self.product).status_code, 201)
+        self.assertEqual(self._ingest(key, self.other_product).status_code, 404)
+        self.assertEqual(self._ingest('tgs_unknown', self.product).status_code, 403)
+
+        batch = APIClient().post('/api/external/questions/batch/', [
+            {'external_id': 'ext-2', 'product': self.product.pk, 'text': '?'},
+            {'external_id': 'ext-2', 'product': self.other_product.pk, 'text': '?'},
+        ], format='json', headers={'X-API-KEY': key})
+        self.assertEqual([item['status'] for item in batch.json()['results']], ['created', 'error'])
+        self.assertFalse(ProductQuestion.objects.filter(product=self.other_product).exists())
+
+        # сообщения — только своего магазина
+        question = ProductQuestion.objects.filter(product=self.product).first()
+        ProductQuestionMessage.objects.create(question=question, text='Да', role='owner')
+        messages = APIClient().get('/api/messages/', headers={'X-API-KEY': key}).json()['results']
+        self.assertEqual([item['text'] for item in messages], ['Да'])
+
+    def test_messages_cannot_reference_other_store(self):
+        key = self._create_key()['key']
+        client = APIClient()
+        client.credentials(HTTP_X_API_KEY=key)
+        own = ProductQuestion.objects.create(product=self.product, text='?')
+        foreign = ProductQuestion.objects.create(product=self.other_product, text='?')
+        foreign_message = ProductQuestionMessage.objects.create(question=foreign, text='Нет', role='owner')
+
+        self.assertEqual(client.post('/api/messages/', {'question': foreign.pk, 'text': 'Да'},
+                                     format='json').status_code, 400)
+        created = client.post('/api/messages/', {'question': own.pk, 'text': 'Да'}, format='json')
+        self.assertEqual(created.status_code, 201)
+
+        # вопрос при изменении не меняется, чужой parent отклоняется
+        moved = client.patch(f"/api/messages/{created.json()['id']}/", {'question': foreign.pk}, format='json')
+        self.assertEqual(moved.status_code, 200)
+        self.assertEqual(ProductQuestionMessage.objects.get(pk=created.json()['id']).question_id, own.pk)
+        reparented = client.patch(f"/api/messages/{created.json()['id']}/", {'parent': foreign_message.pk},
+                                  format='json')
+        self.assertEqual(reparented.status_code, 400)
+
+    def test_lookup_is_cached_and_revocation_applies(self):
+        created = self._create_key()
+        self.assertIsNotNone(resolve_api_key(created['key']))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_api_key(created['key']).store_id, self.store.pk)
+
+        response = self.client.delete(f"/api/stores/{self.store.pk}/api-keys/{created['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNotNone(StoreAPIKey.objects.get().revoked_at)
+        self.assertEqual(self._ingest(created['key'], self.product).status_code, 403)
+
+    def test_async_view(self):
+        key = self._create_key()['key']
+        factory = AsyncRequestFactory()
+
+        async def post(product):
+            request = factory.post('/api/external/questions/', {'external_id': 'ext-1', 'product': product.pk,
+                                   'text': '?'}, content_type='application/json', headers={'X-API-Key': key})
+            return await AsyncExternalQuestionCreateView.as_view()(request)
+
+        self.assertEqual(async_to_sync(post)(self.product).status_code, 201)
+        self.assertEqual(async_to_sync(post)(self.other_product).status_code, 404)
+
+
+class StubAnswerBackend(BaseAnswerBackend):
+    """Детерминированные ответы без сети — только для тестов."""
+
+    def generate_answers(self, context, questions):
+        return [f"Ответ о товаре «{context['title']}»: {question.text[:100]}" for question in questions]
+
+
+@override_settings(AI_ANSWER_BACKEND='core.tests.StubAnswerBackend')
+class AnswerWorkerTests(TestCase):
+    def setUp(self):
+        store = Store.objects.create(name='Магазин')
+        self.customer = CustomUser.objects.create_user(username='customer', external_id='ext-1')
+        self.products = [
+            Product.objects.create(store=store, title=f'Товар {i}', description='') for i in range(2)
+        ]
+
+    def test_questions_are_answered_in_batches_per_product(self):
+        questions = [
+            ProductQuestion.objects.create(product=product, user=self.customer, text=f'Вопрос {i}')
+            for i, product in enumerate(self.products * 3)
+        ]
+        self.assertEqual(AIAnswerJob.objects.filter(status=AIAnswerJob.Status.PENDING).count(), 6)
+
+        worker = AnswerWorker(batch_size=10)
+        self.assertEqual(worker.run_once(), 6)
+        self.assertEqual(worker.run_once(), 0)
+
+        for question in questions:
+            self.assertEqual(list(question.messages.values_list('role', flat=True)), ['ai'])
+        self.assertFalse(AIAnswerJob.objects.exclude(status=AIAnswerJob.Status.DONE).exists())
+
+        stats = worker.stats.as_dict()
+        self.assertEqual((stats['jobs'], stats['answers'], stats['batches']), (6, 6, 1))
+        self.assertEqual(set(stats['stage_ms']), {'claim', 'load', 'generate', 'write'})
+
+    def test_resolved_questions_are_skipped(self):
+        question = ProductQuestion.objects.create(product=self.products[0], user=self.customer, text='?')
+        ProductQuestion.objects.filter(pk=question.pk).update(is_resolved=True)
+
+        AnswerWorker().run_once()
+
+        self.assertFalse(question.messages.exists())
+        self.assertEqual(AIAnswerJob.objects.get(question=question).status, AIAnswerJob.Status.DONE)
+
+    def test_backend_errors_are_retried_then_failed(self):
+        question = ProductQuestion.objects.create(product=self.products[0], user=self.customer, text='?')
+        worker = AnswerWorker(backend=mock.Mock(**{'generate_answers.side_effect': RuntimeError('boom')}))
+
+        with self.settings(AI_JOB_MAX_ATTEMPTS=2, AI_JOB_RETRY_DELAY=60):
+            started = timezone.now()
+            worker.run_once()
+            job = AIAnswerJob.objects.get(question=question)
+            self.assertEqual(job.status, AIAnswerJob.Status.PENDING)
+            # повтор — только после паузы
+            self.assertGreaterEqual(job.next_attempt_at, started + timedelta(seconds=60))
+            self.assertEqual(worker.run_once(), 0)
+            AIAnswerJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+            worker.run_once()
+
+        job = AIAnswerJob.objects.get(question=question)
+        self.assertEqual((job.status, job.attempts), (AIAnswerJob.Status.FAILED, 2))
+        self.assertIn('boom', job.error)
+
+    def test_backend_is_required(self):
+        with self.settings(AI_ANSWER_BACKEND=''), self.assertRaises(ImproperlyConfigured):
+            AnswerWorker()
+
+    def test_answer_count_mismatch_fails_batch(self):
+        questions = [ProductQuestion.objects.create(product=self.products[0], user=self.customer, text=f'Вопрос {i}')
+                     for i in range(2)]
+        worker = AnswerWorker(backend=mock.Mock(**{'generate_answers.return_value': ['Один ответ']}))
+
+        worker.run_once()
+
+        self.assertFalse(ProductQuestionMessage.objects.filter(question__in=questions).exists())
+        self.assertEqual(set(AIAnswerJob.objects.values_list('status', flat=True)), {AIAnswerJob.Status.PENDING})
+
+    def test_abandoned_jobs_are_reclaimed_until_attempts_run_out(self):
+        question = ProductQuestion.objects.create(product=self.products[0], user=self.customer, text='?')
+        stale = timezone.now() - timedelta(seconds=settings.AI_JOB_LOCK_TIMEOUT + 1)
+        jobs = AIAnswerJob.objects.filter(question=question)
+
+        jobs.update(status=AIAnswerJob.Status.RUNNING, locked_at=stale, attempts=1)
+        self.assertEqual(len(AnswerWorker().claim()), 1)
+
+        jobs.update(status=AIAnswerJob.Status.RUNNING, locked_at=stale, attempts=settings.AI_JOB_MAX_ATTEMPTS)
+        self.assertEqual(AnswerWorker().claim(), [])
+        self.assertEqual(jobs.get().status, AIAnswerJob.Status.FAILED)
+
+
+class ProductContextTests(TestCase):
+    def setUp(self):
+        store = Store.objects.create(name='Магазин')
+        self.product = Product.objects.create(store=store, title='Куртка', description='Тёплая')
+        customer = CustomUser.objects.create_user(username='customer', external_id='ext-1')
+        self.question = ProductQuestion.objects.create(product=self.product, user=customer, text='Есть размер M?')
+
+    def test_context_is_cached_and_invalidated_on_change(self):
+        self.assertEqual(get_product_context(self.product.pk)['title'], 'Куртка')
+        with self.assertNumQueries(1):
+            get_product_context(self.product.pk)
+
+        self.product.title = 'Пуховик'
+        self.product.save()
+        ProductQuestionMessage.objects.create(question=self.question, role='manager', text='Есть')
+
+        context = get_product_context(self.product.pk)
+        self.assertEqual(context['title'], 'Пуховик')
+        self.assertEqual(context['qa'], [{'question': 'Есть размер M?', 'answer': 'Есть'}])
+
+    def test_invalidation_is_seen_by_other_processes(self):
+        # Отдельный экземпляр бэкенда — как кэш в процессе воркера
+        worker_cache = caches.create_connection('default')
+        get_product_context(self.product.pk)
+        key = context_cache_key(self.product.pk)
+        self.assertEqual(worker_cache.get(key)['title'], 'Куртка')
+
+        self.product.title = 'Пуховик'
+        self.product.save()
+
+        self.assertIsNone(worker_cache.get(key))
+
+
+class SimilarityTests(TestCase):
+    def setUp(self):
+        similarity._indexes.clear()
+        self.store = Store.objects.create(name='Магазин')
+        self.other_store = Store.objects.create(name='Другой')
+        self.customer = CustomUser.objects.create_user(username='customer', external_id='ext-1')
+        self.product = Product.objects.create(store=self.store, title='Куртка', description='')
+
+    def _answered(self, text, answer, product=None):
+        question = ProductQuestion.objects.create(product=product or self.product, user=self.customer, text=text)
+        ProductQuestionMessage.objects.create(question=question, role='manager', text=answer)
+        return question
+
+    def test_minhash(self):
+        self.assertTrue((similarity.minhash('Какой размер?') == similarity.minhash('какой  РАЗМЕР')).all())
+        similar = (similarity.minhash('Какой размер у куртки?') == similarity.minhash('Какого размера куртка?')).mean()
+        different = (similarity.minhash('Какой размер у куртки?') == similarity.minhash('Когда доставка?')).mean()
+        self.assertGreater(similar, different)
+        self.assertEqual(similarity.shingles('?!'), set())
+
+    def test_suggest_answer(self):
+        answered = self._answered('Какой размер у куртки?', 'Размер M')
+        self._answered('Когда доставка?', 'Завтра', product=Product.objects.create(store=self.other_store, title='Шапка'))
+
+        suggestion = similarity.suggest_answer(self.store.pk, 'Какой размер куртки?')
+        self.assertEqual((suggestion['answer'], suggestion['question_id']), ('Размер M', answered.pk))
+        self.assertIsNone(similarity.suggest_answer(self.store.pk, 'Какой размер?', exclude_question_id=answered.pk))
+        self.assertIsNone(similarity.suggest_answer(self.other_store.pk, 'Какой размер у куртки?'))
+        # пустые и только из знаков препинания тексты ни с чем не совпадают
+        self._answered('???', 'Уточните вопрос')
+        self.assertIsNone(similarity.suggest_answer(self.store.pk, '!'))
+
+    def test_rebuild_similarity_index(self):
+        self._answered('Какой размер у куртки?', 'Размер M')
+        self._answered('...', 'Уточните вопрос')
+        AnsweredQuestionSignature.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('rebuild_similarity_index', '--store', str(self.store.pk), stdout=out)
+
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(AnsweredQuestionSignature.objects.get().answer, 'Размер M')
+        self.assertIsNotNone(similarity.suggest_answer(self.store.pk, 'Какой размер куртки?'))
+
+    @override_settings(SIMILARITY_INDEX_RELOAD=3600, SIMILARITY_INDEX_LAG=300)
+    def test_refresh_rereads_late_commits_and_reload_drops_deleted(self):
+        first = self._answered('Какой размер у куртки?', 'Размер M')
+        index = similarity.get_index(self.store.pk)
+        late = self._answered('Когда доставка?', 'Завтра')
+        # транзакция закоммичена позже, но updated_at раньше уже загруженной строки
+        AnsweredQuestionSignature.objects.filter(question=late).update(
+            updated_at=index.loaded_until - timedelta(seconds=60))
+        first_id = first.pk
+        first.delete()
+
+        index.refresh()
+        self.assertEqual(index.search(similarity.minhash('Когда доставка?'))[0], late.pk)
+        # догрузка не видит удалений — их убирает полная перезагрузка
+        self.assertIn(first_id, index.rows)
+        with override_settings(SIMILARITY_INDEX_RELOAD=0):
+            index.refresh()
+        self.assertEqual(list(index.rows), [late.pk])
+        self.assertIsNone(similarity.suggest_answer(self.store.pk, 'Какой размер у куртки?'))
+
+    @override_settings(AI_ANSWER_BACKEND='core.tests.StubAnswerBackend')
+    def test_worker_does_not_publish_similar_answers(self):
+        self._answered('Он водонепроницаемый?', 'Да')
+        question = ProductQuestion.objects.create(product=self.product, user=self.customer,
+                                                  text='Он не водонепроницаемый?')
+
+        AnswerWorker().run_once()
+
+        self.assertNotEqual(question.messages.get(role='ai').text, 'Да')
+
+
+@override_settings(METRICS_SAMPLE_RATE=1.0, METRICS_TOKEN='metrics-secret')
+class QueryMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.manager = CustomUser.objects.create_user(username='manager', password='secret', role='manager')
+        customer = CustomUser.objects.create_user(username='customer', external_id='ext-1')
+        product = Product.objects.create(store=Store.objects.create(name='Магазин'), title='Товар', description='')
+        ProductQuestion.objects.create(product=product, user=customer, text='Вопрос')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/conversations/', {'external_id': 'ext-1'})
+
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn('serializer;dur=', timing)
+
+    async def test_server_timing_under_asgi(self):
+        # Вся цепочка middleware асинхронная, SQL из sync_to_async всё равно учитывается
+        self.assertTrue(iscoroutinefunction(QueryMetricsMiddleware(AsyncUserConversationView.as_view())))
+        self.assertTrue(iscoroutinefunction(ReplicaMiddleware(AsyncUserConversationView.as_view())))
+
+        response = await AsyncClient().get(
+            '/api/conversations/', {'external_id': 'ext-1'},
+            headers={'Authorization': f'Bearer {AccessToken.for_user(self.manager)}'},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    def test_duplicate_queries_are_fingerprinted(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for pk in (1, 2, 3):
+                list(CustomUser.objects.filter(pk=pk))
+            list(CustomUser.objects.filter(pk__in=[1, 2]))
+            list(CustomUser.objects.filter(pk__in=[1, 2, 3]))
+
+        self.assertEqual(metrics.queries, 5)
+        self.assertEqual(sorted(metrics.duplicates().values()), [2, 3])
+
+    def test_metrics_endpoint_is_protected(self):
+        self.client.get('/api/conversations/', {'external_id': 'ext-1'})
+
+        self.assertEqual(APIClient().get('/api/_metrics').status_code, 403)
+        self.assertEqual(APIClient().get('/api/_metrics', HTTP_X_METRICS_TOKEN='metrics').status_code, 403)
+        response = APIClient().get('/api/_metrics', HTTP_X_METRICS_TOKEN='metrics-secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('tgshop_sql_queries_bucket{endpoint="api/conversations/",method="GET",le="5"} 1', body)
+        self.assertNotIn('_metrics', body)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        product = Product.objects.create(store=Store.objects.create(name='Магазин'), title='Товар', description='')
+        self.questions = [ProductQuestion.objects.create(product=product, text=f'Вопрос {i}') for i in range(5)]
+        # одинаковые даты: порядок внутри них задаёт id
+        ProductQuestion.objects.filter(pk__in=[q.pk for q in self.questions[:3]]).update(
+            created_at=self.questions[0].created_at,
+        )
+        self.view = mock.Mock(pagination_ordering=('-created_at', '-id'))
+
+    def _page(self, cursor=None):
+        params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(ProductQuestion.objects.all(), Request(RequestFactory().get('/', params)),
+                                           self.view)
+        return paginator, [question.pk for question in page]
+
+    def test_pages_follow_composite_key(self):
+        expected = list(ProductQuestion.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        seen, cursor = [], None
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                paginator, page = self._page(cursor)
+                seen += page
+                link = paginator.get_next_link()
+                if link is None:
+                    break
+                cursor = parse_qs(urlsplit(link).query)['cursor'][0]
+        self.assertEqual(seen, expected)
+        # одно направление — сравнение строк, а не OR по полям
+        self.assertIn('("core_productquestion"."created_at", "core_productquestion"."id") <',
+                      queries.captured_queries[-1]['sql'])
+
+    def test_invalid_cursor_values_are_404(self):
+        for values in (['не дата', 1, False], ['2026-01-01T00:00:00+00:00', 'x', False],
+                       [None, 1, False], ['2026-01-01T00:00:00+00:00', 1, 'нет']):
+            with self.subTest(values=values), self.assertRaises(NotFound):
+                self._page(encode_cursor(values))
+
+
+class ShopUserListTests(TestCase):
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        product = Product.objects.create(store=Store.objects.create(name='Магазин', owner=owner), title='Товар',
+                                         description='')
+        for i in range(3):
+            customer = CustomUser.objects.create_user(username=f'customer{i}', external_id=f'ext-{i}')
+            question = ProductQuestion.objects.create(product=product, user=customer, text='?')
+            ProductQuestionMessage.objects.create(question=question, role='user', text='Вопрос')
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+
+    def test_pages_and_invalid_cursor(self):
+        first = self.client.get('/api/shop_users/', {'limit': 2})
+        next_url = first['Link'].split('>')[0].lstrip('<')
+        second = self.client.get(next_url)
+
+        self.assertEqual([user['external_id'] for user in first.json() + second.json()], ['ext-0', 'ext-1', 'ext-2'])
+        self.assertFalse(second.has_header('Link'))
+        for values in (['не дата', 1], ['2026-01-01T00:00:00+00:00', 'x'], [None, 1]):
+            with self.subTest(values=values):
+                response = self.client.get('/api/shop_users/', {'cursor': encode_cursor(values)})
+                self.assertEqual(response.status_code, 404)
+
+
+class ConnectionManagementTests(TestCase):
+    def test_health_reports_databases(self):
+        response = APIClient().get('/api/_health')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['status'], 'ok')
+        self.assertTrue(data['databases']['default']['ok'])
+
+        with mock.patch('core.views.check_database', return_value={'ok': False, 'error': 'OperationalError'}):
+            self.assertEqual(APIClient().get('/api/_health').status_code, 503)
+
+    def test_replica_only_for_listed_get_endpoints(self):
+        seen = []
+        middleware = ReplicaMiddleware(lambda request: seen.append(ReplicaRouter().db_for_read(Product)))
+        factory = RequestFactory()
+        databases = {**settings.DATABASES, 'replica': settings.DATABASES['default']}
+
+        with override_settings(DATABASES=databases), mock.patch('core.db.replica_available', return_value=True):
+            middleware(factory.get('/api/conversations/'))
+            middleware(factory.post('/api/conversations/'))
+            middleware(factory.get('/api/products/1/'))
+            with reading_from_replica():
+                seen.append(ReplicaRouter().db_for_read(Product))
+        seen.append(ReplicaRouter().db_for_read(Product))
+
+        self.assertEqual(seen, ['replica', None, None, 'replica', None])
+
+    def test_pool_saturation_metrics(self):
+        stats = {'pool_min': 2, 'pool_max': 10, 'pool_size': 6, 'pool_available': 1, 'requests_waiting': 3,
+                 'requests_num': 120, 'requests_queued': 7}
+        with mock.patch('core.db.pool_stats', side_effect=lambda alias: stats if alias == 'default' else None):
+            body = render_pool_metrics()
+
+        self.assertIn('tgshop_db_requests_waiting{alias="default"} 3', body)
+        self.assertIn('tgshop_db_requests_queued_total{alias="default"} 7', body)
+        self.assertIn('tgshop_db_pool_saturation{alias="default"} 0.500', body)
+
+
+@override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    IMAGE_RENDITION_WIDTHS=[320, 640, 1280],
+    IMAGE_RENDITION_FORMATS=['webp'],
+)
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        Store.objects.create(name='Магазин', owner=owner)
+        Marketplace.objects.create(name='ozon')
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+
+    def _photo(self, name, color='red'):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), color).save(buffer, format='JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def _create_product(self, title, *photos):
+        response = self.client.post('/api/products/', {
+            'title': title, 'description': 'Описание', 'marketplaces': ['ozon'], 'images': list(photos),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def test_identical_photos_are_stored_and_processed_once(self):
+        first = self._create_product('Товар 1', self._photo('a.jpg'))
+        second = self._create_product('Товар 2', self._photo('b.jpg'), self._photo('c.jpg', 'blue'))
+
+        images = ProductImage.objects.order_by('id')
+        self.assertEqual(images[0].image.name, images[1].image.name)
+        self.assertNotEqual(images[0].image.name, images[2].image.name)
+        self.assertEqual({image.status for image in images}, {ProductImage.Status.PENDING})
+
+        worker = ImageWorker()
+        self.assertEqual(worker.run_once(), 3)
+        self.assertEqual(worker.stats['deduplicated'], 1)
+
+        image = ProductImage.objects.get(product_id=first)
+        self.assertEqual((image.status, image.width, image.height), (ProductImage.Status.READY, 800, 600))
+        # ширина 1280 больше оригинала — такого превью нет
+        self.assertEqual(sorted(image.renditions['webp'], key=int), ['320', '640'])
+        self.assertTrue(default_storage.exists(image.renditions['webp']['320']))
+        self.assertEqual(ProductImage.objects.filter(product_id=second).first().renditions, image.renditions)
+
+        data = self.client.get(f'/api/products/{first}/').json()
+        self.assertIn('320w', data['images'][0]['srcset']['webp'])
+        self.assertIn('640w', data['images'][0]['srcset']['webp'])
+
+    def test_broken_file_is_retried_then_failed(self):
+        product = self._create_product('Товар')
+        image = ProductImage.objects.create(product_id=product, image='products/missing.jpg')
+
+        with self.settings(IMAGE_JOB_MAX_ATTEMPTS=2):
+            ImageWorker().run_once()
+            self.assertEqual(ProductImage.objects.get(pk=image.pk).status, ProductImage.Status.PENDING)
+            ImageWorker().run_once()
+
+        self.assertEqual(ProductImage.objects.get(pk=image.pk).status, ProductImage.Status.FAILED)
+
+    def test_abandoned_processing_is_reclaimed_until_attempts_run_out(self):
+        product = self._create_product('Товар')
+        image = ProductImage.objects.create(product_id=product, image='products/missing.jpg')
+        images = ProductImage.objects.filter(pk=image.pk)
+        stale = timezone.now() - timedelta(seconds=settings.IMAGE_JOB_LOCK_TIMEOUT + 1)
+
+        images.update(status=ProductImage.Status.PROCESSING, locked_at=stale, attempts=1)
+        self.assertEqual([claimed.pk for claimed in ImageWorker().claim()], [image.pk])
+
+        images.update(status=ProductImage.Status.PROCESSING, locked_at=stale, attempts=settings.IMAGE_JOB_MAX_ATTEMPTS)
+        self.assertEqual(ImageWorker().claim(), [])
+        self.assertEqual(images.get().status, ProductImage.Status.FAILED)
+
+    def test_internal_source_urls_are_not_fetched(self):
+        product = self._create_product('Товар')
+        urls = ['http://127.0.0.1:8000/admin/', 'http://169.254.169.254/latest/meta-data/', 'http://10.0.0.5/a.jpg']
+        for url in urls:
+            ProductImage.objects.create(product_id=product, source_url=url)
+
+        with self.settings(IMAGE_JOB_MAX_ATTEMPTS=1), mock.patch.object(fetch._opener, 'open') as opened:
+            ImageWorker().run_once()
+        opened.assert_not_called()
+        for image in ProductImage.objects.filter(product_id=product):
+            self.assertEqual(image.status, ProductImage.Status.FAILED)
+            self.assertIn('UnsafeURLError', image.error)
+            self.assertFalse(image.image.name)
+
+        handler = fetch._PublicRedirectHandler()
+        with self.assertRaises(fetch.UnsafeURLError):
+            handler.redirect_request(None, None, 302, 'Found', {}, 'http://[::ffff:127.0.0.1]/')
+        for url in urls + ['http://localhost/a.jpg']:
+            self.assertFalse(_is_image_url(url))
+        self.assertTrue(_is_image_url('https://cdn.example.com/a1.jpg'))
+
+    def test_non_image_response_is_not_saved(self):
+        public = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 443))]
+        response = mock.MagicMock()
+        response.__enter__.return_value.read.return_value = b'<html>secret</html>'
+        with mock.patch('socket.getaddrinfo', return_value=public), \
+                mock.patch.object(fetch._opener, 'open', return_value=response):
+            with self.assertRaisesMessage(ValueError, 'не является изображением'):
+                fetch.fetch_image('https://cdn.example.com/a.jpg')
+
+
+@override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    AWS_STORAGE_BUCKET_NAME='media',
+)
+class DirectImageUploadTests(TestCase):
+    EXISTING = 'a' * 64
+    NEW = 'b' * 64
+
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        store = Store.objects.create(name='Магазин', owner=owner)
+        self.product = Product.objects.create(store=store, title='Товар', description='')
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+
+        self.uploaded = {f'products/originals/aa/{self.EXISTING}.jpg'}
+        patcher = mock.patch('core.images.s3.head', side_effect=lambda key: {} if key in self.uploaded else None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_presign_skips_files_already_in_storage(self):
+        response = self.client.post('/api/products/images/presign/', [
+            {'name': 'a.jpg', 'content_type': 'image/jpeg', 'size': 100, 'sha256': self.EXISTING},
+            {'name': 'b.png', 'content_type': 'image/png', 'size': 200, 'sha256': self.NEW},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        existing, new = response.json()
+        self.assertEqual((existing['exists'], existing.get('upload')), (True, None))
+        self.assertEqual(new['key'], f'products/originals/bb/{self.NEW}.png')
+        self.assertIn('x-amz-checksum-sha256', new['upload']['url'])
+        self.assertEqual(new['upload']['headers']['Content-Length'], '200')
+
+    def test_confirm_requires_uploaded_files(self):
+        key = f'products/originals/bb/{self.NEW}.png'
+        url = f'/api/products/{self.product.pk}/images/confirm/'
+
+        response = self.client.post(url, [{'key': key}], format='json')
+        self.assertEqual((response.status_code, response.json()['missing']), (400, [key]))
+
+        self.uploaded.add(key)
+        response = self.client.post(url, [{'key': key, 'caption': 'Фото'}], format='json')
+        self.assertEqual(response.status_code, 201)
+        image = self.product.images.get()
+        self.assertEqual((image.content_hash, image.status), (self.NEW, ProductImage.Status.PENDING))
+
+        response = self.client.post(url, [{'key': 'products/other.png'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        self.store = Store.objects.create(name='Магазин', owner=owner)
+        self.ozon = Marketplace.objects.create(name='ozon')
+        self.wb = Marketplace.objects.create(name='wildberries')
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+
+    def test_jsonl_import_upserts_by_sku(self):
+        body = (
+            '{"sku": "A1", "title": "Чайник", "specifications": {"color": "white"}, '
+            '"marketplaces": ["ozon"], "images": ["https://cdn.example.com/a1.jpg"]}\n'
+            '{"sku": "A2", "title": "Кружка"}\n'
+            'not json\n'
+        )
+        response = self.client.post('/api/products/import/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['created'], result['updated'], result['errors']), (2, 0, 1))
+        self.assertEqual(result['error_details'], [{'line': 3, 'error': 'Invalid JSON'}])
+
+        product = Product.objects.get(store=self.store, sku='A1')
+        self.assertEqual(list(product.marketplaces.all()), [self.ozon])
+        image = product.images.get()
+        self.assertEqual((image.source_url, image.status), ('https://cdn.example.com/a1.jpg', ProductImage.Status.PENDING))
+
+        body = (
+            '{"sku": "A1", "title": "Чайник 2", "marketplaces": "wildberries", '
+            '"images": ["https://cdn.example.com/a1.jpg"]}\n'
+        )
+        result = self.client.post('/api/products/import/', body, content_type='application/x-ndjson').json()
+        self.assertEqual((result['created'], result['updated'], result['images_queued']), (0, 1, 0))
+        product.refresh_from_db()
+        self.assertEqual(product.title, 'Чайник 2')
+        self.assertEqual(list(product.marketplaces.all()), [self.wb])
+        self.assertEqual(product.images.count(), 1)
+
+    def test_csv_import_and_export(self):
+        upload = SimpleUploadedFile('catalog.csv', (
+            'sku,title,spec.color,marketplaces,images\n'
+            'B1,Лампа,red,ozon|wildberries,\n'
+            'B2,,blue,,\n'
+            'B3,Стол,,amazon,\n'
+        ).encode(), content_type='text/csv')
+        result = self.client.post('/api/products/import/', {'file': upload}, format='multipart').json()
+        self.assertEqual((result['created'], result['errors']), (1, 2))
+        self.assertEqual([error['line'] for error in result['error_details']], [3, 4])
+
+        response = self.client.get('/api/products/export/', {'type': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'sku,title,description,specifications,marketplaces,images',
+            'B1,Лампа,,"{""color"": ""red""}",ozon|wildberries,',
+        ])
+
+
+class MarketplaceSyncTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='Магазин')
+        self.product = Product.objects.create(store=self.store, sku='A-1', title='Куртка', description='')
+        self.fake = FakeMarketplace()
+        self.tokens = {'ozon': '42:ozon-key', 'wildberries': 'wb-jwt', 'yandex_market': '7:ym-key'}
+        for name, token in self.tokens.items():
+            integration = MarketplaceIntegrationToken(store=self.store, marketplace=Marketplace.objects.create(name=name))
+            integration.set_token(token)
+            integration.save()
+        self.adapters = get_adapters()
+        for adapter in self.adapters.values():
+            adapter.page_size = 2
+
+    def _sync(self):
+        scheduler = SyncScheduler(adapters=self.adapters, transport=httpx.ASGITransport(app=self.fake))
+        return async_to_sync(scheduler.run)(once=True)
+
+    def test_incremental_sync(self):
+        ids = {}
+        for name, token in self.tokens.items():
+            for i in range(3):
+                ids[(name, i)] = self.fake.add_question(name, token, 'A-1', f'{name} вопрос {i}', author='Покупатель')
+            self.fake.add_question(name, token, 'unknown-sku', 'Чужой товар')
+
+        stats = self._sync()
+
+        self.assertEqual(stats['created'], 9)
+        self.assertEqual(stats['unmatched'], 3)
+        self.assertEqual(ProductQuestion.objects.filter(product=self.product).count(), 9)
+        question = ProductQuestion.objects.get(marketplace__name='ozon', text='ozon вопрос 0')
+        # одинаковое имя автора не склеивает разных покупателей
+        self.assertEqual(question.user.external_id, f"question:{ids[('ozon', 0)]}@ozon")
+        self.assertEqual(CustomUser.objects.filter(role='user').count(), 9)
+        self.assertTrue(AIAnswerJob.objects.filter(question=question).exists())
+        self.assertEqual(MarketplaceSyncCursor.objects.filter(store=self.store, error='').count(), 3)
+
+        # Второй проход начинается с курсора: приходят только граничные (дубли) и новые вопросы
+        self.fake.add_question('wildberries', self.tokens['wildberries'], 'A-1', 'Новый вопрос')
+        requests_before = sum(self.fake.requests.values())
+        stats = self._sync()
+
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(ProductQuestion.objects.count(), 10)
+        self.assertLess(sum(self.fake.requests.values()) - requests_before, 6)
+
+    def test_unmatched_questions_are_loaded_once_product_appears(self):
+        ids = {name: self.fake.add_question(name, token, 'B-2', f'{name}: а шапка есть?', author='buyer')
+               for name, token in self.tokens.items()}
+
+        self.assertEqual(self._sync()['unmatched'], 3)
+        self.assertEqual(UnmatchedMarketplaceQuestion.objects.count(), 3)
+        # курсор ушёл дальше, но повторный опрос без товара ничего не теряет и не дублирует
+        self._sync()
+        self.assertEqual(UnmatchedMarketplaceQuestion.objects.count(), 3)
+
+        product = Product.objects.create(store=self.store, sku='B-2', title='Шапка', description='')
+        stats = self._sync()
+
+        self.assertEqual(stats['created'], 3)
+        self.assertFalse(UnmatchedMarketplaceQuestion.objects.exists())
+        question = ProductQuestion.objects.get(product=product, marketplace__name='ozon')
+        self.assertEqual((question.text, question.user.external_id),
+                         ('ozon: а шапка есть?', f"question:{ids['ozon']}@ozon"))
+
+    def test_failed_questions_are_retried_by_next_poll(self):
+        question_id = self.fake.add_question('ozon', self.tokens['ozon'], 'A-1', 'Вопрос', author='Анна')
+        # username пользователя вопроса занят — ingest_questions вернёт ошибку
+        blocker = CustomUser.objects.create_user(
+            username=external_username(f'question:{question_id}@ozon'), password='secret')
+
+        stats = self._sync()
+
+        self.assertEqual(stats.get('created', 0), 0)
+        self.assertTrue(stats['error'])
+        self.assertEqual(UnmatchedMarketplaceQuestion.objects.get().question_id, str(question_id))
+        blocker.delete()
+        # курсор ушёл дальше, вопрос загружается из отложенных
+        self.assertEqual(self._sync()['created'], 1)
+        self.assertFalse(UnmatchedMarketplaceQuestion.objects.exists())
+        self.assertEqual(ProductQuestion.objects.get().text, 'Вопрос')
+
+    def test_errors_are_recorded_per_store(self):
+        self.fake.add_question('ozon', self.tokens['ozon'], 'A-1', 'Вопрос')
+        self.fake.add_token('wildberries', self.tokens['wildberries'])
+        self.fake.throttle('wildberries', retry_after=30)
+        # токена Маркета фейк не знает — 401
+
+        stats = self._sync()
+
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['failed_polls'], 2)
+        cursors = {c.marketplace.name: c for c in MarketplaceSyncCursor.objects.select_related('marketplace')}
+        self.assertEqual(cursors['ozon'].failures, 0)
+        self.assertIn('лимит', cursors['wildberries'].error)
+        self.assertEqual(cursors['yandex_market'].failures, 1)
+        self.assertIn('401', cursors['yandex_market'].error)
+
+
+class RotateMarketplaceTokensTests(TestCase):
+    def setUp(self):
+        self.old_key = Fernet(Fernet.generate_key())
+        store = Store.objects.create(name='Магазин')
+        self.tokens = []
+        for name in ('ozon', 'wildberries'):
+            token = MarketplaceIntegrationToken(store=store, marketplace=Marketplace.objects.create(name=name))
+            token._token = self.old_key.encrypt(f'{name}-secret'.encode()).decode()
+            token.save()
+            self.tokens.append(token)
+        keys = mock.patch.object(crypto, 'fernet', MultiFernet([crypto.primary_fernet, self.old_key]))
+        keys.start()
+        self.addCleanup(keys.stop)
+
+    def test_rotates_to_primary_key(self):
+        call_command('rotate_marketplace_tokens', stdout=io.StringIO())
+
+        for token in self.tokens:
+            token.refresh_from_db()
+            self.assertTrue(crypto.is_primary_key_token(token._token))
+        self.assertEqual(self.tokens[0].get_token(), 'ozon-secret')
+
+    def test_token_replaced_during_rotation_is_kept(self):
+        replaced, rotate = self.tokens[0], crypto.rotate_token
+
+        def replace_then_rotate(ciphertext):
+            # владелец сохраняет новый токен между чтением пакета и записью
+            if ciphertext == replaced._token:
+                replaced.set_token('new-secret')
+                replaced.save()
+            return rotate(ciphertext)
+
+        out = io.StringIO()
+        with mock.patch('core.management.commands.rotate_marketplace_tokens.rotate_token', replace_then_rotate):
+            call_command('rotate_marketplace_tokens', stdout=out)
+
+        replaced.refresh_from_db()
+        self.assertEqual(replaced.get_token(), 'new-secret')
+        self.assertIn('перешифровано 1, пропущено 1, изменено параллельно 1, ошибок 0', out.getvalue())
+
+
+class AnswerDeliveryTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.create(name='Магазин')
+        self.product = Product.objects.create(store=self.store, sku='A-1', title='Куртка', description='')
+        self.customer = CustomUser.objects.create_user(username='buyer', external_id='buyer@ozon')
+        self.fake = FakeMarketplace()
+        self.tokens = {'ozon': '42:ozon-key', 'wildberries': 'wb-jwt', 'yandex_market': '7:ym-key'}
+        self.questions = {}
+        for i, (name, token) in enumerate(self.tokens.items()):
+            marketplace = Marketplace.objects.create(name=name)
+            integration = MarketplaceIntegrationToken(store=self.store, marketplace=marketplace)
+            integration.set_token(token)
+            integration.save()
+            self.questions[name] = ProductQuestion.objects.create(
+                product=self.product, user=self.customer, text='Размер?', marketplace=marketplace,
+                external_question_id=str(100 + i),
+            )
+        self.fake.add_token('ozon', self.tokens['ozon'])
+        self.fake.add_token('wildberries', self.tokens['wildberries'])
+
+    def _reply(self, name, role='manager', text='Размер XL'):
+        return ProductQuestionMessage.objects.create(question=self.questions[name], role=role, text=text)
+
+    def _deliver(self):
+        worker = DeliveryWorker(transport=httpx.ASGITransport(app=self.fake))
+        async_to_sync(worker.run)(stop_when_empty=True)
+        return worker.stats.as_dict()
+
+    def test_replies_are_delivered_and_resolve_questions(self):
+        self._reply('ozon')
+        self._reply('wildberries', role='ai', text='Ответ ИИ')
+        # сообщения покупателя и вопросы не с маркетплейса не отправляются
+        self._reply('ozon', role='user', text='Спасибо')
+        local = ProductQuestion.objects.create(product=self.product, text='Локальный вопрос')
+        ProductQuestionMessage.objects.create(question=local, role='manager', text='Ответ')
+        self.assertEqual(AnswerDelivery.objects.count(), 2)
+
+        stats = self._deliver()
+
+        self.assertEqual(stats['delivered'], 2)
+        self.assertEqual(self.fake.answers['ozon'], [(self.tokens['ozon'], '100', 'Размер XL')])
+        self.assertEqual(self.fake.answers['wildberries'], [(self.tokens['wildberries'], '101', 'Ответ ИИ')])
+        self.assertFalse(AnswerDelivery.objects.exclude(status=AnswerDelivery.Status.DELIVERED).exists())
+        self.assertTrue(ProductQuestion.objects.get(pk=self.questions['ozon'].pk).is_resolved)
+        self.assertFalse(ProductQuestion.objects.get(pk=self.questions['yandex_market'].pk).is_resolved)
+
+    def test_retry_and_dead_letter(self):
+        throttled = self._reply('wildberries').delivery
+        rejected = self._reply('yandex_market').delivery
+        self.fake.throttle('wildberries', retry_after=1)
+
+        stats = self._deliver()
+
+        throttled.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual(stats['retried'], 2)
+        # 429 не тратит попытку, отказ маркетплейса — тратит и откладывает повтор
+        self.assertEqual((throttled.status, throttled.attempts), (AnswerDelivery.Status.PENDING, 0))
+        self.assertEqual((rejected.status, rejected.attempts), (AnswerDelivery.Status.PENDING, 1))
+        self.assertIn('401', rejected.error)
+        self.assertGreater(rejected.next_attempt_at, timezone.now())
+        self.assertIn('tgshop_delivery_queue{marketplace="yandex_market",status="pending"} 1',
+                      render_delivery_metrics())
+
+        AnswerDelivery.objects.update(next_attempt_at=timezone.now())
+        with override_settings(DELIVERY_MAX_ATTEMPTS=2):
+            stats = self._deliver()
+
+        rejected.refresh_from_db()
+        self.assertEqual(stats['delivered'], 1)
+        self.assertEqual(stats['dead'], 1)
+        self.assertEqual(rejected.status, AnswerDelivery.Status.DEAD)
+        self.assertFalse(ProductQuestion.objects.get(pk=self.questions['yandex_market'].pk).is_resolved)
+
+
+    def test_abandoned_sending_is_reclaimed_until_attempts_run_out(self):
+        delivery = self._reply('ozon').delivery
+        deliveries = AnswerDelivery.objects.filter(pk=delivery.pk)
+        stale = timezone.now() - timedelta(seconds=settings.DELIVERY_LOCK_TIMEOUT + 1)
+        marketplace_ids = [delivery.marketplace_id]
+
+        deliveries.update(status=AnswerDelivery.Status.SENDING, locked_at=stale, attempts=1)
+        self.assertEqual([entry['id'] for entry in outbox.claim(marketplace_ids, 10, 'test')], [delivery.pk])
+
+        deliveries.update(status=AnswerDelivery.Status.SENDING, locked_at=stale,
+                          attempts=settings.DELIVERY_MAX_ATTEMPTS)
+        self.assertEqual(outbox.claim(marketplace_ids, 10, 'test'), [])
+        self.assertEqual(deliveries.get().status, AnswerDelivery.Status.DEAD)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        store = Store.objects.create(name='Магазин', owner=owner)
+        self.kettle = Product.objects.create(
+            store=store, sku='KT-1', title='Чайник', description='Электрический чайник, kettle 1.7 liters',
+        )
+        question = ProductQuestion.objects.create(product=self.kettle, text='Сколько литров вмещают чайники?')
+        ProductQuestionMessage.objects.create(question=question, text='Чайник вмещает 1.7 литра', role='manager')
+
+        other_owner = CustomUser.objects.create_user(username='other', password='secret', role='owner')
+        other_store = Store.objects.create(name='Другой', owner=other_owner)
+        Product.objects.create(store=other_store, title='Чайник', description='Чужой чайник')
+
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+
+    def test_search_ranks_and_highlights_store_results(self):
+        response = self.client.get('/api/search/', {'q': 'чайники'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([product['id'] for product in data['products']], [self.kettle.pk])
+        self.assertIn('<mark>чайник</mark>', data['products'][0]['headline'])
+        self.assertEqual(len(data['questions']), 1)
+        self.assertIn('<mark>Чайник</mark>', data['messages'][0]['headline'])
+
+        data = self.client.get('/api/search/', {'q': 'kettles', 'type': 'products'}).json()
+        self.assertEqual(list(data), ['products'])
+        self.assertEqual(len(data['products']), 1)
+
+    def test_search_vector_follows_updates_and_typos(self):
+        self.kettle.title = 'Термос'
+        self.kettle.save()
+
+        data = self.client.get('/api/search/', {'q': 'термосы', 'type': 'products'}).json()
+        self.assertEqual([product['title'] for product in data['products']], ['Термос'])
+        # нечёткое совпадение по названию (pg_trgm)
+        data = self.client.get('/api/search/', {'q': 'термас', 'type': 'products'}).json()
+        self.assertEqual(len(data['products']), 1)
+
+    def test_search_validates_params(self):
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'x', 'type': 'users'}).status_code, 400)
+
+        customer = CustomUser.objects.create_user(username='customer', password='secret', role='user')
+        self.client.force_authenticate(customer)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'чайник'}).status_code, 403)
+
+
+@override_settings(SPEC_USAGE_FLUSH_INTERVAL=0)
+class SpecFilterTests(TransactionTestCase):
+    # TransactionTestCase: promote_spec_keys строит индексы CONCURRENTLY, вне транзакции
+
+    def setUp(self):
+        owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        store = Store.objects.create(name='Магазин', owner=owner)
+        for title, specifications in [
+            ('a', {'color': 'black', 'weight': 1.5, 'size': 'M'}),
+            ('b', {'color': 'white', 'weight': '3', 'size': 'L'}),
+            ('c', {'color': 'black', 'weight': 'heavy', 'size': 2}),
+        ]:
+            Product.objects.create(store=store, title=title, description='', specifications=specifications)
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+
+    def titles(self, **params):
+        response = self.client.get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(product['title'] for product in response.json()['results'])
+
+    def assert_filters(self):
+        self.assertEqual(self.titles(**{'spec.color': 'black'}), ['a', 'c'])
+        self.assertEqual(self.titles(**{'spec.size': '2'}), ['c'])
+        self.assertEqual(self.titles(**{'spec.size__in': 'M,L'}), ['a', 'b'])
+        self.assertEqual(self.titles(**{'spec.weight__lt': '2'}), ['a'])
+        self.assertEqual(self.titles(**{'spec.weight__gte': '1.5', 'spec.color': 'white'}), ['b'])
+
+    def test_filters_and_usage_stats(self):
+        self.assert_filters()
+        self.assertEqual(
+            dict(SpecKeyUsage.objects.values_list('key', 'filter_count')),
+            {'color': 2, 'size': 2, 'weight': 2},
+        )
+        self.assertEqual(self.client.get('/api/products/', {'spec.weight__lt': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/', {"spec.a'b": '1'}).status_code, 400)
+
+    def test_promoted_keys_use_typed_indexes(self):
+        self.assert_filters()
+        call_command('promote_spec_keys', '--min-count', '1', stdout=io.StringIO())
+        self.addCleanup(call_command, 'promote_spec_keys', '--demote', 'color', '--demote', 'size',
+                        '--demote', 'weight', stdout=io.StringIO())
+
+        promoted = dict(SpecKeyUsage.objects.values_list('key', 'value_type'))
+        self.assertEqual(promoted, {'color': 'text', 'size': 'text', 'weight': 'text'})
+        names = list(SpecKeyUsage.objects.values_list('index_name', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = ANY(%s)", [names])
+            self.assertEqual(cursor.fetchone()[0], 3)
+        # результаты те же, условия — по выражениям индексов
+        self.assert_filters()
+
+
+class MessageStreamTests(TransactionTestCase):
+    """NOTIFY доставляется только после COMMIT — нужны настоящие транзакции."""
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(username='owner', password='secret', role='owner')
+        self.store = Store.objects.create(name='Магазин', owner=self.owner)
+        self.customer = CustomUser.objects.create_user(username='customer', external_id='ext-1')
+        product = Product.objects.create(store=self.store, title='Чайник', description='')
+        self.question = ProductQuestion.objects.create(product=product, user=self.customer, text='Есть в наличии?')
+        self.missed = ProductQuestionMessage.objects.create(question=self.question, text='Есть', role='manager')
+
+        other_owner = CustomUser.objects.create_user(username='other', password='secret', role='owner')
+        other_store = Store.objects.create(name='Другой', owner=other_owner)
+        other_product = Product.objects.create(store=other_store, title='Чайник', description='')
+        self.other_question = ProductQuestion.objects.create(product=other_product, text='Есть в наличии?')
+
+    async def _next_message(self, events):
+        while True:
+            chunk = (await asyncio.wait_for(anext(events), timeout=5)).decode()
+            if 'event: message' in chunk:
+                return json.loads(chunk.split('data: ', 1)[1])
+
+    async def test_replays_from_last_event_id_and_pushes_new_messages(self):
+        response = await AsyncClient().get(
+            '/api/stream/messages/', {'token': str(AccessToken.for_user(self.owner))},
+            headers={'Last-Event-ID': str(self.missed.pk - 1)},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        try:
+            self.assertEqual((await self._next_message(events))['id'], self.missed.pk)
+
+            await ProductQuestionMessage.objects.acreate(question=self.other_question, text='Нет', role='owner')
+            started = time.monotonic()
+            created = await ProductQuestionMessage.objects.acreate(question=self.question, text='Да', role='ai')
+            message = await self._next_message(events)
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(message['id'], created.pk)
+            self.assertEqual(message['question_id'], self.question.pk)
+            self.assertEqual(message['text'], 'Да')
+
+            # как ASGIHandler после отключения клиента
+            await events.aclose()
+            await sync_to_async(response.close)()
+            await asyncio.sleep(0)
+            self.assertEqual(hub.subscribers, 0)
+        finally:
+            await hub.stop()
+
+    async def test_customer_stream_requires_own_question(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/stream/messages/')).status_code, 401)
+
+        token = str(AccessToken.for_user(self.customer))
+        response = await client.get('/api/stream/messages/', {'token': token})
+        self.assertEqual(response.status_code, 400)
+        response = await client.get('/api/stream/messages/', {'token': token, 'question': self.other_question.pk})
+        self.assertEqual(response.status_code, 404)
 
-# Create your tests here.
@@ -0,0 +1,199 @@
+"""
+Ограничение частоты запросов к API загрузки вопросов и сообщений (throttle_classes view).
+
+Token bucket на (эндпоинт, клиент, магазин): эндпоинт — throttle_scope view с лимитом из
+API_RATE_LIMITS, клиент — пользователь, ключ магазина X-API-KEY или держатель X-API-SECRET,
+магазин — пользователя, ключа, а для X-API-SECRET — товара или вопроса из запроса
+(view.get_throttle_store). Поток вопросов одного магазина не отнимает лимит у остальных.
+Отказ — 429 с Retry-After.
+
+Корзины хранятся в памяти процесса (API_RATE_LIMIT_BACKEND=memory: у каждого воркера свой
+лимит) или в UNLOGGED-таблице RateLimitBucket (database: общий лимит, один UPSERT на запрос).
+
+Адаптивный режим: пока задержка БД (core.db.db_latency) выше API_SHED_LATENCY_MS, запрос
+с X-API-KEY или X-API-SECRET стоит 1/API_SHED_FACTOR жетона — интеграции отступают,
+а панель магазина работает с прежними лимитами.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.throttling import BaseThrottle
+
+from .authentication import is_api_secret, request_store_key
+from .db import db_latency
+from .models import RateLimitBucket
+from .utils.cache import TTLCache
+from .utils.utils import get_request_store
+
+
+class MemoryBuckets:
+    """Корзины в памяти процесса. Давно не использованные вытесняются — вытесненная корзина снова полна."""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """Списать cost жетонов: 0 — запрос пропущен, иначе сколько секунд ждать."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Пополнение на момент запроса; в SET все выражения видят старую строку
+_REFILL = ("LEAST(%(burst)s, bucket.tokens + "
+           "EXTRACT(EPOCH FROM statement_timestamp() - bucket.updated_at)::float8 * %(rate)s)")
+
+
+class DatabaseBuckets:
+    """Корзины в таблице RateLimitBucket, общие для всех процессов и серверов."""
+
+    SQL = f"""
+        INSERT INTO core_ratelimitbucket AS bucket (key, tokens, allowed, updated_at)
+        VALUES (%(key)s, %(burst)s - %(cost)s, true, statement_timestamp())
+        ON CONFLICT (key) DO UPDATE SET
+            allowed = {_REFILL} >= %(cost)s,
+            tokens = {_REFILL} - CASE WHEN {_REFILL} >= %(cost)s THEN %(cost)s ELSE 0 END,
+            updated_at = statement_timestamp()
+        RETURNING tokens, allowed
+    """
+
+    def take(self, key, rate, burst, cost=1.0):
+        with connection.cursor() as cursor:
+            cursor.execute(self.SQL, {'key': key[:255], 'rate': rate, 'burst': burst, 'cost': cost})
+            tokens, allowed = cursor.fetchone()
+        return 0.0 if allowed else (cost - tokens) / rate
+
+    def clear(self):
+        RateLimitBucket.objects.all().delete()
+
+
+BACKENDS = {'memory': MemoryBuckets(), 'database': DatabaseBuckets()}
+
+# Отказы по (throttle_scope, причина): limit — лимит клиента, shed — адаптивный режим
+rejected = Counter()
+_rejected_lock = threading.Lock()
+
+# Последний замер задержки БД
+_latency = TTLCache(maxsize=1, ttl=settings.API_SHED_CHECK_INTERVAL)
+
+# (модель, pk) → store_id: магазин товара и вопроса не меняется; ненайденные не кэшируются
+_store_ids = TTLCache(maxsize=settings.STORE_CACHE_SIZE, ttl=settings.STORE_CACHE_TTL)
+
+
+def overloaded():
+    """Задержка БД выше API_SHED_LATENCY_MS (или БД не отвечает); без порога — всегда False."""
+    if not settings.API_SHED_LATENCY_MS:
+        return False
+    latency = _latency.get_or_set('default', db_latency)
+    return latency is None or latency > settings.API_SHED_LATENCY_MS
+
+
+def _store_key(model, pk):
+    try:
+        return model._meta.label, int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+def store_of(model, pk):
+    """store_id товара или вопроса по pk из тела запроса; None — не найден или pk некорректен."""
+    key = _store_key(model, pk)
+    if key is None:
+        return None
+    store_id = _store_ids.get(key)
+    if store_id is None:
+        store_id = model.objects.filter(pk=key[1]).values_list('store_id', flat=True).first()
+        if store_id is not None:
+            _store_ids.set(key, store_id)
+    return store_id
+
+
+async def astore_of(model, pk):
+    key = _store_key(model, pk)
+    if key is None:
+        return None
+    store_id = _store_ids.get(key)
+    if store_id is None:
+        store_id = await model.objects.filter(pk=key[1]).values_list('store_id', flat=True).afirst()
+        if store_id is not None:
+            _store_ids.set(key, store_id)
+    return store_id
+
+
+def client_key(request):
+    """Пользователь, ключ магазина или держатель X-API-SECRET; None — клиент не аутентифицирован."""
+    user = request.user
+    if user and user.is_authenticated:
+        return f"user{user.pk}"
+    store_key = request_store_key(request)
+    if store_key is not None:
+        return f"apikey{store_key.id}"
+    if is_api_secret(request.headers.get('X-API-SECRET')):
+        return 'secret'
+    return None
+
+
+class StoreRateThrottle(BaseThrottle):
+    """
+    Token bucket на (view.throttle_scope, клиент, магазин). View без лимита в API_RATE_LIMITS
+    и неаутентифицированные запросы (их отклоняет проверка доступа) не ограничиваются.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate, burst = settings.API_RATE_LIMITS.get(scope) or (0, 0)
+        client = client_key(request)
+        if not rate or client is None:
+            return True
+
+        if request.user.is_authenticated:
+            store = get_request_store(request)
+            store_id = store.pk if store else None
+            cost, reason = 1.0, 'limit'
+        else:
+            store_key = request_store_key(request)
+            if store_key is not None:
+                store_id = store_key.store_id
+            else:
+                get_store = getattr(view, 'get_throttle_store', None)
+                store_id = get_store(request) if get_store else None
+            cost, reason = (1 / settings.API_SHED_FACTOR, 'shed') if overloaded() else (1.0, 'limit')
+
+        buckets = BACKENDS[settings.API_RATE_LIMIT_BACKEND]
+        self.wait_seconds = buckets.take(f"{scope}:{client}:{store_id or '-'}", rate, burst, min(cost, burst))
+        if self.wait_seconds:
+            with _rejected_lock:
+                rejected[(scope, reason)] += 1
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def render_throttle_metrics(prefix='tgshop'):
+    """Отказы по лимитам запросов в формате Prometheus (счётчики процесса)."""
+    name = f'{prefix}_throttled_requests_total'
+    lines = [f'# HELP {name} Запросов отклонено с 429', f'# TYPE {name} counter']
+    with _rejected_lock:
+        lines += [f'{name}{{scope="{scope}",reason="{reason}"}} {count}'
+                  for (scope, reason), count in sorted(rejected.items())]
+    return '\n'.join(lines) + '\n'
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
@@ -7,7 +8,8 @@ from .views import (
     GenerateInviteLinkView,
     RegisterViaTokenView, ConfirmInviteView, MarketplaceTokenViewSet, ProductViewSet, QuestionAnswerViewSet,
     ProductQuestionViewSet, ProductQuestionMessageViewSet, ExternalQuestionCreateView, UserConversationView,
-    ShopUserListView
+    ShopUserListView, ExternalQuestionBatchCreateView, MetricsView, SearchView, MessageStreamView,
+    AsyncExternalQuestionCreateView, AsyncUserConversationView, HealthView, StoreAPIKeyViewSet
 )
 
 from rest_framework import permissions
@@ -23,14 +25,26 @@ router.register(
     MarketplaceTokenViewSet,
     basename='marketplace-token'
 )
+router.register(r'stores/(?P<store_id>\d+)/api-keys', StoreAPIKeyViewSet, basename='store-api-key')
+# Под ASGI горячие эндпоинты обслуживают async-view (тот же контракт, без Swagger-описания)
+if settings.ASYNC_VIEWS:
+    ExternalQuestionView, ConversationView = AsyncExternalQuestionCreateView, AsyncUserConversationView
+else:
+    ExternalQuestionView, ConversationView = ExternalQuestionCreateView, UserConversationView
+
 urlpatterns = [
     path('register/', RegisterUserView.as_view(), name='register'),
     path('shop_users/', ShopUserListView.as_view(), name='shop_users'),
-    path('conversations/', UserConversationView.as_view(), name='conversations'),
+    path('conversations/', ConversationView.as_view(), name='conversations'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('stream/messages/', MessageStreamView.as_view(), name='message-stream'),
     path('owners/<int:store_id>/invite-manager/', InviteManagerView.as_view(), name='invite-manager'),
     path('owners/<int:store_id>/generate-invite/', GenerateInviteLinkView.as_view(), name='generate-invite'),
     path('invite/<uuid:token>/', RegisterViaTokenView.as_view(), name='register-via-token'),
     path('', include(router.urls)),
-    path('external/questions/', ExternalQuestionCreateView.as_view(), name='external-question'),
+    path('external/questions/', ExternalQuestionView.as_view(), name='external-question'),
+    path('external/questions/batch/', ExternalQuestionBatchCreateView.as_view(), name='external-question-batch'),
     path('invite/<uuid:token>/confirm/', ConfirmInviteView.as_view(), name='invite-confirm'),
+    path('_metrics', MetricsView.as_view(), name='metrics'),
+    path('_health', HealthView.as_view(), name='health'),
 ]
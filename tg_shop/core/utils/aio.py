@@ -0,0 +1,94 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+def json_response(data, status=200):
+    # как JSONRenderer DRF: кириллица без \u-экранирования
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def _authenticators():
+    return [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+
+
+def _authenticate(request):
+    # Request DRF прогоняет DEFAULT_AUTHENTICATION_CLASSES (и CSRF для сессии) при обращении к user
+    drf_request = Request(request, authenticators=_authenticators())
+    return drf_request.user, drf_request.auth
+
+
+async def authenticate(request):
+    """
+    (user, auth) по тем же классам аутентификации, что и в APIView. Без заголовков
+    Authorization, X-API-KEY и cookie сессии аутентифицировать нечем — без перехода в поток.
+    """
+    if ('HTTP_AUTHORIZATION' not in request.META and 'HTTP_X_API_KEY' not in request.META
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES):
+        return AnonymousUser(), None
+    return await sync_to_async(_authenticate)(request)
+
+
+def request_data(request):
+    """Тело запроса: JSON или форма — как парсеры DRF по умолчанию."""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError as exc:
+            raise exceptions.ParseError(f'JSON parse error - {exc}')
+    return request.POST
+
+
+class AsyncAPIView(View):
+    """
+    Async-view с поведением APIView, которого в DRF нет: CSRF проверяет SessionAuthentication,
+    а не middleware; request.user и request.auth — из DEFAULT_AUTHENTICATION_CLASSES; APIException
+    превращаются в JSON-ответ с тем же статусом (401 без WWW-Authenticate — в 403, как в DRF).
+    throttle_classes проверяются до обработчика, отказ — 429 с Retry-After.
+    """
+    throttle_classes = ()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user, request.auth = await authenticate(request)
+            if self.throttle_classes:
+                # корзины и магазин клиента могут читаться из БД
+                await sync_to_async(self.check_throttles)(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+    def check_throttles(self, request):
+        throttles = [throttle() for throttle in self.throttle_classes]
+        waits = [throttle.wait() for throttle in throttles if not throttle.allow_request(request, self)]
+        if waits:
+            raise exceptions.Throttled(max(wait or 0 for wait in waits))
+
+    def handle_exception(self, request, exc):
+        headers = {}
+        status_code = exc.status_code
+        if getattr(exc, 'wait', None):
+            headers['Retry-After'] = '%d' % float(exc.wait)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            auth_header = _authenticators()[0].authenticate_header(request)
+            if auth_header:
+                headers['WWW-Authenticate'] = auth_header
+            else:
+                status_code = status.HTTP_403_FORBIDDEN
+        detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = json_response(detail, status=status_code)
+        for name, value in headers.items():
+            response[name] = value
+        return response
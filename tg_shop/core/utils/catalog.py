@@ -0,0 +1,352 @@
+import codecs
+import csv
+import io
+import json
+import re
+import time
+from itertools import islice
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.ai.context import invalidate_product_contexts
+from core.images.fetch import is_public_address
+from core.images.storage import storage_url
+from core.models import Marketplace, Product, ProductImage
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ('sku', 'title', 'description', 'specifications', 'marketplaces', 'images')
+
+_LIST_SEPARATOR_RE = re.compile(r'[|,]')
+_URL_SEPARATOR_RE = re.compile(r'[|\s]+')
+
+
+class RecordError(ValueError):
+    pass
+
+
+def _is_image_url(url):
+    # URLValidator на 100k записей — четверть времени импорта; URL всё равно проверит скачивание
+    # (core.images.fetch резолвит хост). Здесь отсекаются только явные внутренние адреса
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    if parts.scheme not in ('http', 'https') or not parts.hostname or len(url) > 1000:
+        return False
+    host = parts.hostname
+    if host == 'localhost' or host.endswith('.localhost'):
+        return False
+    return is_public_address(host) or not _looks_like_ip(host)
+
+
+def _looks_like_ip(host):
+    return ':' in host or host.replace('.', '').isdigit()
+
+
+# ── чтение ─────────────────────────────────
+
+def iter_records(stream, file_format):
+    """
+    Построчно читать CSV/JSONL из бинарного потока, не загружая файл целиком.
+    Возвращает пары (line, record); битая строка JSONL — (line, RecordError).
+    """
+    # codecs читает кусками через stream.read() — подходит и для тела запроса, и для файла
+    text = codecs.getreader('utf-8-sig')(stream)
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line, raw in enumerate(text, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            yield line, json.loads(raw)
+        except ValueError:
+            yield line, RecordError('Invalid JSON')
+
+
+def detect_format(content_type='', filename=''):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv') or filename.lower().endswith('.csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines') \
+            or filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def _split(value, separator_re):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in separator_re.split(str(value)) if item.strip()]
+
+
+def parse_record(record, marketplaces):
+    """
+    Запись каталога → поля товара. CSV: specifications — JSON-строка и/или колонки spec.<ключ>,
+    marketplaces — через «|» или «,», images — URL через «|» или пробел.
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise RecordError('Invalid record')
+
+    sku = str(record.get('sku') or '').strip()
+    title = str(record.get('title') or '').strip()
+    if not sku or not title:
+        raise RecordError('sku and title are required')
+    if len(sku) > 64 or len(title) > 255:
+        raise RecordError('sku or title is too long')
+
+    specifications = record.get('specifications') or {}
+    if isinstance(specifications, str):
+        try:
+            specifications = json.loads(specifications)
+        except ValueError:
+            raise RecordError('specifications must be a JSON object')
+    if not isinstance(specifications, dict):
+        raise RecordError('specifications must be a JSON object')
+    for key, value in record.items():
+        if key and key.startswith('spec.') and value not in (None, ''):
+            specifications[key[5:]] = value
+
+    names = _split(record.get('marketplaces'), _LIST_SEPARATOR_RE)
+    marketplace_ids = None
+    if names is not None:
+        unknown = [name for name in names if name not in marketplaces]
+        if unknown:
+            raise RecordError(f"Unknown marketplaces: {', '.join(unknown)}")
+        marketplace_ids = {marketplaces[name] for name in names}
+
+    images = _split(record.get('images'), _URL_SEPARATOR_RE) or []
+    for url in images:
+        if not _is_image_url(url):
+            raise RecordError(f'Invalid image URL: {url[:200]}')
+
+    return {
+        'sku': sku,
+        'title': title,
+        'description': str(record.get('description') or ''),
+        'specifications': specifications,
+        'marketplace_ids': marketplace_ids,
+        'images': list(dict.fromkeys(images)),
+    }
+
+
+# ── импорт ─────────────────────────────────
+
+class CatalogImport:
+    """
+    Потоковый импорт каталога магазина (PostgreSQL): пачки по CATALOG_IMPORT_CHUNK_SIZE записей.
+    Каждая пачка — COPY во временную таблицу и один INSERT ... ON CONFLICT (store_id, sku) DO UPDATE,
+    связи с маркетплейсами и фото — тоже через COPY. Фото не скачиваются в запросе:
+    создаются ProductImage с source_url, их скачивает run_image_workers.
+    """
+
+    def __init__(self, store, user=None, chunk_size=None):
+        self.store = store
+        self.user = user
+        self.chunk_size = chunk_size or settings.CATALOG_IMPORT_CHUNK_SIZE
+        # name не уникален — берём первую запись, как ingest_questions
+        self.marketplaces = dict(Marketplace.objects.order_by('-id').values_list('name', 'id'))
+        self.stats = {'created': 0, 'updated': 0, 'errors': 0, 'images_queued': 0}
+        self.errors = []
+
+    def run(self, records):
+        started = time.perf_counter()
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+        elapsed = time.perf_counter() - started
+        total = self.stats['created'] + self.stats['updated']
+        return {
+            **self.stats,
+            'error_details': self.errors,
+            'seconds': round(elapsed, 3),
+            'products_per_s': round(total / elapsed, 1) if elapsed else None,
+        }
+
+    def error(self, line, message):
+        self.stats['errors'] += 1
+        if len(self.errors) < settings.CATALOG_IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def import_chunk(self, chunk):
+        rows = {}
+        for line, record in chunk:
+            try:
+                row = parse_record(record, self.marketplaces)
+            except RecordError as exc:
+                self.error(line, str(exc))
+                continue
+            # Повтор артикула в пачке — побеждает последняя запись
+            rows[row['sku']] = row
+        if not rows:
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            ids, updated = self.upsert_products(cursor, rows)
+            self.link_marketplaces(cursor, rows, ids)
+            self.queue_images(cursor, rows, ids)
+
+        invalidate_product_contexts(updated)
+        self.stats['updated'] += len(updated)
+        self.stats['created'] += len(rows) - len(updated)
+
+    def upsert_products(self, cursor, rows):
+        """
+        COPY пачки во временную таблицу и INSERT ... ON CONFLICT (store_id, sku) DO UPDATE из неё.
+        Возвращает ({sku: id}, [id обновлённых товаров]).
+        """
+        # Внутри внешней транзакции (ATOMIC_REQUESTS, тесты) ON COMMIT DROP не срабатывает между пачками
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS catalog_import_stage "
+            "(sku text, title text, description text, specifications jsonb) ON COMMIT DROP"
+        )
+        cursor.execute("TRUNCATE catalog_import_stage")
+        _copy(cursor, 'catalog_import_stage', ('sku', 'title', 'description', 'specifications'), (
+            (row['sku'], row['title'], row['description'], json.dumps(row['specifications'], ensure_ascii=False))
+            for row in rows.values()
+        ))
+        cursor.execute(
+            f"INSERT INTO {_table(Product)} (store_id, sku, title, description, specifications, created_by_id) "
+            f"SELECT %s, sku, title, description, specifications, %s FROM catalog_import_stage "
+            f"ON CONFLICT (store_id, sku) DO UPDATE SET title = EXCLUDED.title, "
+            f"description = EXCLUDED.description, specifications = EXCLUDED.specifications "
+            # xmax = 0 только у только что вставленных строк
+            f"RETURNING id, sku, xmax = 0",
+            [self.store.pk, getattr(self.user, 'pk', None)],
+        )
+        ids = {}
+        updated = []
+        for product_id, sku, inserted in cursor.fetchall():
+            ids[sku] = product_id
+            if not inserted:
+                updated.append(product_id)
+        return ids, updated
+
+    def link_marketplaces(self, cursor, rows, ids):
+        # Колонка marketplaces задаёт полный список: старые связи заменяются
+        replaced = {sku: row['marketplace_ids'] for sku, row in rows.items() if row['marketplace_ids'] is not None}
+        if not replaced:
+            return
+        through = _table(Product.marketplaces.through)
+        cursor.execute(f"DELETE FROM {through} WHERE product_id = ANY(%s)", [[ids[sku] for sku in replaced]])
+        _copy(cursor, through, ('product_id', 'marketplace_id'), (
+            (ids[sku], marketplace_id)
+            for sku, marketplace_ids in replaced.items()
+            for marketplace_id in marketplace_ids
+        ))
+
+    def queue_images(self, cursor, rows, ids):
+        wanted = {(ids[sku], url) for sku, row in rows.items() for url in row['images']}
+        if not wanted:
+            return
+        # Повторный импорт тех же URL не создаёт дубли фото
+        cursor.execute(
+            f"SELECT product_id, source_url FROM {_table(ProductImage)} "
+            f"WHERE product_id = ANY(%s) AND source_url <> ''",
+            [list({product_id for product_id, _ in wanted})],
+        )
+        new = sorted(wanted - set(cursor.fetchall()))
+        now = timezone.now()
+        _copy(cursor, _table(ProductImage), _IMAGE_COLUMNS, (
+            (product_id, '', '', url, '', '{}', ProductImage.Status.PENDING.value, 0, '', now)
+            for product_id, url in new
+        ))
+        self.stats['images_queued'] += len(new)
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+# Колонки ProductImage без значений по умолчанию в БД: COPY должен заполнить их явно
+_IMAGE_COLUMNS = (
+    'product_id', 'image', 'caption', 'source_url', 'content_hash', 'renditions', 'status', 'attempts', 'error',
+    'created_at',
+)
+
+
+def _copy(cursor, table, columns, rows):
+    """COPY ... FROM STDIN через psycopg — на порядок быстрее INSERT с параметрами."""
+    with cursor.cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+def import_catalog(store, stream, file_format, user=None, chunk_size=None):
+    return CatalogImport(store, user=user, chunk_size=chunk_size).run(iter_records(stream, file_format))
+
+
+# ── экспорт ────────────────────────────────
+
+def iter_catalog(store, chunk_size=None):
+    """
+    Товары магазина пачками по id (keyset): в памяти не больше одной пачки.
+    Связи и фото — по одному запросу на пачку.
+    """
+    chunk_size = chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE
+    through = Product.marketplaces.through
+    last_id = 0
+    while True:
+        products = list(
+            Product.objects.filter(store=store, id__gt=last_id).order_by('id')
+            .values('id', 'sku', 'title', 'description', 'specifications')[:chunk_size]
+        )
+        if not products:
+            return
+        ids = [product['id'] for product in products]
+        marketplaces = {}
+        for product_id, name in through.objects.filter(product_id__in=ids).values_list(
+            'product_id', 'marketplace__name',
+        ):
+            marketplaces.setdefault(product_id, []).append(name)
+        images = {}
+        for product_id, image, source_url in ProductImage.objects.filter(product_id__in=ids).order_by('id').values_list(
+            'product_id', 'image', 'source_url',
+        ):
+            images.setdefault(product_id, []).append(storage_url(image) if image else source_url)
+
+        for product in products:
+            product['marketplaces'] = sorted(marketplaces.get(product['id'], []))
+            product['images'] = images.get(product['id'], [])
+            yield product
+        last_id = ids[-1]
+
+
+def export_lines(products, file_format):
+    """Строки CSV/JSONL для StreamingHttpResponse."""
+    if file_format == 'jsonl':
+        for product in products:
+            yield json.dumps({field: product[field] for field in EXPORT_FIELDS}, ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for product in products:
+        writer.writerow([
+            product['sku'] or '',
+            product['title'],
+            product['description'],
+            json.dumps(product['specifications'], ensure_ascii=False),
+            '|'.join(product['marketplaces']),
+            '|'.join(product['images']),
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
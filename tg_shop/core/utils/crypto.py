@@ -1,7 +1,18 @@
-from cryptography.fernet import Fernet
+import hashlib
+import secrets
+
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from django.conf import settings
 
-fernet = Fernet(settings.FERNET_KEY.encode())
+from .cache import TTLCache
+
+# Первый ключ — основной (им шифруем), остальные — только для расшифровки старых значений
+primary_fernet = Fernet(settings.FERNET_KEYS[0].encode())
+fernet = MultiFernet([Fernet(key.encode()) for key in settings.FERNET_KEYS])
+
+# (store_id, marketplace_id, sha256(шифротекст)) → расшифрованный токен
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
 
 def encrypt_token(data: str) -> str:
     return fernet.encrypt(data.encode()).decode()
@@ -9,3 +20,29 @@ def encrypt_token(data: str) -> str:
 def decrypt_token(data: str) -> str:
     return fernet.decrypt(data.encode()).decode()
 
+def rotate_token(data: str) -> str:
+    """Перешифровать значение основным ключом."""
+    return fernet.rotate(data.encode()).decode()
+
+def is_primary_key_token(data: str) -> bool:
+    try:
+        primary_fernet.decrypt(data.encode())
+    except InvalidToken:
+        return False
+    return True
+
+def token_cache_key(store_id, marketplace_id, ciphertext: str):
+    return store_id, marketplace_id, hashlib.sha256(ciphertext.encode()).hexdigest()
+
+def mask_token(token: str) -> str:
+    if len(token) <= 8:
+        return '*' * len(token)
+    # длинные токены (JWT Wildberries) маскируем фиксированным числом звёздочек
+    return f"{token[:4]}{'*' * min(len(token)-8, 24)}{token[-4:]}"
+
+def generate_api_key(prefix='tgs_') -> str:
+    return prefix + secrets.token_urlsafe(32)
+
+def hash_api_key(raw_key: str) -> str:
+    # у ключа 256 бит случайности — медленный хэш для паролей не нужен
+    return hashlib.sha256(raw_key.encode()).hexdigest()
@@ -0,0 +1,325 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.ai.queue import enqueue_questions
+from core.models import CustomUser, Product, Marketplace, ProductQuestion
+from .cache import TTLCache
+
+
+REQUIRED_FIELDS = ('external_id', 'product', 'text')
+IDEMPOTENCY_KEY_MAX_LENGTH = 200
+
+# Ключ идемпотентности → id вопроса: повтор одиночной загрузки в пределах TTL не идёт в БД
+idempotency_cache = TTLCache(maxsize=settings.IDEMPOTENCY_CACHE_SIZE, ttl=settings.IDEMPOTENCY_CACHE_TTL)
+
+
+def _item_error(index, message):
+    return {'index': index, 'status': 'error', 'error': message}
+
+
+def external_username(external_id):
+    """
+    username пользователя, созданного по external_id: хэш всего ID, а не его префикс —
+    у «Анна Петрова@ozon» и «Анна Петрова@wildberries» разные username.
+    """
+    return f"user_{hashlib.sha256(external_id.encode()).hexdigest()[:32]}"
+
+
+def _resolve_users(external_ids):
+    """
+    external_id → CustomUser. Недостающих пользователей создаём одним bulk_create.
+    """
+    users = {u.external_id: u for u in CustomUser.objects.filter(external_id__in=external_ids)}
+    missing = [ext_id for ext_id in external_ids if ext_id not in users]
+    if missing:
+        CustomUser.objects.bulk_create(
+            [CustomUser(external_id=ext_id, username=external_username(ext_id), role='user') for ext_id in missing],
+            ignore_conflicts=True,
+        )
+        # ignore_conflicts не возвращает PK — дочитываем созданных (и созданных параллельно)
+        users.update({u.external_id: u for u in CustomUser.objects.filter(external_id__in=missing)})
+    return users
+
+
+def _resolve_marketplaces(names):
+    # name не уникален — берём первую запись, как Marketplace.objects.filter(name=...).first()
+    marketplaces = {}
+    for marketplace in Marketplace.objects.filter(name__in=names).order_by('-id'):
+        marketplaces[marketplace.name] = marketplace
+    return marketplaces
+
+
+def _load_questions(keys):
+    """(marketplace_id, question_id) → (id, store_id) сохранённых вопросов с этими ключами."""
+    if not keys:
+        return {}
+    questions = ProductQuestion.objects.filter(
+        marketplace_id__in={marketplace_id for marketplace_id, _ in keys},
+        external_question_id__in={question_id for _, question_id in keys},
+    ).values_list('id', 'marketplace_id', 'external_question_id', 'store_id')
+    return {(marketplace_id, question_id): (pk, store) for pk, marketplace_id, question_id, store in questions}
+
+
+def _insert_keyed(questions):
+    """
+    INSERT ... ON CONFLICT DO NOTHING RETURNING: {(marketplace_id, question_id): id} только строк,
+    вставленных этим запросом. bulk_create(ignore_conflicts=True) id не возвращает, и ключ,
+    который успел занять параллельный повтор, нельзя было бы отличить от своего.
+    """
+    if not questions:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {connection.ops.quote_name(ProductQuestion._meta.db_table)} "
+            f"(product_id, user_id, text, marketplace_id, external_question_id, is_resolved, created_at) "
+            f"SELECT *, false, %s FROM unnest(%s::bigint[], %s::bigint[], %s::text[], %s::bigint[], %s::text[]) "
+            f"ON CONFLICT DO NOTHING "
+            f"RETURNING id, marketplace_id, external_question_id",
+            [
+                timezone.now(),
+                [question.product_id for question in questions],
+                [question.user_id for question in questions],
+                [question.text for question in questions],
+                [question.marketplace_id for question in questions],
+                [question.external_question_id for question in questions],
+            ],
+        )
+        return {(marketplace_id, question_id): pk for pk, marketplace_id, question_id in cursor.fetchall()}
+
+
+def _duplicate(index, stored, product):
+    """
+    Повтор уже сохранённого вопроса. Ключ (marketplace, question_id) уникален глобально, а дубль
+    засчитывается только в пределах магазина товара: id вопроса чужого магазина не раскрывается.
+    """
+    if stored is None:
+        # занявший ключ вопрос удалён между вставкой и чтением
+        return _item_error(index, 'Question could not be created')
+    question_id, store_id = stored
+    if store_id != product.store_id:
+        return _item_error(index, 'Question id is used by another store')
+    return {'index': index, 'status': 'duplicate', 'question_id': question_id}
+
+
+def ingest_questions(items, store_id=None):
+    """
+    Пакетная загрузка вопросов из маркетплейсов. С store_id — только к товарам этого магазина,
+    вопросы к остальным получают ошибку «Product not found».
+
+    Пользователи, товары и маркетплейсы резолвятся несколькими запросами на весь пакет,
+    новые вопросы создаются одним INSERT. Повтор вопроса с тем же (marketplace, question_id)
+    не создаёт дубль — возвращается существующий question_id, если вопрос из магазина того же
+    товара, иначе ошибка. Строка, которую опередил параллельный повтор, тоже получает duplicate.
+
+    Возвращает список результатов в порядке входных элементов:
+    {'index', 'status': 'created' | 'duplicate' | 'error', 'question_id' | 'error'}
+    """
+    results = [None] * len(items)
+    valid = []
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = _item_error(index, 'Invalid item')
+            continue
+        if not all(item.get(field) for field in REQUIRED_FIELDS):
+            results[index] = _item_error(index, 'Missing required fields')
+            continue
+        try:
+            product_id = int(item['product'])
+        except (TypeError, ValueError):
+            results[index] = _item_error(index, 'Invalid product id')
+            continue
+        question_id = item.get('question_id')
+        valid.append((index, {
+            'external_id': str(item['external_id']),
+            'product': product_id,
+            'text': item['text'],
+            'marketplace': item.get('marketplace'),
+            'question_id': str(question_id) if question_id else None,
+        }))
+
+    if not valid:
+        return results
+
+    products = Product.objects.all() if store_id is None else Product.objects.filter(store_id=store_id)
+    products = products.in_bulk({item['product'] for _, item in valid})
+    marketplaces = _resolve_marketplaces({item['marketplace'] for _, item in valid if item['marketplace']})
+
+    # Уже загруженные ранее вопросы (идемпотентность по ID вопроса на маркетплейсе)
+    existing = _load_questions({
+        (marketplaces[item['marketplace']].id, item['question_id'])
+        for _, item in valid if item['question_id'] and item['marketplace'] in marketplaces
+    })
+
+    pending = []
+    seen = {}
+    for index, item in valid:
+        product = products.get(item['product'])
+        if product is None:
+            results[index] = _item_error(index, 'Product not found')
+            continue
+
+        marketplace = marketplaces.get(item['marketplace'])
+        # Без маркетплейса ключ (NULL, question_id) не уникален в БД — дедуплицировать не по чему
+        key = (marketplace.id, item['question_id']) if marketplace and item['question_id'] else None
+        if key in existing:
+            results[index] = _duplicate(index, existing[key], product)
+            continue
+        if key in seen:
+            seen[key].append((index, product))
+            continue
+        if key:
+            seen[key] = []
+        pending.append((index, item, product, marketplace, key))
+
+    if not pending:
+        return results
+
+    with transaction.atomic():
+        users = _resolve_users({item['external_id'] for _, item, _, _, _ in pending})
+        keyed, plain = [], []
+        for entry in pending:
+            index, item, product, marketplace, key = entry
+            user = users.get(item['external_id'])
+            if user is None:
+                # username уже занят пользователем, созданным не по external_id
+                for failed_index in [index, *(dup_index for dup_index, _ in seen.get(key, []))]:
+                    results[failed_index] = _item_error(failed_index, 'User could not be created')
+                continue
+            question = ProductQuestion(
+                product=product,
+                user=user,
+                text=item['text'],
+                marketplace=marketplace,
+                external_question_id=key[1] if key else None,
+            )
+            (keyed if key else plain).append((index, key, question))
+
+        ProductQuestion.objects.bulk_create([question for _, _, question in plain])
+
+        inserted = _insert_keyed([question for _, _, question in keyed])
+        # Не вставленные строки проиграли гонку параллельному повтору — читаем его вопросы
+        lost = _load_questions({key for _, key, _ in keyed if key not in inserted})
+
+        # bulk_create не шлёт post_save — ставим новые вопросы в очередь ИИ явно
+        enqueue_questions(
+            [(question.id, question.product_id) for _, _, question in plain] +
+            [(inserted[key], question.product_id) for _, key, question in keyed if key in inserted]
+        )
+
+    for index, _, question in plain:
+        results[index] = {'index': index, 'status': 'created', 'question_id': question.id}
+
+    for index, key, question in keyed:
+        if key in inserted:
+            stored = (inserted[key], question.product.store_id)
+            results[index] = {'index': index, 'status': 'created', 'question_id': inserted[key]}
+        else:
+            stored = lost.get(key)
+            results[index] = _duplicate(index, stored, question.product)
+        for dup_index, product in seen[key]:
+            results[dup_index] = _duplicate(dup_index, stored, product)
+
+    return results
+
+
+class IdempotencyKeys:
+    """
+    Ключи одиночной загрузки вопроса: (маркетплейс, question_id маркетплейса) в пределах
+    магазина товара и/или заголовок Idempotency-Key. Заголовок действует в пределах клиента
+    (scope) и хранится в ProductQuestion.idempotency_key с его префиксом.
+
+    Повтор находится в idempotency_cache, иначе — одним запросом по уникальным индексам.
+    insert() вставляет через ON CONFLICT DO NOTHING: параллельные повторы не падают
+    на IntegrityError и получают один и тот же вопрос.
+    """
+
+    def __init__(self, marketplace, question_id, header, scope, store_id):
+        # question_id чужого магазина не находится — его вопрос не раскрывается
+        self.question = (store_id, marketplace, str(question_id)) if marketplace and question_id else None
+        self.stored = f"{scope}:{header}" if header else None
+
+    def __bool__(self):
+        return bool(self.question or self.stored)
+
+    def _cache_keys(self):
+        return [key for key in (('question', self.question), ('header', self.stored)) if key[1]]
+
+    def queryset(self):
+        condition = Q()
+        if self.question:
+            store_id, marketplace, question_id = self.question
+            condition |= Q(store_id=store_id, marketplace__name=marketplace, external_question_id=question_id)
+        if self.stored:
+            condition |= Q(idempotency_key=self.stored)
+        if not condition:
+            return ProductQuestion.objects.none().values_list('id', flat=True)
+        return ProductQuestion.objects.filter(condition).values_list('id', flat=True)
+
+    def cached(self):
+        for key in self._cache_keys():
+            question_id = idempotency_cache.get(key)
+            if question_id is not None:
+                return question_id
+        return None
+
+    def remember(self, question_id):
+        for key in self._cache_keys():
+            idempotency_cache.set(key, question_id)
+        return question_id
+
+    def lookup(self):
+        """id ранее загруженного вопроса или None."""
+        question_id = self.cached()
+        if question_id is None:
+            question_id = self.queryset().first()
+        return self.remember(question_id) if question_id is not None else None
+
+    async def alookup(self):
+        question_id = self.cached()
+        if question_id is None:
+            question_id = await self.queryset().afirst()
+        return self.remember(question_id) if question_id is not None else None
+
+    def build(self, **fields):
+        if fields.get('marketplace') is None:
+            # Без маркетплейса (marketplace, question_id) не уникален — как в ingest_questions
+            self.question = None
+        return ProductQuestion(
+            external_question_id=self.question[2] if self.question else None,
+            idempotency_key=self.stored,
+            **fields,
+        )
+
+    def insert(self, question):
+        """
+        Создать вопрос (или найти вставленный параллельным повтором) и поставить в очередь ИИ.
+        None — question_id маркетплейса уже занят вопросом другого магазина.
+        """
+        if not self:
+            # build() снял ключ (маркетплейс не найден) — дубли искать не по чему
+            question.save()
+            return question.id
+        ProductQuestion.objects.bulk_create([question], ignore_conflicts=True)
+        question_id = self.queryset().first()
+        if question_id is None:
+            return None
+        # bulk_create не шлёт post_save; повторная постановка в очередь игнорируется
+        enqueue_questions([(question_id, question.product_id)])
+        return self.remember(question_id)
+
+    async def ainsert(self, question):
+        if not self:
+            await question.asave()
+            return question.id
+        await ProductQuestion.objects.abulk_create([question], ignore_conflicts=True)
+        question_id = await self.queryset().afirst()
+        if question_id is None:
+            return None
+        await sync_to_async(enqueue_questions)([(question_id, question.product_id)])
+        return self.remember(question_id)
@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+
+from core.models import Product, ProductQuestion, ProductQuestionMessage
+
+SEARCH_TYPES = ('products', 'questions', 'messages')
+
+
+def search_query(text):
+    """websearch-синтаксис («кавычки», -исключение, or) в русской и английской конфигурациях."""
+    return (
+        SearchQuery(text, config='russian', search_type='websearch') |
+        SearchQuery(text, config='english', search_type='websearch')
+    )
+
+
+def _headline(field, query):
+    return SearchHeadline(
+        field, query, config='russian', start_sel='<mark>', stop_sel='</mark>',
+        max_words=25, min_words=8, max_fragments=2,
+    )
+
+
+def _ranked(queryset, match, rank, limit):
+    """
+    Частое слово совпадает с сотнями тысяч строк, а ts_rank считается по каждой из них.
+    Поэтому GIN-индекс отбирает не больше SEARCH_MAX_CANDIDATES строк, ранжируются только они.
+    """
+    candidates = queryset.filter(match).values('pk')[:settings.SEARCH_MAX_CANDIDATES]
+    return (
+        queryset.model.objects
+        .filter(pk__in=candidates)
+        .annotate(rank=rank)
+        .order_by('-rank', '-pk')[:limit]
+    )
+
+
+def search_products(store, text, limit):
+    query = search_query(text)
+    products = _ranked(
+        Product.objects.filter(store=store),
+        # полнотекстовое совпадение или похожее название (опечатки)
+        Q(search_vector=query) | Q(title__trigram_similar=text),
+        SearchRank(F('search_vector'), query) + TrigramSimilarity('title', text),
+        limit,
+    )
+    return list(
+        products
+        .annotate(headline=_headline('description', query))
+        .values('id', 'sku', 'title', 'headline', 'rank')
+    )
+
+
+def search_questions(store, text, limit):
+    query = search_query(text)
+    questions = _ranked(
+        ProductQuestion.objects.filter(store=store),
+        Q(search_vector=query),
+        SearchRank(F('search_vector'), query),
+        limit,
+    )
+    return list(
+        questions
+        .annotate(headline=_headline('text', query))
+        .values('id', 'product_id', 'is_resolved', 'created_at', 'headline', 'rank')
+    )
+
+
+def search_messages(store, text, limit):
+    query = search_query(text)
+    messages = _ranked(
+        ProductQuestionMessage.objects.filter(store=store),
+        Q(search_vector=query),
+        SearchRank(F('search_vector'), query),
+        limit,
+    )
+    return list(
+        messages
+        .annotate(headline=_headline('text', query))
+        .values('id', 'question_id', 'role', 'sent_at', 'headline', 'rank')
+    )
+
+
+SEARCHES = {
+    'products': search_products,
+    'questions': search_questions,
+    'messages': search_messages,
+}
+
+
+def search(store, text, types=SEARCH_TYPES, limit=None):
+    limit = limit or settings.SEARCH_PAGE_SIZE
+    return {search_type: SEARCHES[search_type](store, text, limit) for search_type in types}
@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import DecimalField, Func, Q
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from core.models import Product, SpecKeyUsage
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SPEC_PREFIX = 'spec.'
+RANGE_OPERATORS = ('lt', 'lte', 'gt', 'gte')
+OPERATORS = ('exact', 'in') + RANGE_OPERATORS
+# Ключ подставляется в DDL индексов promote_spec_keys — только буквы, цифры, _, - и пробел
+KEY_RE = re.compile(r'^[\w\- ]{1,64}$')
+
+_promoted_cache = TTLCache(maxsize=1, ttl=settings.SPEC_PROMOTED_CACHE_TTL)
+
+
+class SpecNumeric(Func):
+    """core_spec_numeric(specifications -> 'ключ') — то же выражение, что в числовых индексах promote_spec_keys."""
+    function = 'core_spec_numeric'
+    output_field = DecimalField()
+
+    def __init__(self, key):
+        super().__init__(KeyTransform(key, 'specifications'))
+
+
+def spec_text(key):
+    """specifications ->> 'ключ' — выражение текстовых индексов promote_spec_keys."""
+    return KeyTextTransform(key, 'specifications')
+
+
+def _number(value):
+    try:
+        number = Decimal(value.strip())
+    except (InvalidOperation, AttributeError):
+        return None
+    return number if number.is_finite() else None
+
+
+def _json_values(value):
+    """
+    Значение из query string совпадает со строкой и с числом/булевым в JSON:
+    ?spec.weight=2 находит и {"weight": 2}, и {"weight": "2"}.
+    """
+    values = [value]
+    number = _number(value)
+    if number is not None:
+        values.append(int(number) if number == number.to_integral_value() else float(number))
+    if value in ('true', 'false'):
+        values.append(value == 'true')
+    return values
+
+
+def parse_spec_filters(params):
+    """
+    [(key, operator, [values])] из ?spec.color=black&spec.weight__lt=2&spec.size__in=S,M.
+    Ошибки — ValidationError (400).
+    """
+    filters = []
+    for name in params:
+        if not name.startswith(SPEC_PREFIX):
+            continue
+        key, _, operator = name[len(SPEC_PREFIX):].rpartition('__')
+        if operator not in OPERATORS:
+            # двойное подчёркивание без оператора — часть ключа
+            key, operator = name[len(SPEC_PREFIX):], 'exact'
+        if not KEY_RE.match(key):
+            raise ValidationError({name: "Недопустимый ключ характеристики"})
+
+        raw_values = params.getlist(name)
+        if operator == 'in':
+            values = [item.strip() for raw in raw_values for item in raw.split(',') if item.strip()]
+        else:
+            values = raw_values
+        if operator in RANGE_OPERATORS:
+            numbers = [_number(value) for value in values]
+            if None in numbers:
+                raise ValidationError({name: "Ожидается число"})
+            values = numbers
+        if values:
+            filters.append((key, operator, values))
+    return filters
+
+
+def promoted_keys():
+    """{key: value_type} ключей с индексами promote_spec_keys; кэшируется на SPEC_PROMOTED_CACHE_TTL."""
+    return _promoted_cache.get_or_set('keys', lambda: dict(
+        SpecKeyUsage.objects.exclude(index_name='').values_list('key', 'value_type')
+    ))
+
+
+def filter_by_specs(queryset, params):
+    """
+    Применить фильтры spec.* к queryset товаров.
+
+    Равенство — specifications @> '{"key": value}' (GIN jsonb_path_ops), сравнения —
+    core_spec_numeric(...). Для ключей с индексами promote_spec_keys условие строится тем же
+    выражением, что и индекс, чтобы планировщик мог его использовать.
+    """
+    filters = parse_spec_filters(params)
+    if not filters:
+        return queryset
+    usage_tracker.record(key for key, _, _ in filters)
+
+    promoted = promoted_keys()
+    for n, (key, operator, values) in enumerate(filters):
+        alias = f'_spec_{n}'
+        value_type = promoted.get(key)
+        if operator in RANGE_OPERATORS:
+            queryset = queryset.alias(**{alias: SpecNumeric(key)}).filter(**{f'{alias}__{operator}': values[0]})
+        elif value_type == SpecKeyUsage.ValueType.TEXT:
+            queryset = queryset.alias(**{alias: spec_text(key)}).filter(**{f'{alias}__in': values})
+        elif value_type == SpecKeyUsage.ValueType.NUMERIC and all(_number(value) is not None for value in values):
+            queryset = queryset.alias(**{alias: SpecNumeric(key)}).filter(
+                **{f'{alias}__in': [_number(value) for value in values]}
+            )
+        else:
+            condition = Q()
+            for value in values:
+                for json_value in _json_values(value):
+                    condition |= Q(specifications__contains={key: json_value})
+            queryset = queryset.filter(condition)
+    return queryset
+
+
+# ── статистика ключей ──────────────────────
+
+class SpecUsageTracker:
+    """
+    Счётчики ключей фильтров в памяти процесса. В SpecKeyUsage сбрасываются одним
+    upsert не чаще раза в SPEC_USAGE_FLUSH_INTERVAL секунд — не пишем в БД на каждый запрос.
+    """
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def record(self, keys):
+        with self._lock:
+            self._counts.update(keys)
+            due = time.monotonic() - self._flushed_at >= settings.SPEC_USAGE_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed_at = time.monotonic()
+        if not counts:
+            return
+        keys = sorted(counts)  # одинаковый порядок блокировок строк в параллельных процессах
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {SpecKeyUsage._meta.db_table} "
+                    f"(key, filter_count, last_used_at, value_type, index_name) "
+                    f"SELECT key, count, %s, '', '' FROM unnest(%s::text[], %s::bigint[]) AS t(key, count) "
+                    f"ON CONFLICT (key) DO UPDATE SET "
+                    f"filter_count = {SpecKeyUsage._meta.db_table}.filter_count + EXCLUDED.filter_count, "
+                    f"last_used_at = EXCLUDED.last_used_at",
+                    [timezone.now(), keys, [counts[key] for key in keys]],
+                )
+        except DatabaseError:
+            # статистика не должна ломать выдачу товаров
+            logger.exception("Не удалось сохранить статистику ключей характеристик")
+
+
+usage_tracker = SpecUsageTracker()
+
+
+# ── индексы для частых ключей ──────────────
+
+def index_name(key, value_type):
+    digest = hashlib.md5(key.encode()).hexdigest()[:12]
+    suffix = 'num' if value_type == SpecKeyUsage.ValueType.NUMERIC else 'txt'
+    return f'product_spec_{digest}_{suffix}_idx'
+
+
+def _literal(key):
+    return "'" + key.replace("'", "''") + "'"
+
+
+def index_expression(key, value_type):
+    if value_type == SpecKeyUsage.ValueType.NUMERIC:
+        return f"core_spec_numeric(specifications -> {_literal(key)})"
+    return f"(specifications ->> {_literal(key)})"
+
+
+def detect_value_type(key, sample_size=10_000):
+    """numeric, если почти все значения ключа в выборке — числа, иначе text. None — ключа нет ни у одного товара."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*), count(core_spec_numeric(value)) FROM ("
+            f"SELECT specifications -> %s AS value FROM {Product._meta.db_table} "
+            f"WHERE specifications ? %s LIMIT %s) AS sample",
+            [key, key, sample_size],
+        )
+        total, numeric = cursor.fetchone()
+    if not total:
+        return None
+    return SpecKeyUsage.ValueType.NUMERIC if numeric >= total * 0.9 else SpecKeyUsage.ValueType.TEXT
+
+
+def create_spec_index(key, value_type):
+    """
+    btree (store_id, выражение) CONCURRENTLY — без блокировки записи. Вызывается вне транзакции.
+    Недостроенный после сбоя (INVALID) индекс пересоздаётся.
+    """
+    name = index_name(key, value_type)
+    table = Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+            [name],
+        )
+        row = cursor.fetchone()
+        if row is not None and not row[0]:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+            f"(store_id, {index_expression(key, value_type)})"
+        )
+        # Статистика по выражению индекса появляется только после ANALYZE — без неё планировщик
+        # считает любое сравнение по ключу неселективным и индекс не выбирает
+        cursor.execute(f"ANALYZE {table}")
+    previous = SpecKeyUsage.objects.filter(key=key).values_list('index_name', flat=True).first()
+    SpecKeyUsage.objects.update_or_create(key=key, defaults={
+        'value_type': value_type, 'index_name': name, 'promoted_at': timezone.now(),
+    })
+    _promoted_cache.clear()
+    if previous and previous != name:
+        # ключ переиндексирован с другим типом — старый индекс больше не используется
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {previous}")
+    return name
+
+
+def drop_spec_index(key):
+    usage = SpecKeyUsage.objects.filter(key=key).exclude(index_name='').first()
+    if usage is None:
+        return None
+    # Сначала перестаём строить запросы под индекс, затем удаляем его
+    SpecKeyUsage.objects.filter(pk=usage.pk).update(value_type='', index_name='', promoted_at=None)
+    _promoted_cache.clear()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {usage.index_name}")
+    return usage.index_name
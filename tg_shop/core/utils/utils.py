@@ -1,6 +1,63 @@
+import copy
+
+from django.conf import settings
+
+from .cache import TTLCache
+
+# ('store', store_id) / ('owner', user_id) → Store (или None). Принадлежность к магазину
+# (role, store_id) берётся из пользователя запроса, который аутентификация читает из БД, —
+# поэтому снятый с магазина менеджер теряет доступ сразу во всех процессах. Кэшируется
+# только сам магазин: его изменение сбрасывает кэш своего процесса (core/signals.py),
+# остальных — не позже чем через STORE_CACHE_TTL секунд.
+store_cache = TTLCache(maxsize=settings.STORE_CACHE_SIZE, ttl=settings.STORE_CACHE_TTL)
+
+
+def _store_cache_key(user):
+    if user.is_manager():
+        return ('store', user.store_id) if user.store_id else None
+    elif user.is_owner():
+        return 'owner', user.pk
+    return None
+
+
+def _load_store(key):
+    from core.models import Store
+
+    kind, value = key
+    if kind == 'store':
+        return Store.objects.filter(pk=value).first()
+    return Store.objects.filter(owner_id=value).first()
+
+
 def get_store_for_user(user):
-    if user.is_manager() and user.store:
-        return user.store
-    elif user.is_owner() and hasattr(user, 'owned_store') and user.owned_store:
-        return user.owned_store
-    return None
\ No newline at end of file
+    """
+    Магазин пользователя: для менеджера — тот, к которому он привязан,
+    для владельца — его собственный. Магазин кэшируется в процессе; каждый вызов
+    получает свою копию, чтобы потоки не делили один экземпляр модели.
+    """
+    if not user or not user.is_authenticated or not hasattr(user, 'role'):
+        return None
+    key = _store_cache_key(user)
+    if key is None:
+        return None
+    store = store_cache.get_or_set(key, lambda: _load_store(key))
+    return copy.copy(store) if store is not None else None
+
+
+def get_request_store(request):
+    """
+    get_store_for_user, запомненный на время запроса: повторные вызовы из
+    get_queryset / get_serializer_context / permissions не идут даже в кэш.
+    """
+    # DRF Request оборачивает HttpRequest — храним на исходном, он общий для всего стека
+    http_request = getattr(request, '_request', request)
+    if not hasattr(http_request, '_resolved_store'):
+        http_request._resolved_store = get_store_for_user(request.user)
+    return http_request._resolved_store
+
+
+def invalidate_store_cache(user_id=None):
+    if user_id is None:
+        store_cache.clear()
+    else:
+        store_cache.delete(('owner', user_id))
@@ -1,24 +1,69 @@
+from collections import Counter
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Min, Max, Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework import status
 from drf_yasg import openapi
-from .permissions import IsOwnerOrManager, IsAuthenticatedOrAPISecret
+from .pagination import INVALID_CURSOR_MESSAGE, encode_cursor, decode_cursor
+from .parsers import NDJSONParser
+from .metrics import registry, timed
+from .permissions import IsOwnerOrManager, IsAuthenticatedOrAPISecret, IsStaffOrMetricsToken
 from .serializers import RegisterUserSerializer, MarketplaceTokenSerializer, ProductSerializer, \
     QuestionAnswerSerializer, ProductQuestionSerializer, ProductQuestionMessageSerializer, \
-    QuestionWithMessagesSerializer
+    QuestionWithMessagesSerializer, ProductImageSerializer, ImageUploadRequestSerializer, ImageConfirmSerializer, \
+    StoreAPIKeySerializer
 
 from rest_framework import generics, permissions
 from .serializers import ManagerInviteSerializer
 from .models import Store, CustomUser, ManagerInviteToken, MarketplaceIntegrationToken, ProductImage, Product, \
-    QuestionAnswer, ProductQuestion, ProductQuestionMessage, Marketplace
+    QuestionAnswer, ProductQuestion, ProductQuestionMessage, Marketplace, StoreAPIKey
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied, NotFound
-
-from .utils.utils import get_store_for_user
+from rest_framework.exceptions import PermissionDenied, NotFound, NotAuthenticated
+
+from .ai.context import invalidate_product_context
+from .authentication import is_api_secret, request_store_key
+from .db import check_database, render_pool_metrics
+from .sync.outbox import render_delivery_metrics
+from .throttling import StoreRateThrottle, astore_of, render_throttle_metrics, store_of
+from .ai.similarity import suggest_answer
+from .images.s3 import head_many, is_s3_storage, presigned_put
+from .images.storage import original_key, parse_original_key
+from .realtime.stream import MessageStream, stream_user
+from .utils.aio import AsyncAPIView, json_response, request_data
+from .utils.catalog import FORMATS as CATALOG_FORMATS, detect_format, export_lines, import_catalog, iter_catalog
+from .utils.ingestion import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyKeys, external_username, ingest_questions
+from .utils.search import SEARCH_TYPES, search
+from .utils.specs import filter_by_specs
+from .utils.utils import get_request_store, get_store_for_user
+
+
+def get_owned_store(request, store_id):
+    """
+    Магазин из URL, если текущий пользователь — его владелец: 404 — магазина нет,
+    403 — он чужой. Свой магазин берётся из кэша пользователя без запроса к БД.
+    """
+    store = get_request_store(request)
+    if store is None or str(store.pk) != str(store_id):
+        store = Store.objects.filter(pk=store_id).first()
+        if store is None:
+            raise NotFound('Магазин не найден')
+    if store.owner_id != request.user.pk:
+        raise PermissionDenied('Вы не владелец этого магазина')
+    return store
 
 
 class RegisterUserView(APIView):
@@ -44,13 +89,7 @@ class InviteManagerView(generics.CreateAPIView):
         return super().dispatch(request, *args, **kwargs)
 
     def get_store(self):
-        try:
-            store = Store.objects.get(id=self.store_id)
-        except Store.DoesNotExist:
-            raise NotFound('Магазин не найден')
-        if store.owner != self.request.user:
-            raise PermissionDenied('Вы не владелец этого магазина')
-        return store
+        return get_owned_store(self.request, self.store_id)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -58,7 +97,7 @@ class InviteManagerView(generics.CreateAPIView):
         return context
 
 
-from rest_framework import viewsets, permissions
+from rest_framework import mixins, viewsets, permissions
 from .serializers import ManagerSerializer
 from .models import CustomUser, Store
 from rest_framework.exceptions import PermissionDenied
@@ -67,6 +106,7 @@ from rest_framework.exceptions import PermissionDenied
 class ManagerViewSet(viewsets.ModelViewSet):
     serializer_class = ManagerSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('id',)
 
     def get_queryset(self):
         if self.request.user.role != 'owner':
@@ -76,8 +116,7 @@ class ManagerViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         if self.request.user.role != 'owner':
             raise PermissionDenied("Только владелец может создавать менеджеров.")
-        store = Store.objects.filter(owner=self.request.user).first()
-        serializer.save(role='manager', store=store)
+        serializer.save(role='manager', store=get_request_store(self.request))
 
     def perform_update(self, serializer):
         if self.request.user.role != 'owner':
@@ -108,14 +147,7 @@ class GenerateInviteLinkView(APIView):
         responses={200: openapi.Response(description="Инвайт-ссылка создана")}
     )
     def post(self, request, store_id):
-        try:
-            store = Store.objects.get(id=store_id)
-        except Store.DoesNotExist:
-            return Response({"error": "Store not found"}, status=404)
-
-        if store.owner != request.user:
-            raise PermissionDenied("Вы не владелец магазина")
-
+        store = get_owned_store(request, store_id)
         token = ManagerInviteToken.objects.create(store=store)
         link = f"http://localhost:8000/api/invite/{token.token}/"
         return Response({"invite_link": link})
@@ -226,19 +258,14 @@ class MarketplaceTokenViewSet(viewsets.ModelViewSet):
     serializer_class = MarketplaceTokenSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'service_name'
+    pagination_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
-        store_id = self.kwargs['store_id']
-        store = Store.objects.get(pk=store_id)
-        if store.owner != self.request.user:
-            raise PermissionDenied('Вы не владелец этого магазина')
+        store = get_owned_store(self.request, self.kwargs['store_id'])
         return MarketplaceIntegrationToken.objects.filter(store=store)
 
     def perform_create(self, serializer):
-        store_id = self.kwargs['store_id']
-        store = Store.objects.get(pk=store_id)
-        if store.owner != self.request.user:
-            raise PermissionDenied('Вы не владелец этого магазина')
+        store = get_owned_store(self.request, self.kwargs['store_id'])
         try:
             serializer.save(store=store)
         except IntegrityError:
@@ -247,52 +274,173 @@ class MarketplaceTokenViewSet(viewsets.ModelViewSet):
             })
 
 
+class StoreAPIKeyViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.DestroyModelMixin,
+                         viewsets.GenericViewSet):
+    """
+    API-ключи интеграций магазина (X-API-KEY). Ключ возвращается один раз — в ответе на создание.
+    Удаление отзывает ключ: запись остаётся, ключ перестаёт действовать в течение API_KEY_CACHE_TTL.
+    """
+    serializer_class = StoreAPIKeySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        store = get_owned_store(self.request, self.kwargs['store_id'])
+        return StoreAPIKey.objects.filter(store=store)
+
+    def perform_create(self, serializer):
+        store = get_owned_store(self.request, self.kwargs['store_id'])
+        serializer.save(store=store, created_by=self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.revoke()
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrManager]
     parser_classes = [MultiPartParser, FormParser]
 
     def get_store(self):
-        user = self.request.user
-
-        if not user.is_authenticated:
+        if not self.request.user.is_authenticated:
             raise PermissionDenied("Необходима авторизация")
 
-        if hasattr(user, 'role'):
-            if user.role == 'owner':
-                return Store.objects.filter(owner=user).first()
-            elif user.role == 'manager':
-                return user.store
-
-        raise PermissionDenied("Вы не привязаны к магазину.")
-
-        if user.role == 'owner':
-            store = Store.objects.filter(owner=user).first()
-        elif user.role == 'manager':
-            store = user.store
-        else:
-            store = None
-
+        store = get_request_store(self.request)
         if not store:
             raise PermissionDenied("Вы не привязаны к магазину.")
         return store
 
     def get_queryset(self):
-        return Product.objects.filter(store=self.get_store())
+        queryset = Product.objects.filter(store=self.get_store()).prefetch_related('marketplaces', 'images')
+        if self.action == 'list':
+            queryset = filter_by_specs(queryset, self.request.query_params)
+        return queryset
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['store'] = self.get_store()
         return context
 
+    @swagger_auto_schema(
+        method='post',
+        operation_description="Потоковый импорт каталога из CSV или JSONL: тело запроса (text/csv, "
+                              "application/x-ndjson) или файл в поле file. Товары обновляются по артикулу (sku), "
+                              "фото из колонки images скачиваются в фоне",
+        responses={200: openapi.Response(description="Статистика импорта"), 400: "Неподдерживаемый формат"}
+    )
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_catalog(self, request):
+        store = self.get_store()
+        if request.content_type.startswith('multipart/'):
+            stream = request.FILES.get('file')
+            if stream is None:
+                return Response({"error": "Файл не передан (поле file)"}, status=400)
+            file_format = detect_format(stream.content_type, stream.name)
+        else:
+            # Тело читается потоком, DRF-парсеры его не буферизуют
+            stream = request.stream
+            file_format = detect_format(request.content_type)
 
-from rest_framework.decorators import action
+        if file_format is None:
+            return Response({"error": "Поддерживаются CSV и JSONL"}, status=400)
+        if stream is None:
+            return Response({"error": "Пустой запрос"}, status=400)
+        return Response(import_catalog(store, stream, file_format, user=request.user))
+
+    @swagger_auto_schema(
+        method='get',
+        operation_description="Потоковая выгрузка каталога магазина",
+        manual_parameters=[
+            openapi.Parameter('type', openapi.IN_QUERY, description="Формат: jsonl (по умолчанию) или csv",
+                              type=openapi.TYPE_STRING, enum=list(CATALOG_FORMATS)),
+        ],
+        responses={200: openapi.Response(description="Файл каталога")}
+    )
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_catalog(self, request):
+        store = self.get_store()
+        file_format = request.query_params.get('type', 'jsonl')
+        if file_format not in CATALOG_FORMATS:
+            return Response({"error": "Поддерживаются csv и jsonl"}, status=400)
+
+        content_type = 'text/csv; charset=utf-8' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(export_lines(iter_catalog(store), file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="catalog-{store.pk}.{file_format}"'
+        return response
+
+    @swagger_auto_schema(
+        method='post',
+        operation_description="Подписанные PUT-ссылки для загрузки фото напрямую в хранилище. "
+                              "Файлы, которые уже есть в хранилище, помечены exists=true и не загружаются",
+        request_body=ImageUploadRequestSerializer(many=True),
+        responses={200: openapi.Response(description="Ключи и ссылки для загрузки"), 400: "Ошибка запроса"}
+    )
+    @action(detail=False, methods=['post'], url_path='images/presign', parser_classes=[JSONParser])
+    def presign_images(self, request):
+        self.get_store()
+        if not is_s3_storage():
+            return Response({"error": "Прямая загрузка доступна только с S3-хранилищем"}, status=400)
+
+        serializer = ImageUploadRequestSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        files = serializer.validated_data
+        keys = [original_key(item['sha256'], item['name']) for item in files]
+
+        result = []
+        for item, key, existing in zip(files, keys, head_many(keys)):
+            entry = {'key': key, 'exists': existing is not None}
+            if existing is None:
+                entry['upload'] = presigned_put(key, item['content_type'], item['size'], item['sha256'])
+            result.append(entry)
+        return Response(result)
+
+    @swagger_auto_schema(
+        method='post',
+        operation_description="Привязать к товару фото, загруженные по ссылкам из images/presign",
+        request_body=ImageConfirmSerializer(many=True),
+        responses={201: ProductImageSerializer(many=True), 400: "Файлы не загружены"}
+    )
+    @action(detail=True, methods=['post'], url_path='images/confirm', parser_classes=[JSONParser])
+    def confirm_images(self, request, pk=None):
+        product = self.get_object()
+        serializer = ImageConfirmSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
+
+        keys = [item['key'] for item in items]
+        missing = [key for key, existing in zip(keys, head_many(keys)) if existing is None]
+        if missing:
+            return Response({"error": "Файлы не загружены", "missing": missing}, status=400)
+
+        images = ProductImage.objects.bulk_create([
+            ProductImage(
+                product=product, image=item['key'], caption=item['caption'],
+                content_hash=parse_original_key(item['key']),
+            )
+            for item in items
+        ])
+        invalidate_product_context(product.pk)
+        return Response(ProductImageSerializer(images, many=True).data, status=201)
+
+    @swagger_auto_schema(
+        operation_description="Товары магазина. Фильтры по характеристикам (specifications): "
+                              "spec.<ключ>=значение, spec.<ключ>__in=a,b, spec.<ключ>__lt|lte|gt|gte=число",
+        manual_parameters=[
+            openapi.Parameter('spec.color', openapi.IN_QUERY, description="Пример: товары с color=black",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('spec.weight__lt', openapi.IN_QUERY, description="Пример: weight меньше числа",
+                              type=openapi.TYPE_NUMBER),
+        ],
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 
 class QuestionAnswerViewSet(viewsets.ModelViewSet):
     queryset = QuestionAnswer.objects.all()
     serializer_class = QuestionAnswerSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-sent_at', '-id')
 
     def get_queryset(self):
         user = self.request.user
@@ -314,13 +462,15 @@ class QuestionAnswerViewSet(viewsets.ModelViewSet):
 
         questions = ProductQuestion.objects.filter(user=user).values_list('id', flat=True)
         answers = QuestionAnswer.objects.filter(question_id__in=questions)
-        serializer = self.get_serializer(answers, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(answers)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 class ProductQuestionViewSet(viewsets.ModelViewSet):
     serializer_class = ProductQuestionSerializer
     queryset = ProductQuestion.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         user = self.request.user
@@ -330,25 +480,113 @@ class ProductQuestionViewSet(viewsets.ModelViewSet):
             return ProductQuestion.objects.all()
         return ProductQuestion.objects.none()
 
+    @swagger_auto_schema(
+        method='get',
+        operation_description="Готовый ответ на похожий ранее отвеченный вопрос магазина",
+        responses={200: openapi.Response(description="Предложенный ответ"), 404: "Похожих вопросов нет"}
+    )
+    @action(detail=True, methods=['get'], url_path='suggested-answer')
+    def suggested_answer(self, request, pk=None):
+        if request.user.role not in ['manager', 'owner']:
+            raise PermissionDenied("Только сотрудники магазина могут получать подсказки")
+        question = self.get_object()
+        store = get_request_store(request)
+        if store is None or question.product.store_id != store.pk:
+            raise NotFound("Вопрос не найден")
+
+        suggestion = suggest_answer(store.pk, question.text, exclude_question_id=question.pk)
+        if suggestion is None:
+            return Response({"error": "Похожих вопросов не найдено"}, status=404)
+        return Response(suggestion)
+
 
 
 class ProductQuestionMessageViewSet(viewsets.ModelViewSet):
     serializer_class = ProductQuestionMessageSerializer
     queryset = ProductQuestionMessage.objects.all()
     permission_classes = [IsAuthenticatedOrAPISecret]  # ✅ Только один permission
+    throttle_classes = [StoreRateThrottle]
+    throttle_scope = 'messages'
+    pagination_ordering = ('sent_at', 'id')
+
+    def get_throttle_store(self, request):
+        return store_of(ProductQuestion, request.data.get('question')) if request.method == 'POST' else None
 
     def get_queryset(self):
         user = self.request.user
         if user.is_authenticated and user.role in ['manager', 'owner']:
             return ProductQuestionMessage.objects.all()
+        store_key = request_store_key(self.request)
+        if store_key is not None:
+            return ProductQuestionMessage.objects.filter(store_id=store_key.store_id)
         return ProductQuestionMessage.objects.none()
 
 
+def idempotency_keys(request, data, store_id):
+    """
+    Ключи идемпотентности одиночной загрузки к товару магазина store_id;
+    None — заголовок Idempotency-Key слишком длинный.
+    """
+    header = request.headers.get('Idempotency-Key')
+    if header and len(header) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None
+    # Ключи разных клиентов не пересекаются; ключи одного магазина (X-API-KEY) — общие,
+    # все клиенты с X-API-SECRET — один клиент
+    store_key = request_store_key(request)
+    if request.user.is_authenticated:
+        scope = f"user{request.user.pk}"
+    else:
+        scope = f"store{store_key.store_id}" if store_key else 'api'
+    return IdempotencyKeys(data.get('marketplace'), data.get('question_id'), header, scope, store_id)
+
+
+def product_store(request, store_id):
+    """store_id товара, если клиенту можно загружать к нему вопросы, иначе None."""
+    store_key = request_store_key(request)
+    if store_id is None or (store_key is not None and store_id != store_key.store_id):
+        return None
+    return store_id
+
+
+def request_products(request):
+    """Товары, к которым клиент может загружать вопросы: для ключа магазина — только его."""
+    store_key = request_store_key(request)
+    if store_key is not None:
+        return Product.objects.filter(store_id=store_key.store_id)
+    return Product.objects.all()
+
+
+CONFLICT = {'error': 'question_id belongs to a question of another store'}
+
+
+def replayed(question_id):
+    """(тело, статус, заголовки) ответа на повтор загрузки."""
+    return (
+        {'message': 'Question already submitted', 'question_id': question_id},
+        200,
+        {'Idempotent-Replayed': 'true'},
+    )
+
+
 class ExternalQuestionCreateView(APIView):
     permission_classes = [IsAuthenticatedOrAPISecret]  # публично, но по ключу
+    throttle_classes = [StoreRateThrottle]
+    throttle_scope = 'external-questions'
+
+    def get_throttle_store(self, request):
+        return store_of(Product, request.data.get('product'))
 
     @swagger_auto_schema(
-        operation_description="Публичный API для создания вопроса о товаре, используется API-ключ (например, X-API-KEY)",
+        operation_description="Публичный API для создания вопроса о товаре. Доступ: X-API-KEY магазина "
+                              "(вопросы только к его товарам), JWT или общий X-API-SECRET. "
+                              "Повтор с тем же Idempotency-Key или question_id маркетплейса не создаёт дубль — "
+                              "возвращается 200 с id ранее созданного вопроса.",
+        manual_parameters=[
+            openapi.Parameter('X-API-KEY', openapi.IN_HEADER, type=openapi.TYPE_STRING,
+                              description="API-ключ магазина"),
+            openapi.Parameter('Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING,
+                              description=f"Ключ повтора запроса, до {IDEMPOTENCY_KEY_MAX_LENGTH} символов"),
+        ],
         request_body=openapi.Schema(
             type=openapi.TYPE_OBJECT,
             required=['external_id', 'product', 'text'],
@@ -357,9 +595,14 @@ class ExternalQuestionCreateView(APIView):
                 'product': openapi.Schema(type=openapi.TYPE_INTEGER),
                 'text': openapi.Schema(type=openapi.TYPE_STRING),
                 'marketplace': openapi.Schema(type=openapi.TYPE_STRING, enum=['ozon', 'wildberries', 'yandex_market']),
+                'question_id': openapi.Schema(type=openapi.TYPE_STRING,
+                                              description="ID вопроса на маркетплейсе (ключ идемпотентности)"),
             },
         ),
-        responses={201: openapi.Response(description="Вопрос создан"), 400: "Ошибка запроса"},
+        responses={201: openapi.Response(description="Вопрос создан"),
+                   200: openapi.Response(description="Повтор: вопрос уже был создан"), 400: "Ошибка запроса",
+                   404: "Товар не найден", 409: "question_id занят вопросом другого магазина",
+                   429: "Превышен лимит запросов (заголовок Retry-After)"},
     )
     def post(self, request):
 
@@ -371,29 +614,177 @@ class ExternalQuestionCreateView(APIView):
         if not all([external_id, product_id, text]):
             return Response({'error': 'Missing required fields'}, status=400)
 
+        # повтор ищется только среди вопросов магазина товара
+        store_id = product_store(request, store_of(Product, product_id))
+        keys = idempotency_keys(request, request.data, store_id)
+        if keys is None:
+            return Response({'error': 'Idempotency-Key is too long'}, status=400)
+        if store_id is None:
+            return Response({'error': 'Product not found'}, status=404)
+        if keys:
+            duplicate = keys.lookup()
+            if duplicate is not None:
+                body, status_code, headers = replayed(duplicate)
+                return Response(body, status=status_code, headers=headers)
+
         user, _ = CustomUser.objects.get_or_create(
             external_id=external_id,
             defaults={
-                'username': f"user_{external_id[:12]}",
+                'username': external_username(external_id),
                 'role': 'user'
             }
         )
 
         try:
-            product = Product.objects.get(id=product_id)
+            product = request_products(request).get(id=product_id)
         except Product.DoesNotExist:
             return Response({'error': 'Product not found'}, status=404)
 
         marketplace = Marketplace.objects.filter(name=marketplace_name).first()
 
-        question = ProductQuestion.objects.create(
-            product=product,
-            user=user,
-            text=text,
-            marketplace=marketplace
+        if keys:
+            question_id = keys.insert(keys.build(product=product, user=user, text=text, marketplace=marketplace))
+            if question_id is None:
+                return Response(CONFLICT, status=409)
+        else:
+            question_id = ProductQuestion.objects.create(
+                product=product,
+                user=user,
+                text=text,
+                marketplace=marketplace
+            ).id
+
+        return Response({'message': 'Question submitted', 'question_id': question_id}, status=201)
+
+
+class AsyncExternalQuestionCreateView(AsyncAPIView):
+    """
+    ExternalQuestionCreateView на async ORM — для ASGI (ASYNC_VIEWS=1): пока ждём БД,
+    поток воркера не занят. Контракт тот же.
+    """
+    throttle_classes = [StoreRateThrottle]
+    throttle_scope = 'external-questions'
+
+    def get_throttle_store(self, request):
+        return store_of(Product, request_data(request).get('product'))
+
+    async def post(self, request):
+        if not (request.user.is_authenticated or request_store_key(request) or
+                is_api_secret(request.headers.get('X-API-SECRET'))):
+            raise NotAuthenticated()
+
+        data = request_data(request)
+        external_id = data.get('external_id')
+        product_id = data.get('product')
+        text = data.get('text')
+        marketplace_name = data.get('marketplace')
+
+        if not all([external_id, product_id, text]):
+            return json_response({'error': 'Missing required fields'}, status=400)
+
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return json_response({'error': 'Invalid product id'}, status=400)
+
+        store_id = product_store(request, await astore_of(Product, product_id))
+        keys = idempotency_keys(request, data, store_id)
+        if keys is None:
+            return json_response({'error': 'Idempotency-Key is too long'}, status=400)
+        if store_id is None:
+            return json_response({'error': 'Product not found'}, status=404)
+        if keys:
+            duplicate = await keys.alookup()
+            if duplicate is not None:
+                body, status_code, headers = replayed(duplicate)
+                response = json_response(body, status=status_code)
+                for name, value in headers.items():
+                    response[name] = value
+                return response
+
+        if not await request_products(request).filter(id=product_id).aexists():
+            return json_response({'error': 'Product not found'}, status=404)
+
+        user, _ = await CustomUser.objects.aget_or_create(
+            external_id=external_id,
+            defaults={
+                'username': external_username(external_id),
+                'role': 'user'
+            }
         )
+        marketplace = await Marketplace.objects.filter(name=marketplace_name).afirst() if marketplace_name else None
+
+        if keys:
+            question_id = await keys.ainsert(
+                keys.build(product_id=product_id, user=user, text=text, marketplace=marketplace)
+            )
+            if question_id is None:
+                return json_response(CONFLICT, status=409)
+        else:
+            question_id = (await ProductQuestion.objects.acreate(
+                product_id=product_id,
+                user=user,
+                text=text,
+                marketplace=marketplace
+            )).id
+        return json_response({'message': 'Question submitted', 'question_id': question_id}, status=201)
+
+
+class ExternalQuestionBatchCreateView(APIView):
+    permission_classes = [IsAuthenticatedOrAPISecret]
+    # с X-API-SECRET пакет может содержать вопросы разных магазинов — лимит на клиента
+    throttle_classes = [StoreRateThrottle]
+    throttle_scope = 'external-questions-batch'
+    parser_classes = [JSONParser, NDJSONParser]
 
-        return Response({'message': 'Question submitted', 'question_id': question.id}, status=201)
+    @swagger_auto_schema(
+        operation_description="Пакетная загрузка вопросов (JSON-массив или NDJSON). "
+                              "Повтор с тем же question_id маркетплейса не создаёт дубль.",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                required=['external_id', 'product', 'text'],
+                properties={
+                    'external_id': openapi.Schema(type=openapi.TYPE_STRING),
+                    'product': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'text': openapi.Schema(type=openapi.TYPE_STRING),
+                    'marketplace': openapi.Schema(type=openapi.TYPE_STRING, enum=['ozon', 'wildberries', 'yandex_market']),
+                    'question_id': openapi.Schema(type=openapi.TYPE_STRING,
+                                                  description="ID вопроса на маркетплейсе (ключ идемпотентности)"),
+                },
+            ),
+        ),
+        responses={200: openapi.Response(description="Результат по каждому элементу"), 400: "Ошибка запроса",
+                   429: "Превышен лимит запросов (заголовок Retry-After)"},
+    )
+    def post(self, request):
+        items = request.data
+        if isinstance(items, dict):
+            return Response({'error': 'Expected a list of questions'}, status=400)
+
+        # с ключом магазина — только товары этого магазина
+        store_key = request_store_key(request)
+        store_id = store_key.store_id if store_key else None
+        batch_size = settings.EXTERNAL_QUESTIONS_BATCH_SIZE
+        results = []
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, batch_size))
+            if not chunk:
+                break
+            offset = len(results)
+            for result in ingest_questions(chunk, store_id=store_id):
+                result['index'] += offset
+                results.append(result)
+
+        summary = Counter(result['status'] for result in results)
+        return Response({
+            'created': summary['created'],
+            'duplicates': summary['duplicate'],
+            'errors': summary['error'],
+            'results': results,
+        })
 
 
 class UserConversationView(APIView):
@@ -417,55 +808,241 @@ class UserConversationView(APIView):
         except CustomUser.DoesNotExist:
             return Response({"error": "user not found"}, status=404)
 
-        questions = ProductQuestion.objects.filter(user=user).order_by("-created_at")
+        questions = QuestionWithMessagesSerializer.setup_eager_loading(
+            ProductQuestion.objects.filter(user=user).order_by("-created_at")
+        )
         data = QuestionWithMessagesSerializer(questions, many=True).data
         return Response(data)
 
+class AsyncUserConversationView(AsyncAPIView):
+    """UserConversationView на async ORM — для ASGI (ASYNC_VIEWS=1). Контракт тот же."""
+
+    async def get(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        external_id = request.GET.get("external_id")
+        if not external_id:
+            return json_response({"error": "external_id is required"}, status=400)
+
+        user_id = await CustomUser.objects.filter(external_id=external_id).values_list('id', flat=True).afirst()
+        if user_id is None:
+            return json_response({"error": "user not found"}, status=404)
+
+        # prefetch выполняется при async-итерации, сериализация БД уже не трогает
+        questions = [
+            question async for question in QuestionWithMessagesSerializer.setup_eager_loading(
+                ProductQuestion.objects.filter(user_id=user_id).order_by("-created_at")
+            )
+        ]
+        return json_response(QuestionWithMessagesSerializer(questions, many=True).data)
+
+
 class ShopUserListView(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
-        operation_description="Список пользователей, задававших вопросы по товарам магазина",
+        operation_description="Список пользователей, задававших вопросы по товарам магазина. "
+                              "Отсортирован по первому сообщению; следующая страница — в заголовке Link.",
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Курсор следующей страницы",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Размер страницы",
+                              type=openapi.TYPE_INTEGER),
+        ],
         responses={200: openapi.Response(description="Список пользователей")}
     )
     def get(self, request):
-        store = get_store_for_user(request.user)
+        store = get_request_store(request)
+        if not store:
+            return Response({"error": "Магазин не найден у пользователя"}, status=403)
+
+        try:
+            limit = int(request.query_params.get('limit', settings.SHOP_USERS_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=400)
+        limit = max(1, min(limit, settings.SHOP_USERS_PAGE_SIZE))
+
+        # Первое/последнее сообщение по каждому пользователю — одним GROUP BY в БД.
+        # Курсор сравнивается с агрегатом (HAVING), поэтому каждая страница заново группирует
+        # все сообщения магазина: без OFFSET и со стабильным порядком, но O(сообщений магазина),
+        # а не O(страницы). Фильтр по копии store_id (message_store_idx) обходится без JOIN товара
+        rows = (
+            ProductQuestionMessage.objects
+            .filter(store=store, question__user__isnull=False)
+            .values('question__user_id', 'question__user__external_id')
+            .annotate(first_message=Min('sent_at'), last_message=Max('sent_at'))
+            .order_by('first_message', 'question__user_id')
+        )
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            first_message, user_id = decode_cursor(cursor, 2)
+            try:
+                first_message = ProductQuestionMessage._meta.get_field('sent_at').to_python(first_message)
+                user_id = CustomUser._meta.pk.to_python(user_id)
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+            if first_message is None or user_id is None:
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+            rows = rows.filter(
+                Q(first_message__gt=first_message) |
+                Q(first_message=first_message, question__user_id__gt=user_id)
+            )
+
+        page = list(rows[:limit + 1])
+        has_next = len(page) > limit
+        page = page[:limit]
+
+        with timed('serializer'):
+            users = [
+                {
+                    "external_id": row['question__user__external_id'] or f"user_{row['question__user_id']}",
+                    "first_message": row['first_message'],
+                    "last_message": row['last_message'],
+                }
+                for row in page
+            ]
+        response = Response(users)
+        if has_next:
+            last = page[-1]
+            next_cursor = encode_cursor([last['first_message'], last['question__user_id']])
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+            response['Link'] = f'<{next_url}>; rel="next"'
+        return response
+
+
+class SearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Полнотекстовый поиск по товарам, вопросам и сообщениям магазина "
+                              "(русский и английский, websearch-синтаксис). Товары находятся и по похожему "
+                              "названию (опечатки). Результаты отсортированы по релевантности, "
+                              "совпадения в headline выделены <mark>.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Поисковый запрос",
+                              type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('type', openapi.IN_QUERY, description="Где искать, через запятую: "
+                              "products, questions, messages (по умолчанию везде)",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Результатов каждого типа",
+                              type=openapi.TYPE_INTEGER),
+        ],
+        responses={200: openapi.Response(description="Результаты по типам"), 400: "Ошибка запроса"}
+    )
+    def get(self, request):
+        if request.user.role not in ['manager', 'owner']:
+            raise PermissionDenied("Поиск доступен только сотрудникам магазина")
+        store = get_request_store(request)
         if not store:
             return Response({"error": "Магазин не найден у пользователя"}, status=403)
 
-        # Все товары магазина
-        products = Product.objects.filter(shop=store)
-        if not products.exists():
-            return Response({"users": []})
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({"error": "q is required"}, status=400)
+        if len(text) > 200:
+            return Response({"error": "q is too long"}, status=400)
+
+        types = [item.strip() for item in request.query_params.get('type', '').split(',') if item.strip()]
+        unknown = set(types) - set(SEARCH_TYPES)
+        if unknown:
+            return Response({"error": f"Unknown type: {', '.join(sorted(unknown))}"}, status=400)
 
-        # Вопросы по товарам
-        questions = ProductQuestion.objects.filter(product__in=products).select_related("user").prefetch_related("messages")
+        try:
+            limit = int(request.query_params.get('limit', settings.SEARCH_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=400)
+        limit = max(1, min(limit, settings.SEARCH_MAX_PAGE_SIZE))
 
-        result = {}
+        return Response(search(store, text, types or SEARCH_TYPES, limit))
 
-        for question in questions:
-            user = question.user
-            if user is None:
-                continue
 
-            uid = user.external_id or f"user_{user.id}"
-            sent_at_list = list(question.messages.values_list("sent_at", flat=True))
-            if not sent_at_list:
-                continue
+class MessageStreamView(View):
+    """
+    Новые сообщения как Server-Sent Events вместо опроса /api/messages/ и /api/conversations/.
 
-            first = min(sent_at_list)
-            last = max(sent_at_list)
+    Сотрудник получает сообщения своего магазина, ?question=<id> — одну переписку; покупатель —
+    только свои переписки (question обязателен). Авторизация — сессия или JWT (заголовок
+    Authorization либо ?token=, EventSource не передаёт заголовки). После обрыва EventSource
+    присылает Last-Event-ID, пропущенные сообщения дочитываются из БД.
 
-            if uid not in result:
-                result[uid] = {
-                    "external_id": uid,
-                    "first_message": first,
-                    "last_message": last,
-                }
-            else:
-                result[uid]["first_message"] = min(result[uid]["first_message"], first)
-                result[uid]["last_message"] = max(result[uid]["last_message"], last)
+    Работает только под ASGI (uvicorn tg_shop.asgi:application): под WSGI бесконечный
+    асинхронный поток держал бы поток воркера.
+    """
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({"error": "Поток доступен только под ASGI"}, status=501)
+        user = await stream_user(request)
+        if user is None:
+            return JsonResponse({"error": "Требуется авторизация"}, status=401)
+
+        try:
+            question_id = int(request.GET['question']) if request.GET.get('question') else None
+            last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            return JsonResponse({"error": "question and Last-Event-ID must be integers"}, status=400)
+
+        if getattr(user, 'role', None) in ('manager', 'owner'):
+            store = await sync_to_async(get_store_for_user)(user)
+            if store is None:
+                return JsonResponse({"error": "Магазин не найден у пользователя"}, status=403)
+            store_id = store.pk
+            if question_id is not None and not await ProductQuestion.objects.filter(
+                    pk=question_id, store_id=store_id).aexists():
+                return JsonResponse({"error": "Вопрос не найден"}, status=404)
+        else:
+            if question_id is None:
+                return JsonResponse({"error": "question is required"}, status=400)
+            store_id = await ProductQuestion.objects.filter(
+                pk=question_id, user_id=user.pk).values_list('store_id', flat=True).afirst()
+            if store_id is None:
+                return JsonResponse({"error": "Вопрос не найден"}, status=404)
+
+        response = StreamingHttpResponse(
+            MessageStream(store_id, question_id, last_event_id), content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        # nginx не буферизует поток
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MetricsView(APIView):
+    permission_classes = [IsStaffOrMetricsToken]
+
+    @swagger_auto_schema(
+        operation_description="Метрики SQL и сериализации по эндпоинтам, пулов соединений и очереди "
+                              "отправки ответов, отказов по лимитам запросов в формате Prometheus. "
+                              "Доступ: staff или заголовок X-METRICS-TOKEN",
+        responses={200: openapi.Response(description="text/plain; version=0.0.4")}
+    )
+    def get(self, request):
+        return HttpResponse(registry.render() + render_pool_metrics() + render_delivery_metrics() +
+                            render_throttle_metrics(),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        sorted_users = sorted(result.values(), key=lambda x: x["first_message"])
-        return Response(sorted_users)
 
+class HealthView(APIView):
+    # для балансировщика и оркестратора — без авторизации, без подробностей ошибок
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    @swagger_auto_schema(
+        operation_description="Проверка соединений с БД (SELECT 1 в default и реплике), задержка и "
+                              "состояние пула. 503 — недоступна основная БД; недоступная реплика — degraded.",
+        responses={200: openapi.Response(description="ok / degraded"), 503: "Основная БД недоступна"}
+    )
+    def get(self, request):
+        databases = {alias: check_database(alias) for alias in settings.DATABASES}
+        if not databases['default']['ok']:
+            state = 'down'
+        elif all(result['ok'] for result in databases.values()):
+            state = 'ok'
+        else:
+            state = 'degraded'
+        return Response(
+            {'status': state, 'connection_mode': settings.DB_CONNECTION_MODE, 'databases': databases},
+            status=503 if state == 'down' else 200,
+        )
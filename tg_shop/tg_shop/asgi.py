@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+SSE-поток /api/stream/messages/ работает только под ASGI-сервером, например:
+uvicorn tg_shop.asgi:application --workers 4
 """
 
 import os
@@ -9,9 +9,12 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import json
 from datetime import timedelta
 from pathlib import Path
 import os
+
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -29,6 +32,8 @@ SECRET_KEY = 'django-insecure-cjb#$+r94m&quj0i_q0fcsrg%4k_=+q(6sjxik63$0@du%^flb
 DEBUG = True
 import os
 FERNET_KEY = os.getenv('FERNET_KEY')
+# Ротация ключей: FERNET_KEYS="новый,старый". Первый ключ шифрует, остальные только расшифровывают
+FERNET_KEYS = [key.strip() for key in os.getenv('FERNET_KEYS', '').split(',') if key.strip()] or [FERNET_KEY]
 
 ALLOWED_HOSTS = []
 AUTH_USER_MODEL = 'core.CustomUser'
@@ -45,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
 ]
 INSTALLED_APPS += ['rest_framework',
@@ -55,12 +61,20 @@ INSTALLED_APPS += ['rest_framework',
 
 
 
+# Ограничение размера страницы, которое клиент может запросить через ?page_size=
+PAGINATION_MAX_PAGE_SIZE = int(os.getenv('PAGINATION_MAX_PAGE_SIZE', 500))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # X-API-KEY интеграций магазина
+        'core.authentication.StoreAPIKeyAuthentication',
     ],
+    # Keyset-пагинация по умолчанию; view может подменить pagination_class
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('PAGINATION_PAGE_SIZE', 50)),
 }
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -68,8 +82,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.QueryMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'tg_shop.urls'
@@ -94,7 +110,11 @@ WSGI_APPLICATION = 'tg_shop.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# DEFAULT_FILE_STORAGE в Django 5.1+ не читается — хранилище задаётся через STORAGES
+STORAGES = {
+    'default': {'BACKEND': os.getenv('FILE_STORAGE_BACKEND', 'storages.backends.s3boto3.S3Boto3Storage')},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
 
 AWS_ACCESS_KEY_ID = os.getenv('MINIO_ID','minioadmin')
 AWS_SECRET_ACCESS_KEY = os.getenv('MINIO_PASSWD','minioadmin')
@@ -104,15 +124,81 @@ AWS_S3_ENDPOINT_URL = os.getenv('MINIO_ENDPOINT','http://localhost:9000')
 AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = None
 AWS_S3_REGION_NAME = 'us-east-1'  # фиктивное значение
-DATABASES = {
-    'default': {
+# Адрес MinIO, доступный клиентам (для подписанных ссылок), если отличается от внутреннего
+AWS_S3_PUBLIC_ENDPOINT_URL = os.getenv('MINIO_PUBLIC_ENDPOINT') or None
+
+# Загрузка фото в S3: пул соединений клиента boto3 и параллельность
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 32))
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', 8))
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+S3_MULTIPART_CONCURRENCY = int(os.getenv('S3_MULTIPART_CONCURRENCY', 4))
+# Прямая загрузка фото по подписанным ссылкам
+IMAGE_UPLOAD_URL_TTL = int(os.getenv('IMAGE_UPLOAD_URL_TTL', 900))
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 20 * 1024 * 1024))
+
+# Соединения с БД, DB_CONNECTION_MODE:
+#   persistent — соединение потока живёт DB_CONN_MAX_AGE секунд и переиспользуется запросами (WSGI);
+#   pool — пул psycopg на процесс, нужен psycopg[pool]. Для ASGI: ORM там работает из разных
+#          потоков, и постоянные соединения не переиспользуются;
+#   none — новое соединение на каждый запрос.
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', 'persistent')
+if DB_CONNECTION_MODE not in ('persistent', 'pool', 'none'):
+    raise ImproperlyConfigured(f"DB_CONNECTION_MODE: неизвестный режим {DB_CONNECTION_MODE!r}")
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+# Сколько запрос ждёт свободное соединение пула, секунд
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
+
+def database(host, port):
+    config = {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.getenv('POSTGRES_DB'),
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
-        'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT'),
+        'HOST': host,
+        'PORT': port,
     }
+    if DB_CONNECTION_MODE == 'persistent':
+        config['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+        # соединение, оборвавшееся между запросами, проверяется и открывается заново
+        config['CONN_HEALTH_CHECKS'] = True
+    elif DB_CONNECTION_MODE == 'pool':
+        config['OPTIONS'] = {'pool': {
+            'min_size': DB_POOL_MIN_SIZE, 'max_size': DB_POOL_MAX_SIZE, 'timeout': DB_POOL_TIMEOUT,
+        }}
+    return config
+
+
+DATABASES = {
+    'default': database(os.getenv('DB_HOST'), os.getenv('DB_PORT')),
+}
+
+# Реплика для чтения: GET/HEAD к эндпоинтам DB_REPLICA_URL_NAMES (core.db.ReplicaRouter).
+# Остальное, в том числе чтение сразу после записи, идёт в default
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **database(os.getenv('DB_REPLICA_HOST'), os.getenv('DB_REPLICA_PORT', os.getenv('DB_PORT'))),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+DB_REPLICA_URL_NAMES = os.getenv(
+    'DB_REPLICA_URL_NAMES', 'conversations,shop_users,search,product-list',
+).split(',')
+# Как часто перепроверять недоступную реплику, секунд; пока она недоступна, чтение идёт в default
+DB_REPLICA_CHECK_INTERVAL = int(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+
+# Общий для всех процессов кэш (контекст товара для ИИ): сбросы из веб-процессов видят воркеры.
+# По умолчанию — таблица core_cache в основной БД (миграция 0026); CACHE_BACKEND/CACHE_LOCATION
+# позволяют подключить, например, django.core.cache.backends.redis.RedisCache
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'core_cache'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000))},
+    },
 }
 
 AUTH_USER_MODEL = 'core.CustomUser'
@@ -158,4 +244,170 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-EXTERNAL_API_SECRET=os.getenv('EXTERNAL_API_SECRET')
\ No newline at end of file
+EXTERNAL_API_SECRET=os.getenv('EXTERNAL_API_SECRET')
+
+# Размер пакета при загрузке вопросов через /api/external/questions/batch/
+EXTERNAL_QUESTIONS_BATCH_SIZE = int(os.getenv('EXTERNAL_QUESTIONS_BATCH_SIZE', 1000))
+
+# Максимальный размер страницы /api/shop_users/
+SHOP_USERS_PAGE_SIZE = int(os.getenv('SHOP_USERS_PAGE_SIZE', 500))
+
+# Процессный кэш «пользователь → магазин»
+STORE_CACHE_TTL = int(os.getenv('STORE_CACHE_TTL', 60))
+STORE_CACHE_SIZE = int(os.getenv('STORE_CACHE_SIZE', 10000))
+
+# Кэш расшифрованных токенов маркетплейсов
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+# Генерация ИИ-ответов (python manage.py run_ai_workers)
+# Обязателен для run_ai_workers, например core.ai.backends.OpenAIAnswerBackend
+AI_ANSWER_BACKEND = os.getenv('AI_ANSWER_BACKEND', '')
+AI_ANSWER_MODEL = os.getenv('AI_ANSWER_MODEL', 'gpt-4o-mini')
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+AI_JOB_BATCH_SIZE = int(os.getenv('AI_JOB_BATCH_SIZE', 50))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', 3))
+# Повтор после ошибки бэкенда: AI_JOB_RETRY_DELAY * 2^(попытка-1), не больше AI_JOB_MAX_BACKOFF, секунд
+AI_JOB_RETRY_DELAY = float(os.getenv('AI_JOB_RETRY_DELAY', 30))
+AI_JOB_MAX_BACKOFF = float(os.getenv('AI_JOB_MAX_BACKOFF', 1800))
+# Через сколько секунд задача в статусе running считается брошенной упавшим воркером
+AI_JOB_LOCK_TIMEOUT = int(os.getenv('AI_JOB_LOCK_TIMEOUT', 300))
+
+# Кэш контекста товара для промптов ИИ (хранится в общем CACHES['default'])
+PRODUCT_CONTEXT_TTL = int(os.getenv('PRODUCT_CONTEXT_TTL', 3600))
+PRODUCT_CONTEXT_QA_LIMIT = int(os.getenv('PRODUCT_CONTEXT_QA_LIMIT', 20))
+PRODUCT_CONTEXT_TEXT_LIMIT = int(os.getenv('PRODUCT_CONTEXT_TEXT_LIMIT', 4000))
+
+# Подсказки ответов на похожие вопросы (MinHash-индекс по магазину, GET /api/questions/{id}/suggested-answer/)
+SIMILARITY_NUM_PERM = int(os.getenv('SIMILARITY_NUM_PERM', 128))
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.6))
+# Как часто индекс процесса догружает изменения из БД, секунд
+SIMILARITY_INDEX_REFRESH = int(os.getenv('SIMILARITY_INDEX_REFRESH', 30))
+# Догрузка перечитывает изменения за столько секунд до последней загруженной строки:
+# updated_at ставится до коммита, и позже закоммиченная строка может оказаться «в прошлом»
+SIMILARITY_INDEX_LAG = int(os.getenv('SIMILARITY_INDEX_LAG', 300))
+# Как часто индекс загружается заново (убираются удалённые вопросы и результаты rebuild_index), секунд
+SIMILARITY_INDEX_RELOAD = int(os.getenv('SIMILARITY_INDEX_RELOAD', 900))
+
+# Метрики SQL/сериализации по запросам (Server-Timing и /api/_metrics)
+# Доля запросов, для которых собираются метрики: 0 — выключено, 1 — все
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))
+# Токен для сборщика Prometheus (заголовок X-METRICS-TOKEN); staff-пользователям доступно и без него
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# С какого числа повторов одного запроса писать предупреждение о N+1
+METRICS_DUPLICATE_THRESHOLD = int(os.getenv('METRICS_DUPLICATE_THRESHOLD', 5))
+
+# Превью фотографий товаров (python manage.py run_image_workers)
+IMAGE_RENDITION_WIDTHS = [int(w) for w in os.getenv('IMAGE_RENDITION_WIDTHS', '320,640,1280').split(',')]
+IMAGE_RENDITION_FORMATS = os.getenv('IMAGE_RENDITION_FORMATS', 'avif,webp').split(',')
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 80))
+IMAGE_AVIF_QUALITY = int(os.getenv('IMAGE_AVIF_QUALITY', 55))
+IMAGE_JOB_BATCH_SIZE = int(os.getenv('IMAGE_JOB_BATCH_SIZE', 20))
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv('IMAGE_JOB_MAX_ATTEMPTS', 3))
+IMAGE_JOB_LOCK_TIMEOUT = int(os.getenv('IMAGE_JOB_LOCK_TIMEOUT', 300))
+
+# Импорт/экспорт каталога (POST /api/products/import/, GET /api/products/export/)
+CATALOG_IMPORT_CHUNK_SIZE = int(os.getenv('CATALOG_IMPORT_CHUNK_SIZE', 2000))
+CATALOG_IMPORT_MAX_ERRORS = int(os.getenv('CATALOG_IMPORT_MAX_ERRORS', 1000))
+CATALOG_EXPORT_CHUNK_SIZE = int(os.getenv('CATALOG_EXPORT_CHUNK_SIZE', 2000))
+# Таймаут скачивания фото по source_url, секунд
+IMAGE_FETCH_TIMEOUT = int(os.getenv('IMAGE_FETCH_TIMEOUT', 15))
+
+# Поиск (GET /api/search/)
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', 100))
+# Сколько совпадений максимум ранжируется на запрос — ограничивает время для частых слов
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', 1000))
+
+# Фильтры по характеристикам товаров (?spec.<ключ>=...)
+# Как часто счётчики ключей сбрасываются в SpecKeyUsage, секунд
+SPEC_USAGE_FLUSH_INTERVAL = int(os.getenv('SPEC_USAGE_FLUSH_INTERVAL', 30))
+SPEC_PROMOTED_CACHE_TTL = int(os.getenv('SPEC_PROMOTED_CACHE_TTL', 60))
+# promote_spec_keys по умолчанию: сколько самых частых ключей и с какого числа фильтров
+SPEC_PROMOTE_TOP = int(os.getenv('SPEC_PROMOTE_TOP', 5))
+SPEC_PROMOTE_MIN_COUNT = int(os.getenv('SPEC_PROMOTE_MIN_COUNT', 100))
+
+# SSE-поток новых сообщений (GET /api/stream/messages/, только под ASGI)
+# Интервал комментария-пинга в простаивающем потоке, секунд
+REALTIME_HEARTBEAT = int(os.getenv('REALTIME_HEARTBEAT', 15))
+# Очередь подписчика; при переполнении пропущенное дочитывается из БД
+REALTIME_QUEUE_SIZE = int(os.getenv('REALTIME_QUEUE_SIZE', 1000))
+# Сколько пропущенных сообщений дочитывается по Last-Event-ID; больше — событие reset
+REALTIME_REPLAY_LIMIT = int(os.getenv('REALTIME_REPLAY_LIMIT', 1000))
+# Пауза перед переподключением LISTEN, секунд (удваивается до максимума)
+REALTIME_RECONNECT_DELAY = float(os.getenv('REALTIME_RECONNECT_DELAY', 0.5))
+REALTIME_RECONNECT_MAX_DELAY = float(os.getenv('REALTIME_RECONNECT_MAX_DELAY', 30))
+
+# async-версии /api/external/questions/ и /api/conversations/ (async ORM) — включать под ASGI
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+
+# Синхронизация вопросов с маркетплейсами (manage.py sync_marketplaces, core.sync)
+SYNC_ADAPTERS = {
+    'ozon': 'core.sync.adapters.OzonAdapter',
+    'wildberries': 'core.sync.adapters.WildberriesAdapter',
+    'yandex_market': 'core.sync.adapters.YandexMarketAdapter',
+}
+# Переопределение адресов API, например фейкового маркетплейса: '{"ozon": "http://127.0.0.1:9000"}'
+SYNC_API_URLS = json.loads(os.getenv('SYNC_API_URLS', '{}'))
+# Пауза между проходами по магазину, секунд
+SYNC_POLL_INTERVAL = float(os.getenv('SYNC_POLL_INTERVAL', 60))
+# Запросов в секунду к маркетплейсу со всего процесса (0 — без ограничения)
+SYNC_RATE_LIMITS = {
+    'ozon': float(os.getenv('SYNC_OZON_RATE', 20)),
+    'wildberries': float(os.getenv('SYNC_WILDBERRIES_RATE', 3)),
+    'yandex_market': float(os.getenv('SYNC_YANDEX_MARKET_RATE', 10)),
+}
+# Соединений в пуле HTTP-клиента маркетплейса
+SYNC_MAX_CONNECTIONS = int(os.getenv('SYNC_MAX_CONNECTIONS', 20))
+SYNC_HTTP_TIMEOUT = float(os.getenv('SYNC_HTTP_TIMEOUT', 30))
+# Сколько вопросов разных магазинов записывается в БД одной транзакцией
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 500))
+# Как часто перечитывать токены (новые и удалённые магазины), секунд
+SYNC_RELOAD_INTERVAL = float(os.getenv('SYNC_RELOAD_INTERVAL', 300))
+# Максимальная пауза после ошибок и для отклонённых токенов, секунд
+SYNC_MAX_BACKOFF = float(os.getenv('SYNC_MAX_BACKOFF', 900))
+
+# Отправка ответов на маркетплейсы (manage.py run_answer_delivery, очередь AnswerDelivery)
+# Запросов в секунду к маркетплейсу со всего процесса (0 — без ограничения)
+DELIVERY_RATE_LIMITS = {
+    'ozon': float(os.getenv('DELIVERY_OZON_RATE', 10)),
+    'wildberries': float(os.getenv('DELIVERY_WILDBERRIES_RATE', 3)),
+    'yandex_market': float(os.getenv('DELIVERY_YANDEX_MARKET_RATE', 5)),
+}
+# Сколько ответов забирается из очереди за раз и сколько может отправляться одновременно — на маркетплейс
+DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', 100))
+DELIVERY_MAX_IN_FLIGHT = int(os.getenv('DELIVERY_MAX_IN_FLIGHT', 200))
+# Повтор после ошибки: DELIVERY_RETRY_DELAY * 2^(попытка-1), не больше DELIVERY_MAX_BACKOFF, секунд
+DELIVERY_RETRY_DELAY = float(os.getenv('DELIVERY_RETRY_DELAY', 30))
+DELIVERY_MAX_BACKOFF = float(os.getenv('DELIVERY_MAX_BACKOFF', 3600))
+# После стольких неудачных попыток ответ уходит в dead
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', 8))
+# Ответ в статусе sending дольше этого считается брошенным упавшим воркером, секунд
+DELIVERY_LOCK_TIMEOUT = int(os.getenv('DELIVERY_LOCK_TIMEOUT', 300))
+
+# Идемпотентность POST /api/external/questions/ (Idempotency-Key, question_id маркетплейса):
+# сколько секунд и записей процесс помнит загруженные ключи, не обращаясь к БД
+IDEMPOTENCY_CACHE_TTL = int(os.getenv('IDEMPOTENCY_CACHE_TTL', 600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 100_000))
+
+# Ограничение частоты запросов к API (core.throttling): throttle_scope view → (запросов в секунду, запас),
+# отдельно на каждого клиента (пользователь или X-API-SECRET) и магазин; 0 запросов — без ограничения
+API_RATE_LIMITS = {
+    'external-questions': (float(os.getenv('API_RATE_EXTERNAL_QUESTIONS', 50)),
+                           float(os.getenv('API_BURST_EXTERNAL_QUESTIONS', 200))),
+    'external-questions-batch': (float(os.getenv('API_RATE_EXTERNAL_QUESTIONS_BATCH', 2)),
+                                 float(os.getenv('API_BURST_EXTERNAL_QUESTIONS_BATCH', 20))),
+    'messages': (float(os.getenv('API_RATE_MESSAGES', 20)), float(os.getenv('API_BURST_MESSAGES', 100))),
+}
+# memory — корзины в памяти процесса (лимит на каждый воркер), database — общие в таблице RateLimitBucket
+API_RATE_LIMIT_BACKEND = os.getenv('API_RATE_LIMIT_BACKEND', 'memory')
+# Адаптивный режим: при задержке БД выше API_SHED_LATENCY_MS (0 — выключен) запрос с X-API-SECRET
+# стоит 1/API_SHED_FACTOR жетона. Задержка замеряется не чаще раза в API_SHED_CHECK_INTERVAL секунд
+API_SHED_LATENCY_MS = float(os.getenv('API_SHED_LATENCY_MS', 0))
+API_SHED_FACTOR = float(os.getenv('API_SHED_FACTOR', 0.25))
+API_SHED_CHECK_INTERVAL = float(os.getenv('API_SHED_CHECK_INTERVAL', 1))
+
+# Ключи интеграций магазинов (X-API-KEY): sha256 ключа → магазин в процессном кэше.
+# Отозванный ключ перестаёт действовать в остальных процессах не позже чем через API_KEY_CACHE_TTL секунд
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', 5))
+API_KEY_CACHE_SIZE = int(os.getenv('API_KEY_CACHE_SIZE', 10000))